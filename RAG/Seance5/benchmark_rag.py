@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+"""
+Benchmark hors ligne du systeme RAG - Seance 5
+Meme parcours que validation_finale.py (initialisation puis questions) mais sans cle API ni
+base de donnees, donc executable en CI: LLM simule deterministe, embeddings par hachage,
+backend NumPy embarque et corpus synthetique genere en flux (jusqu'a 1M chunks).
+
+Mesures: debit d'ingestion (et duree par etape), latence p50/p95/p99 de la recherche seule
+et de la requete complete (par etape, via les traces), recall@k contre une recherche exacte,
+taux de chunk source retrouve, octets d'index parcourus par requete, RSS max. Resultats en JSON; --compare signale les
+regressions par rapport a un fichier de reference (code de sortie 1).
+
+Exemples:
+    python benchmark_rag.py --chunks 20000 --queries 200 --output bench.json
+    python benchmark_rag.py --chunks 20000 --queries 200 --compare bench_main.json --tolerance 0.15
+    python benchmark_rag.py --chunks 20000 --queries 200 --quantization int8
+    python benchmark_rag.py --corpus repo --queries 50
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+SYNTHETIC_QUESTION_TEMPLATE = "Que disent les documents sur {} ?"
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+CONSONANTS = "bdfgkmnprtvz"
+VOWELS = "aeiou"
+
+# Metriques comparees par --compare: (chemin dans le JSON, sens de l'amelioration)
+COMPARED_METRICS = [
+    ('ingestion.chunks_per_second', 'higher'),
+    ('retrieval.latency_ms.p50', 'lower'),
+    ('retrieval.latency_ms.p95', 'lower'),
+    ('retrieval.recall_at_k', 'higher'),
+    ('retrieval.hit_rate_at_k', 'higher'),
+    ('query.latency_ms.p50', 'lower'),
+    ('query.latency_ms.p95', 'lower'),
+    ('query.latency_ms.p99', 'lower'),
+    ('batch.questions_per_second', 'higher'),
+    ('retrieval.index.scan_bytes', 'lower'),
+    ('memory.peak_rss_mb', 'lower')
+]
+
+
+class HashingEmbeddings:
+    """Embeddings deterministes sans modele: sac de mots hache (crc32) sur `dimension`
+    composantes signees. Meme interface que HuggingFaceEmbeddings."""
+
+    def __init__(self, model_name: str = 'hashing', dimension: int = 384, **kwargs):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.buckets = {}
+
+    def _bucket(self, word: str) -> Tuple[int, float]:
+        bucket = self.buckets.get(word)
+        if bucket is None:
+            h = zlib.crc32(word.encode('utf-8'))
+            bucket = (h % self.dimension, 1.0 if (h >> 16) & 1 else -1.0)
+            if len(self.buckets) < 1_000_000:
+                self.buckets[word] = bucket
+        return bucket
+
+    def _embed(self, text: str) -> List[float]:
+        words = WORD_PATTERN.findall(text.lower())
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        if words:
+            buckets = [self._bucket(word) for word in words]
+            np.add.at(vector, [b[0] for b in buckets], [b[1] for b in buckets])
+        norm = float(np.linalg.norm(vector))
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class StubLLM:
+    """LLM simule: reponse deterministe tiree du contexte, latence fixe optionnelle"""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_s = latency_ms / 1000
+        self.calls = 0
+
+    def _answer(self, prompt: str) -> str:
+        self.calls += 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        start = prompt.find("Contenu: ")
+        excerpt = prompt[start + 9:start + 209] if start >= 0 else prompt[:200]
+        return f"Reponse simulee d'apres les documents: {excerpt.strip()}"
+
+    def call_api(self, prompt: str, usage: Optional[Dict[str, Any]] = None) -> str:
+        return self._answer(prompt)
+
+    def call_api_stream(self, prompt: str, usage: Optional[Dict[str, Any]] = None):
+        yield self._answer(prompt)
+
+
+# ----------------------------------------------------------------------
+# Corpus synthetique
+# ----------------------------------------------------------------------
+def build_vocabulary(size: int, rng: random.Random, excluded: List[str]) -> List[str]:
+    """Pseudo-mots de 2 a 4 syllabes, sans les marqueurs de reference contextuelle
+    (une question synthetique ne doit jamais passer en mode conversationnel)"""
+    words = set()
+    while len(words) < size:
+        word = ''.join(rng.choice(CONSONANTS) + rng.choice(VOWELS) for _ in range(rng.randint(2, 4)))
+        if not any(marker in word for marker in excluded):
+            words.add(word)
+    return sorted(words)
+
+
+def generate_synthetic_corpus(base_dir: Path, chunks: int, chunk_size: int, seed: int, queries: int,
+                              paragraphs_per_file: int = 500, topics: int = 200,
+                              excluded: Optional[List[str]] = None) -> List[Dict[str, str]]:
+    """Ecrire ~`chunks` paragraphes (un chunk chacun) dans base_dir/Corpus/Corpus documentaire/*.md.
+
+    Chaque paragraphe parle d'un theme (vocabulaire propre + mots communs). Renvoie
+    `queries` questions construites a partir de paragraphes tires au hasard, avec la
+    signature du paragraphe d'origine pour mesurer le taux de chunk source retrouve.
+    """
+    rng = random.Random(seed)
+    vocabulary = build_vocabulary(max(2000, topics * 60), rng, excluded or [])
+    common = vocabulary[:200]
+    topic_words = [rng.sample(vocabulary[200:], 40) for _ in range(topics)]
+    target_chars = int(chunk_size * 0.7)
+
+    corpus_dir = base_dir / "Corpus" / "Corpus documentaire"
+    corpus_dir.mkdir(parents=True, exist_ok=True)
+    sampled = set(rng.sample(range(chunks), min(queries, chunks)))
+    questions = []
+
+    handle = None
+    for index in range(chunks):
+        if index % paragraphs_per_file == 0:
+            if handle:
+                handle.close()
+            handle = open(corpus_dir / f"synthetic_{index // paragraphs_per_file:05d}.md", 'w', encoding='utf-8')
+            handle.write(f"# Document synthetique {index // paragraphs_per_file}\n\n")
+
+        words_of_topic = topic_words[rng.randrange(topics)]
+        words = []
+        length = 0
+        while length < target_chars:
+            word = rng.choice(words_of_topic) if rng.random() < 0.6 else rng.choice(common)
+            words.append(word)
+            length += len(word) + 1
+        paragraph = ' '.join(words) + '.'
+        handle.write(paragraph + "\n\n")
+
+        if index in sampled:
+            # Signature: les 6 premiers mots, quasi unique a l'echelle du corpus
+            questions.append({
+                'question': SYNTHETIC_QUESTION_TEMPLATE.format(' '.join(rng.sample(words, 4))),
+                'signature': ' '.join(words[:6])
+            })
+    if handle:
+        handle.close()
+    rng.shuffle(questions)
+    return questions
+
+
+# ----------------------------------------------------------------------
+# Mesures
+# ----------------------------------------------------------------------
+def percentiles_ms(samples: List[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {'p50': None, 'p95': None, 'p99': None, 'mean': None, 'max': None}
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        'p50': round(float(np.percentile(values, 50)), 3),
+        'p95': round(float(np.percentile(values, 95)), 3),
+        'p99': round(float(np.percentile(values, 99)), 3),
+        'mean': round(float(values.mean()), 3),
+        'max': round(float(values.max()), 3)
+    }
+
+
+def peak_rss_mb() -> float:
+    """RSS max du processus (ru_maxrss: Ko sous Linux, octets sous macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def current_rss_mb() -> Optional[float]:
+    """RSS courant (Linux: /proc/self/statm), None ailleurs"""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(resident_pages * resource.getpagesize() / (1024 * 1024), 1)
+
+
+def exact_top_k(vectors: np.ndarray, query: np.ndarray, k: int, block_rows: int = 262144) -> np.ndarray:
+    """Reference: top-k exact en float32 par blocs de lignes (memoire bornee a 1M chunks)"""
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    best_rows = np.empty(0, dtype=np.int64)
+    best_scores = np.empty(0, dtype=np.float32)
+    for start in range(0, len(vectors), block_rows):
+        scores = np.asarray(vectors[start:start + block_rows], dtype=np.float32) @ query
+        best_rows = np.concatenate([best_rows, np.arange(start, start + len(scores))])
+        best_scores = np.concatenate([best_scores, scores])
+        if len(best_scores) > k:
+            keep = np.argpartition(-best_scores, k - 1)[:k]
+            best_rows, best_scores = best_rows[keep], best_scores[keep]
+    return best_rows[np.argsort(-best_scores)]
+
+
+def measure_retrieval(rag, questions: List[Dict[str, str]], k: int) -> Dict[str, Any]:
+    """Latence de search_documents (embedding + recherche + fusion BM25), recall@k de
+    l'index vectoriel contre la recherche exacte, chunk source dans le top-k.
+
+    La reference exacte lit toute la matrice float32: elle est calculee apres le releve
+    du RSS de recherche pour ne pas masquer le gain des codes quantifies."""
+    store = rag.vector_store
+    latencies = []
+    recalls = []
+    searched = []
+    hits = 0
+    judged = 0
+    for item in questions:
+        start = time.perf_counter()
+        results = rag.search_documents(item['question'], k=k)
+        latencies.append(time.perf_counter() - start)
+
+        if item.get('signature'):
+            judged += 1
+            hits += any(item['signature'] in result['content'] for result in results)
+
+        query_vector = np.asarray(rag._embed_question(item['question']), dtype=np.float32)
+        rows, _ = store.search_vectors(query_vector, k)
+        searched.append((query_vector, rows[0]))
+    search_rss_mb = current_rss_mb()
+
+    for query_vector, rows in searched:
+        exact = exact_top_k(store.vectors, query_vector, k)
+        if len(exact):
+            recalls.append(len(set(rows.tolist()) & set(exact.tolist())) / len(exact))
+
+    return {
+        'k': k,
+        'queries': len(questions),
+        'latency_ms': percentiles_ms(latencies),
+        'recall_at_k': round(float(np.mean(recalls)), 4) if recalls else None,
+        'hit_rate_at_k': round(hits / judged, 4) if judged else None,
+        'index': store.get_stats(),
+        'search_rss_mb': search_rss_mb
+    }
+
+
+def measure_queries(rag, questions: List[Dict[str, str]]) -> Dict[str, Any]:
+    """Requete complete rag.query (LLM simule): latence totale et par etape"""
+    latencies = []
+    stages: Dict[str, List[float]] = {}
+    for item in questions:
+        start = time.perf_counter()
+        result = rag.query(item['question'])
+        latencies.append(time.perf_counter() - start)
+        for stage, duration_ms in (result.get('timings') or {}).items():
+            if stage != 'total':
+                stages.setdefault(stage, []).append(duration_ms / 1000)
+    return {
+        'queries': len(questions),
+        'latency_ms': percentiles_ms(latencies),
+        'stages_ms': {stage: percentiles_ms(values) for stage, values in sorted(stages.items())}
+    }
+
+
+def measure_batch(rag, questions: List[Dict[str, str]]) -> Dict[str, Any]:
+    texts = [item['question'] for item in questions]
+    start = time.perf_counter()
+    rag.query_many(texts)
+    elapsed = time.perf_counter() - start
+    return {
+        'questions': len(texts),
+        'elapsed_s': round(elapsed, 3),
+        'questions_per_second': round(len(texts) / elapsed, 2) if elapsed else None
+    }
+
+
+# ----------------------------------------------------------------------
+# Comparaison entre commits
+# ----------------------------------------------------------------------
+def get_metric(report: Dict[str, Any], path: str):
+    value = report
+    for key in path.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare_reports(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """Ecarts relatifs par metrique; `regression` si pire que la reference de plus de `tolerance`"""
+    rows = []
+    for path, better in COMPARED_METRICS:
+        new, old = get_metric(current, path), get_metric(baseline, path)
+        if new is None or old is None:
+            continue
+        change = (new - old) / abs(old) if old else 0.0
+        worse = -change if better == 'higher' else change
+        rows.append({
+            'metric': path,
+            'baseline': old,
+            'current': new,
+            'change': round(change, 4),
+            'regression': worse > tolerance
+        })
+    return rows
+
+
+def print_comparison(rows: List[Dict[str, Any]], baseline_label: str):
+    print(f"\n[BENCH] Comparaison avec {baseline_label}")
+    for row in rows:
+        flag = "REGRESSION" if row['regression'] else "ok"
+        print(f"   {row['metric']:<32} {row['baseline']:>12} -> {row['current']:>12} "
+              f"({row['change'] * 100:+.1f}%) {flag}")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).parent,
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# ----------------------------------------------------------------------
+# Execution
+# ----------------------------------------------------------------------
+def configure_environment(args, work_dir: Path, corpus_base_dir: Optional[Path]):
+    """Variables lues par PostgreSQLRAGSystem: tout en local dans work_dir"""
+    os.environ['RAG_VECTOR_BACKEND'] = 'numpy'
+    os.environ['RAG_INDEX_DIR'] = str(work_dir / 'index')
+    os.environ['RAG_SESSIONS_DIR'] = str(work_dir / 'sessions')
+    os.environ['RAG_SEMANTIC_CACHE'] = 'false'
+    os.environ['RAG_TRACING'] = 'true'
+    os.environ['RAG_TRACE_FILE'] = ''
+    os.environ['RAG_EMBEDDING_CACHE'] = 'true' if args.embedding_cache else 'false'
+    os.environ['RAG_HYBRID_SEARCH'] = 'false' if args.no_hybrid else 'true'
+    os.environ['RAG_INGEST_WORKERS'] = '1'
+    os.environ['RAG_VECTOR_QUANTIZATION'] = args.quantization
+    os.environ['CHUNK_SIZE'] = str(args.chunk_size)
+    os.environ.setdefault('CODESTRAL_API_KEY', 'benchmark')
+    if corpus_base_dir is not None:
+        os.environ['RAG_CORPUS_BASE_DIR'] = str(corpus_base_dir)
+
+
+def run_benchmark(args) -> Dict[str, Any]:
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix='rag_bench_'))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    synthetic = args.corpus == 'synthetic'
+    configure_environment(args, work_dir, work_dir / 'corpus' if synthetic else None)
+
+    # Import apres la configuration: rag_chain lit .env et les variables au chargement
+    import rag_chain
+    import tracing
+    rag_chain.HuggingFaceEmbeddings = lambda model_name=None, **kwargs: HashingEmbeddings(
+        model_name or 'hashing', dimension=args.dimension
+    )
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+        }
+    }
+
+    try:
+        if synthetic:
+            print(f"[BENCH] Generation du corpus synthetique: {args.chunks} chunks")
+            start = time.perf_counter()
+            questions = generate_synthetic_corpus(
+                work_dir / 'corpus', args.chunks, args.chunk_size, args.seed, args.queries,
+                excluded=rag_chain.CONTEXT_INDICATORS
+            )
+            report['corpus'] = {'kind': 'synthetic', 'chunks_requested': args.chunks,
+                                'generation_s': round(time.perf_counter() - start, 2)}
+        else:
+            from validation_finale import QUESTIONS_GENERIQUES
+            questions = [{'question': question} for question in QUESTIONS_GENERIQUES]
+            questions = (questions * (args.queries // len(questions) + 1))[:args.queries]
+            report['corpus'] = {'kind': 'repo'}
+
+        # Ingestion: initialisation complete (chargement du modele simule + indexation)
+        print("[BENCH] Indexation...")
+        tracer = tracing.Tracer(enabled=True)
+        start = time.perf_counter()
+        with tracer.trace('benchmark.ingestion') as trace:
+            rag = rag_chain.PostgreSQLRAGSystem(session_name='benchmark')
+        elapsed = time.perf_counter() - start
+        indexed = len(rag.vector_store) if rag.vector_store is not None else 0
+        stub = StubLLM(args.llm_latency_ms)
+        rag.call_api = stub.call_api
+        rag.call_api_stream = stub.call_api_stream
+        report['ingestion'] = {
+            'chunks': indexed,
+            'elapsed_s': round(elapsed, 3),
+            'chunks_per_second': round(indexed / elapsed, 1) if elapsed else None,
+            'stages_ms': trace.timings() if trace is not None else {},
+            'peak_rss_mb': peak_rss_mb()
+        }
+        print(f"[BENCH] {indexed} chunks indexes en {elapsed:.2f}s")
+
+        warmup, measured = questions[:args.warmup], questions[args.warmup:] or questions
+        for item in warmup:
+            rag.search_documents(item['question'], k=args.k)
+
+        print(f"[BENCH] Recherche: {len(measured)} questions")
+        report['retrieval'] = measure_retrieval(rag, measured, args.k)
+        print(f"[BENCH] Requetes completes (LLM simule, {args.llm_latency_ms} ms)")
+        report['query'] = measure_queries(rag, measured)
+        report['batch'] = measure_batch(rag, measured)
+        report['llm'] = {'stub_latency_ms': args.llm_latency_ms, 'calls': stub.calls}
+        report['memory'] = {'peak_rss_mb': peak_rss_mb()}
+        if rag.query_embeddings is not None:
+            report['query_embedding_cache'] = rag.query_embeddings.get_stats()
+        rag.session_store.flush()
+    finally:
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def print_report(report: Dict[str, Any]):
+    print("\n[BENCH] Resultats")
+    ingestion = report['ingestion']
+    print(f"   Ingestion: {ingestion['chunks']} chunks, {ingestion['chunks_per_second']} chunks/s "
+          f"({ingestion['elapsed_s']}s)")
+    retrieval = report['retrieval']
+    print(f"   Recherche: p50 {retrieval['latency_ms']['p50']} ms, p95 {retrieval['latency_ms']['p95']} ms, "
+          f"p99 {retrieval['latency_ms']['p99']} ms, recall@{retrieval['k']} {retrieval['recall_at_k']}, "
+          f"chunk source retrouve {retrieval['hit_rate_at_k']}")
+    query = report['query']
+    print(f"   Requete complete: p50 {query['latency_ms']['p50']} ms, p95 {query['latency_ms']['p95']} ms, "
+          f"p99 {query['latency_ms']['p99']} ms")
+    for stage, values in query['stages_ms'].items():
+        print(f"      {stage:<16} p50 {values['p50']} ms, p95 {values['p95']} ms")
+    index = retrieval['index']
+    print(f"   Index: quantification {index['quantization']}, {index['scan_bytes'] / 1e6:.1f} Mo parcourus par "
+          f"requete ({index['matrix_bytes'] / 1e6:.1f} Mo en float32, x{index['compression_ratio']}), "
+          f"RSS apres recherche {retrieval['search_rss_mb']} Mo")
+    print(f"   Lot: {report['batch']['questions_per_second']} questions/s")
+    print(f"   RSS max: {report['memory']['peak_rss_mb']} Mo")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hors ligne du systeme RAG (sans API ni PostgreSQL)")
+    parser.add_argument('--corpus', choices=('synthetic', 'repo'), default='synthetic',
+                        help='Corpus synthetique genere ou corpus du depot (questions de validation_finale.py)')
+    parser.add_argument('--chunks', type=int, default=10000, help='Taille du corpus synthetique (jusqu\'a 1M)')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='CHUNK_SIZE du decoupage')
+    parser.add_argument('--dimension', type=int, default=384, help='Dimension des embeddings simules')
+    parser.add_argument('--queries', type=int, default=200, help='Nombre de questions')
+    parser.add_argument('--warmup', type=int, default=10, help='Questions de chauffe (non mesurees)')
+    parser.add_argument('--k', type=int, default=5, help='Top-k de la recherche')
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0, help='Latence simulee du LLM')
+    parser.add_argument('--quantization', choices=('none', 'int8', 'binary'), default='none',
+                        help='Codes quantifies de l\'index numpy (re-classement float32)')
+    parser.add_argument('--no-hybrid', action='store_true', help='Desactiver la fusion BM25')
+    parser.add_argument('--embedding-cache', action='store_true', help='Activer le cache disque des embeddings')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--work-dir', help='Dossier de travail conserve (sinon dossier temporaire supprime)')
+    parser.add_argument('--keep', action='store_true', help='Conserver le dossier temporaire')
+    parser.add_argument('--output', help='Ecrire les resultats en JSON')
+    parser.add_argument('--compare', help='JSON de reference (autre commit) a comparer')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='Degradation relative toleree avant de signaler une regression')
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print_report(report)
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows = compare_reports(report, baseline, args.tolerance)
+        report['comparison'] = {'baseline': baseline.get('meta', {}).get('revision'),
+                                'tolerance': args.tolerance, 'metrics': rows}
+        print_comparison(rows, args.compare)
+        if any(row['regression'] for row in rows):
+            exit_code = 1
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n[BENCH] Resultats ecrits dans {args.output}")
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
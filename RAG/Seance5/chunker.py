@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Decoupage en flux des fichiers du corpus - Seance 5
+Lecture incrementale, coupe aux titres markdown puis aux paragraphes, chemin des titres
+dans les metadonnees; le recouvrement n'est ajoute que si un paragraphe est coupe
+"""
+
+import re
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple
+
+READ_SIZE = 1 << 16  # caracteres lus au plus par ligne (lignes geantes decoupees)
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+FENCE_PATTERN = re.compile(r"^(```|~~~)")
+SENTENCE_END_PATTERN = re.compile(r"(?<=[.!?…])\s+")
+HEADING_SEPARATOR = " > "
+
+
+class StreamingChunker:
+    """Chunks d'au plus `chunk_size` caracteres, produits au fil de la lecture.
+
+    - un titre markdown (# a ######) ferme le chunk en cours et met a jour le chemin
+      des titres (ex. "Gymnastique en France > Disciplines"), le titre ouvre le chunk suivant
+    - les paragraphes (lignes vides) sont regroupes tant que le chunk a de la place
+    - un paragraphe trop long est coupe aux phrases, avec `chunk_overlap` caracteres de
+      recouvrement entre ses morceaux (pas de recouvrement entre paragraphes ou sections)
+    - les titres en attente comptent dans la taille du chunk de leur premier paragraphe;
+      une ligne de titre de plus d'un demi-chunk est traitee comme du texte
+    - la memoire reste bornee (~ quelques chunks) quelle que soit la taille du fichier
+    """
+
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200, read_size: int = READ_SIZE):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) doit etre inferieur a chunk_size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.read_size = read_size
+        # Titres en attente bornes a un demi-chunk: il reste toujours la place d'un paragraphe
+        self.max_heading = chunk_size // 2 - 2
+
+    # ------------------------------------------------------------------
+    # Lecture
+    # ------------------------------------------------------------------
+    def read_lines(self, file_path: Path) -> Iterator[str]:
+        """Lignes du fichier (utf-8, octets invalides remplaces), jamais plus de `read_size` caracteres"""
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            yield from iter(lambda: f.readline(self.read_size), '')
+
+    def split_file(self, file_path: Path) -> Iterator[Tuple[str, str]]:
+        """(texte, chemin des titres) de chaque chunk du fichier"""
+        return self.split_lines(self.read_lines(file_path))
+
+    # ------------------------------------------------------------------
+    # Blocs: titres et paragraphes
+    # ------------------------------------------------------------------
+    def _iter_blocks(self, lines: Iterable[str]) -> Iterator[Tuple[Tuple[str, ...], str, bool]]:
+        """(chemin des titres, texte, est_un_titre); les paragraphes sans fin sont emis par morceaux"""
+        headings: List[Tuple[int, str]] = []
+        paragraph: List[str] = []
+        size = 0
+        in_fence = False
+        path = ()
+
+        for line in lines:
+            line = line.rstrip('\r\n')
+            stripped = line.strip()
+            if FENCE_PATTERN.match(stripped):
+                in_fence = not in_fence
+            elif not in_fence:
+                match = HEADING_PATTERN.match(stripped) if len(stripped) <= self.max_heading else None
+                if match:
+                    if paragraph:
+                        yield path, "\n".join(paragraph), False
+                        paragraph, size = [], 0
+                    level = len(match.group(1))
+                    headings = [item for item in headings if item[0] < level] + [(level, match.group(2))]
+                    path = tuple(title for _, title in headings)
+                    yield path, stripped, True
+                    continue
+                if not stripped:
+                    if paragraph:
+                        yield path, "\n".join(paragraph), False
+                        paragraph, size = [], 0
+                    continue
+
+            paragraph.append(line)
+            size += len(line) + 1
+            if size >= 4 * self.chunk_size:
+                # Paragraphe sans ligne vide (texte brut, code): emis par morceaux
+                yield path, "\n".join(paragraph), False
+                paragraph, size = [], 0
+
+        if paragraph:
+            yield path, "\n".join(paragraph), False
+
+    # ------------------------------------------------------------------
+    # Paragraphes trop longs
+    # ------------------------------------------------------------------
+    def _split_long(self, text: str, limit: int = 0) -> List[str]:
+        """Morceaux <= limit (chunk_size par defaut) coupes aux phrases, `chunk_overlap`
+        caracteres repris entre morceaux (au plus la moitie d'un morceau reduit)"""
+        limit = limit or self.chunk_size
+        if len(text) <= limit:
+            return [text]
+        overlap = self.chunk_overlap if limit >= self.chunk_size else min(self.chunk_overlap, limit // 2)
+        sentences = []
+        for sentence in SENTENCE_END_PATTERN.split(text):
+            if len(sentence) <= limit:
+                sentences.append(sentence)
+            else:
+                sentences.extend(self._split_words(sentence, limit, overlap))
+
+        pieces = []
+        current: List[str] = []
+        length = 0
+        for sentence in sentences:
+            if current and length + 1 + len(sentence) > limit:
+                pieces.append(" ".join(current))
+                # Dernieres phrases reprises dans le morceau suivant (recouvrement)
+                repeated: List[str] = []
+                repeated_length = 0
+                for previous in reversed(current):
+                    if repeated_length + len(previous) + 1 > overlap \
+                            or repeated_length + len(previous) + 1 + len(sentence) > limit:
+                        break
+                    repeated.insert(0, previous)
+                    repeated_length += len(previous) + 1
+                current, length = repeated, max(repeated_length - 1, 0)
+            current.append(sentence)
+            length += len(sentence) + (1 if length else 0)
+        if current:
+            pieces.append(" ".join(current))
+        return pieces
+
+    def _split_words(self, text: str, limit: int, overlap: int) -> List[str]:
+        """Phrase plus longue qu'un morceau: fenetres aux espaces (coupe franche sans espace)"""
+        pieces = []
+        step = limit - overlap
+        start = 0
+        while start < len(text):
+            end = min(start + limit, len(text))
+            if end < len(text):
+                space = text.rfind(' ', start + step // 2, end)
+                end = space if space > start else end
+            pieces.append(text[start:end].strip())
+            if end >= len(text):
+                break
+            start = max(end - overlap, start + 1)
+            space = text.find(' ', start, end)
+            start = space + 1 if space != -1 else start
+        return [piece for piece in pieces if piece]
+
+    # ------------------------------------------------------------------
+    # Assemblage
+    # ------------------------------------------------------------------
+    def split_lines(self, lines: Iterable[str]) -> Iterator[Tuple[str, str]]:
+        buffer: List[str] = []
+        size = 0
+        has_body = False
+        path = ()
+
+        for block_path, text, is_heading in self._iter_blocks(lines):
+            if is_heading:
+                # Titres consecutifs regroupes avec le premier paragraphe qui les suit
+                # (au plus un demi-chunk de titres: au-dela, les premiers partent seuls)
+                if has_body or size + len(text) + 2 > self.max_heading + 2:
+                    yield "\n\n".join(buffer), HEADING_SEPARATOR.join(path)
+                    buffer, size, has_body = [], 0, False
+                buffer.append(text)
+                size += len(text) + 2
+                path = block_path
+                continue
+
+            # Premier paragraphe apres des titres: decoupe a la place restante dans leur chunk
+            for piece in self._split_long(text, self.chunk_size - size if not has_body and buffer else 0):
+                if has_body and size + len(piece) > self.chunk_size:
+                    yield "\n\n".join(buffer), HEADING_SEPARATOR.join(path)
+                    buffer, size = [], 0
+                buffer.append(piece)
+                size += len(piece) + 2
+                has_body = True
+
+        if buffer:
+            yield "\n\n".join(buffer), HEADING_SEPARATOR.join(path)
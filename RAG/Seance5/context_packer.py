@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Assemblage du contexte sous budget de tokens - Seance 5
+Selection des chunks par score par token, suppression des chevauchements du decoupage,
+coupe aux phrases les plus proches de la question plutot qu'aux 400 premiers caracteres
+"""
+
+import os
+import re
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional
+
+from lexical_index import tokenize
+
+# Tokenizer BPE local si disponible, sinon approximation par expression reguliere
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# Approximation BPE: mots decoupes en morceaux de 4 caracteres, ponctuation = 1 token
+APPROX_TOKEN_PATTERN = re.compile(r"\w{1,4}|[^\w\s]", re.UNICODE)
+SENTENCE_PATTERN = re.compile(r"[^.!?\n]+(?:[.!?]+|\n+|$)")
+MIN_OVERLAP_CHARS = 20
+
+
+class TokenCounter:
+    """Compte de tokens: tiktoken (cl100k_base) ou approximation regex"""
+
+    def __init__(self, encoding_name: str = 'cl100k_base'):
+        self.encoding = None
+        if TIKTOKEN_AVAILABLE:
+            try:
+                self.encoding = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                print(f"[WARNING] Encodage tiktoken {encoding_name} indisponible: {e}")
+        self.name = f"tiktoken:{encoding_name}" if self.encoding is not None else "regex"
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return len(APPROX_TOKEN_PATTERN.findall(text))
+
+
+@dataclass
+class PackedContext:
+    text: str
+    tokens_used: int
+    budget: int
+    docs_used: List[Dict[str, Any]] = field(default_factory=list)
+    docs_dropped: int = 0
+    docs_trimmed: int = 0
+    overlap_chars_removed: int = 0
+    near_duplicates_removed: int = 0
+    tokenizer: str = 'regex'
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'tokens_used': self.tokens_used,
+            'budget': self.budget,
+            'docs_used': len(self.docs_used),
+            'docs_dropped': self.docs_dropped,
+            'docs_trimmed': self.docs_trimmed,
+            'overlap_chars_removed': self.overlap_chars_removed,
+            'near_duplicates_removed': self.near_duplicates_removed,
+            'tokenizer': self.tokenizer
+        }
+
+
+class ContextPacker:
+    """Remplit un budget de tokens avec les passages les plus utiles.
+
+    1. doublons et chevauchements (recouvrement du splitter entre chunks voisins) retires
+    2. chunks choisis par ordre de score / token jusqu'au budget
+    3. un chunk qui ne tient pas est reduit a ses phrases les plus proches de la question
+    4. l'echange precedent (questions contextuelles) a son propre sous-budget
+    """
+
+    def __init__(self, budget_tokens: int = 1200, history_tokens: int = 300, max_overlap_chars: int = 200,
+                 min_chunk_tokens: int = 30, tokenizer: Optional[TokenCounter] = None):
+        self.budget_tokens = max(1, budget_tokens)
+        self.history_tokens = max(0, history_tokens)
+        self.max_overlap_chars = max_overlap_chars
+        self.min_chunk_tokens = min_chunk_tokens
+        self.tokenizer = tokenizer or TokenCounter()
+
+    @classmethod
+    def from_env(cls, chunk_overlap: int = 200) -> 'ContextPacker':
+        return cls(
+            budget_tokens=int(os.getenv('RAG_CONTEXT_TOKEN_BUDGET', '1200')),
+            history_tokens=int(os.getenv('RAG_CONTEXT_HISTORY_TOKENS', '300')),
+            max_overlap_chars=chunk_overlap,
+            tokenizer=TokenCounter(os.getenv('RAG_TOKENIZER_ENCODING', 'cl100k_base'))
+        )
+
+    # ------------------------------------------------------------------
+    # Dedoublonnage
+    # ------------------------------------------------------------------
+    def _overlap(self, left: str, right: str) -> int:
+        """Longueur du plus long suffixe de `left` egal a un prefixe de `right`"""
+        for size in range(min(len(left), len(right), self.max_overlap_chars), MIN_OVERLAP_CHARS - 1, -1):
+            if left.endswith(right[:size]):
+                return size
+        return 0
+
+    def _deduplicate(self, docs: List[Dict[str, Any]]) -> (List[Dict[str, Any]], int):
+        """Retirer doublons et recouvrements (le chunk le mieux classe garde le texte commun)"""
+        kept = []
+        seen_ids = set()
+        removed = 0
+        for doc in docs:
+            chunk_id = (doc.get('metadata') or {}).get('chunk_id') or doc.get('chunk_id')
+            if chunk_id and chunk_id in seen_ids:
+                continue
+            text = doc.get('content') or ''
+            for other in kept:
+                if other['source'] != doc.get('source'):
+                    continue
+                other_text = other['text']
+                if text in other_text:
+                    text = ''
+                    break
+                overlap = self._overlap(other_text, text)
+                if overlap:
+                    text = text[overlap:]
+                    removed += overlap
+                    continue
+                overlap = self._overlap(text, other_text)
+                if overlap:
+                    text = text[:-overlap]
+                    removed += overlap
+            if not text.strip():
+                continue
+            if chunk_id:
+                seen_ids.add(chunk_id)
+            kept.append({'doc': doc, 'source': doc.get('source'), 'text': text.strip()})
+        return kept, removed
+
+    # ------------------------------------------------------------------
+    # Coupe aux phrases utiles
+    # ------------------------------------------------------------------
+    def _trim(self, text: str, question_terms: set, budget: int) -> str:
+        """Phrases les plus proches de la question (ordre d'origine conserve) dans `budget` tokens"""
+        sentences = [sentence.strip() for sentence in SENTENCE_PATTERN.findall(text) if sentence.strip()]
+        if not sentences:
+            return ''
+        ranked = sorted(
+            range(len(sentences)),
+            key=lambda i: (-len(question_terms.intersection(tokenize(sentences[i]))), i)
+        )
+        chosen = []
+        used = 0
+        for i in ranked:
+            cost = self.tokenizer.count(sentences[i]) + 1
+            if used + cost > budget:
+                continue
+            chosen.append(i)
+            used += cost
+        if not chosen:
+            # Aucune phrase entiere ne tient: debut de la plus pertinente
+            words = sentences[ranked[0]].split()
+            while words and self.tokenizer.count(' '.join(words)) > budget:
+                words = words[:max(1, len(words) * 3 // 4)] if len(words) > 1 else []
+            return ' '.join(words) + ('...' if words else '')
+        return ' '.join(sentences[i] for i in sorted(chosen))
+
+    # ------------------------------------------------------------------
+    # Assemblage
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _score(doc: Dict[str, Any]) -> float:
+        return float(doc.get('similarity') or 0.0)
+
+    @staticmethod
+    def _label(doc: Dict[str, Any]) -> str:
+        """Source du chunk, suivie de sa section (titres markdown) si elle est connue"""
+        heading_path = (doc.get('metadata') or {}).get('heading_path')
+        source = doc.get('source', 'Unknown')
+        return f"{source} - {heading_path}" if heading_path else source
+
+    def pack(self, question: str, docs: List[Dict[str, Any]], previous_question: Optional[str] = None,
+             previous_answer: Optional[str] = None) -> PackedContext:
+        question_terms = set(tokenize(question))
+        parts = []
+        used = 0
+
+        # Echange precedent (questions contextuelles), dans son sous-budget
+        if previous_answer:
+            history_budget = min(self.history_tokens, self.budget_tokens // 2)
+            answer = previous_answer
+            if self.tokenizer.count(answer) > history_budget:
+                answer = self._trim(answer, question_terms | set(tokenize(previous_question or '')), history_budget)
+            history_text = "\n".join([
+                "=== CONTEXTE CONVERSATIONNEL ===",
+                f"Question précédente: {previous_question or ''}",
+                f"Réponse précédente: {answer}",
+                ""
+            ])
+            parts.append(history_text)
+            used += self.tokenizer.count(history_text)
+
+        ordered = sorted(docs, key=self._score, reverse=True)
+        candidates, overlap_removed = self._deduplicate(ordered)
+        for candidate in candidates:
+            candidate['tokens'] = self.tokenizer.count(candidate['text'])
+            candidate['density'] = self._score(candidate['doc']) / max(candidate['tokens'], 1)
+
+        # Selection gloutonne par score / token; en-tetes comptes dans le budget
+        section_tokens = self.tokenizer.count("=== DOCUMENTS PERTINENTS ===") + 1
+        selected = []
+        trimmed = 0
+        for candidate in sorted(candidates, key=lambda item: item['density'], reverse=True):
+            doc = candidate['doc']
+            header = f"[Source {len(selected) + 1}] {self._label(doc)} (Similarité: {self._score(doc):.3f})"
+            overhead = self.tokenizer.count(header + "\nContenu: ") + 2 + (0 if selected else section_tokens)
+            remaining = self.budget_tokens - used - overhead
+            if remaining < self.min_chunk_tokens:
+                continue
+            if candidate['tokens'] > remaining:
+                candidate['text'] = self._trim(candidate['text'], question_terms, remaining)
+                candidate['tokens'] = self.tokenizer.count(candidate['text'])
+                if not candidate['text'] or candidate['tokens'] > remaining:
+                    continue
+                trimmed += 1
+            selected.append(candidate)
+            used += candidate['tokens'] + overhead
+
+        # Presentation par score decroissant (le plus pertinent en premier)
+        selected.sort(key=lambda item: self._score(item['doc']), reverse=True)
+        if selected:
+            parts.append("=== DOCUMENTS PERTINENTS ===")
+            for i, candidate in enumerate(selected, 1):
+                doc = candidate['doc']
+                parts.append(f"[Source {i}] {self._label(doc)} (Similarité: {self._score(doc):.3f})")
+                parts.append(f"Contenu: {candidate['text']}")
+                parts.append("")
+
+        text = "\n".join(parts)
+        return PackedContext(
+            text=text,
+            tokens_used=self.tokenizer.count(text),
+            budget=self.budget_tokens,
+            docs_used=[candidate['doc'] for candidate in selected],
+            docs_dropped=len(docs) - len(selected),
+            docs_trimmed=trimmed,
+            overlap_chars_removed=overlap_removed,
+            tokenizer=self.tokenizer.name
+        )
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Manifeste d'indexation du corpus - Seance 5
+Empreintes SHA-256 par fichier et par chunk pour la re-indexation incrementale
+"""
+
+import os
+import json
+import hashlib
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime
+from pathlib import Path
+
+MANIFEST_VERSION = 1
+
+
+def hash_text(text: str) -> str:
+    """Empreinte SHA-256 d'un texte (utf-8)"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def hash_file(path: Path, block_size: int = 1 << 20) -> str:
+    """Empreinte SHA-256 du contenu d'un fichier, lue par blocs"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_chunk_id(relative_path: str, chunk_hash: str, occurrence: int = 0) -> str:
+    """ID deterministe d'un chunk: meme fichier + meme contenu => meme ID"""
+    key = f"{relative_path}|{chunk_hash}|{occurrence}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class CorpusManifest:
+    """Manifeste persistant: fichiers indexes, leurs empreintes et les IDs de leurs chunks"""
+
+    def __init__(self, path: Path, collection_name: str, splitter_config: Dict[str, Any]):
+        self.path = Path(path)
+        self.collection_name = collection_name
+        self.splitter_config = dict(splitter_config)
+        self.exists = False
+        self.data = self._empty()
+
+    def _empty(self) -> Dict[str, Any]:
+        return {
+            'version': MANIFEST_VERSION,
+            'collection_name': self.collection_name,
+            'splitter': self.splitter_config,
+            'updated_at': None,
+            'files': {}
+        }
+
+    def load(self) -> 'CorpusManifest':
+        """Charger le manifeste depuis le disque (vide s'il n'existe pas)"""
+        self.exists = self.path.exists()
+        if not self.exists:
+            self.data = self._empty()
+            return self
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+        except Exception as e:
+            print(f"[WARNING] Manifeste illisible, reconstruction complete: {e}")
+            self.exists = False
+            self.data = self._empty()
+        return self
+
+    def save(self):
+        """Sauvegarder le manifeste de maniere atomique"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.data['updated_at'] = datetime.now().isoformat()
+        tmp_path = self.path.with_suffix(self.path.suffix + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def reset(self):
+        """Oublier tous les fichiers indexes (reconstruction complete)"""
+        self.data = self._empty()
+
+    def is_compatible(self) -> bool:
+        """Le manifeste decrit-il la meme collection avec le meme decoupage ?"""
+        return (
+            self.exists
+            and self.data.get('version') == MANIFEST_VERSION
+            and self.data.get('collection_name') == self.collection_name
+            and self.data.get('splitter') == self.splitter_config
+        )
+
+    @property
+    def files(self) -> Dict[str, Dict[str, Any]]:
+        return self.data.setdefault('files', {})
+
+    def get_file(self, relative_path: str) -> Optional[Dict[str, Any]]:
+        return self.files.get(relative_path)
+
+    def is_unchanged(self, relative_path: str, size: int, mtime: float) -> bool:
+        """Test rapide (taille + date) evitant de relire un fichier non modifie"""
+        entry = self.get_file(relative_path)
+        return bool(entry) and entry.get('size') == size and entry.get('mtime') == mtime
+
+    def touch_file(self, relative_path: str, size: int, mtime: float):
+        """Contenu identique mais metadonnees fichier modifiees"""
+        entry = self.get_file(relative_path)
+        if entry:
+            entry['size'] = size
+            entry['mtime'] = mtime
+
+    def chunk_ids(self, relative_path: str) -> List[str]:
+        entry = self.get_file(relative_path)
+        return list(entry.get('chunks', [])) if entry else []
+
+    def update_file(self, relative_path: str, file_hash: str, size: int, mtime: float,
+                    chunk_ids: List[str]) -> Tuple[List[str], List[str]]:
+        """Enregistrer les nouveaux chunks d'un fichier.
+
+        Retourne (ids a ajouter, ids a supprimer) par rapport a l'etat precedent.
+        """
+        old_ids = set(self.chunk_ids(relative_path))
+        new_ids = set(chunk_ids)
+
+        self.files[relative_path] = {
+            'file_hash': file_hash,
+            'size': size,
+            'mtime': mtime,
+            'chunks': list(chunk_ids),
+            'indexed_at': datetime.now().isoformat()
+        }
+
+        to_add = [chunk_id for chunk_id in chunk_ids if chunk_id not in old_ids]
+        to_delete = [chunk_id for chunk_id in old_ids if chunk_id not in new_ids]
+        return to_add, to_delete
+
+    def remove_file(self, relative_path: str) -> List[str]:
+        """Retirer un fichier disparu; retourne les IDs de chunks a supprimer"""
+        entry = self.files.pop(relative_path, None)
+        return list(entry.get('chunks', [])) if entry else []
+
+    def vanished_files(self, current_files) -> List[str]:
+        current = set(current_files)
+        return [relative_path for relative_path in self.files if relative_path not in current]
+
+    def total_chunks(self) -> int:
+        return sum(len(entry.get('chunks', [])) for entry in self.files.values())
+
+    def fingerprint(self) -> str:
+        """Empreinte globale du corpus indexe (change des qu'un fichier change)"""
+        parts = [
+            f"{relative_path}:{entry.get('file_hash')}"
+            for relative_path, entry in sorted(self.files.items())
+        ]
+        parts.append(json.dumps(self.splitter_config, sort_keys=True))
+        return hash_text("\n".join(parts))
+
+
+class ManifestFingerprint:
+    """Empreinte du corpus suivie sur le fichier manifeste.
+
+    Relue quand le fichier change (date, taille, inode): une re-indexation faite par
+    un autre processus (reindex.py) invalide aussi le cache semantique du serveur web.
+    """
+
+    def __init__(self, manifest: CorpusManifest):
+        self.path = manifest.path
+        self.collection_name = manifest.collection_name
+        self.splitter_config = dict(manifest.splitter_config)
+        self.lock = threading.Lock()
+        self.file_key = None
+        self.value = None
+        self.reloads = 0
+        self.set(manifest)
+
+    def _file_key(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def set(self, manifest: CorpusManifest) -> str:
+        """Empreinte du manifeste que ce processus vient d'ecrire"""
+        with self.lock:
+            self.file_key = self._file_key()
+            self.value = manifest.fingerprint()
+            return self.value
+
+    def current(self) -> Optional[str]:
+        """Empreinte a jour (un stat par appel, relecture seulement si le fichier a change)"""
+        file_key = self._file_key()
+        if file_key is None or file_key == self.file_key:
+            return self.value
+        with self.lock:
+            if file_key != self.file_key:
+                manifest = CorpusManifest(self.path, self.collection_name, self.splitter_config).load()
+                if manifest.exists:
+                    self.value = manifest.fingerprint()
+                    self.reloads += 1
+                    print("[CACHE] Manifeste modifie par un autre processus: empreinte du corpus rechargee")
+                self.file_key = file_key
+            return self.value
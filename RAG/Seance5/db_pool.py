@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Pool de connexions PostgreSQL partage - Seance 5
+Un seul engine SQLAlchemy (QueuePool) pour PGVector, l'ecriture COPY, l'index ANN et l'API web,
+plus un pool asyncpg pour le mode ASGI
+"""
+
+import os
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import URL
+from sqlalchemy.pool import QueuePool
+
+# Driver asynchrone (mode ASGI uniquement)
+try:
+    import asyncpg
+    ASYNCPG_AVAILABLE = True
+except ImportError:
+    ASYNCPG_AVAILABLE = False
+
+_shared_pools = {}
+_shared_lock = threading.Lock()
+
+
+class DatabasePool:
+    """Pool borne (min_size connexions gardees ouvertes, max_size au total) avec
+    verification des connexions avant usage (pool_pre_ping) et metriques.
+
+    `engine` se passe tel quel a PGVector (connection=...), `raw_connection()`
+    fournit une connexion psycopg2 rendue au pool par close().
+    """
+
+    def __init__(self, db_params: Dict[str, Any], min_size: int = 2, max_size: int = 10,
+                 timeout: float = 30, recycle: int = 1800):
+        self.db_params = db_params
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        url = URL.create(
+            "postgresql+psycopg2",
+            username=db_params.get('user'),
+            password=db_params.get('password'),
+            host=db_params.get('host'),
+            port=int(db_params['port']) if db_params.get('port') else None,
+            database=db_params.get('database')
+        )
+        self.engine = create_engine(
+            url,
+            poolclass=QueuePool,
+            pool_size=self.min_size,
+            max_overflow=self.max_size - self.min_size,
+            pool_timeout=timeout,
+            pool_recycle=recycle,
+            pool_pre_ping=True
+        )
+        self.session_settings = []
+        self.lock = threading.Lock()
+        self.connections_created = 0
+        self.invalidated = 0
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+        event.listen(self.engine, 'connect', self._on_connect)
+        event.listen(self.engine, 'invalidate', self._on_invalidate)
+
+    @classmethod
+    def from_env(cls, db_params: Dict[str, Any]) -> 'DatabasePool':
+        return cls(
+            db_params,
+            min_size=int(os.getenv('RAG_DB_POOL_MIN', '2')),
+            max_size=int(os.getenv('RAG_DB_POOL_MAX', '10')),
+            timeout=float(os.getenv('RAG_DB_POOL_TIMEOUT', '30')),
+            recycle=int(os.getenv('RAG_DB_POOL_RECYCLE', '1800'))
+        )
+
+    @classmethod
+    def shared(cls, db_params: Dict[str, Any]) -> 'DatabasePool':
+        """Pool unique par base (meme parametres -> meme pool) pour tout le processus"""
+        key = tuple(sorted((name, str(value)) for name, value in db_params.items()))
+        with _shared_lock:
+            pool = _shared_pools.get(key)
+            if pool is None:
+                pool = cls.from_env(db_params)
+                _shared_pools[key] = pool
+            return pool
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.connections_created += 1
+            settings = list(self.session_settings)
+        if settings:
+            cursor = dbapi_connection.cursor()
+            for statement in settings:
+                cursor.execute(statement)
+            cursor.close()
+            dbapi_connection.commit()
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self.lock:
+            self.invalidated += 1
+
+    def add_session_settings(self, statements):
+        """Reglages SET appliques a chaque nouvelle connexion (ex: hnsw.ef_search)"""
+        with self.lock:
+            new = [statement for statement in statements if statement not in self.session_settings]
+            self.session_settings.extend(new)
+        if new:
+            # Les connexions deja ouvertes n'ont pas les reglages: on vide le pool
+            self.engine.dispose()
+
+    def raw_connection(self):
+        """Connexion psycopg2 du pool (close() la rend au pool)"""
+        start = time.monotonic()
+        conn = self.engine.raw_connection()
+        waited = time.monotonic() - start
+        with self.lock:
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """with pool.connection() as conn: ... (rollback en cas d'erreur)"""
+        conn = self.raw_connection()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def health_check(self) -> Dict[str, Any]:
+        """SELECT 1 a travers le pool"""
+        start = time.monotonic()
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return {'ok': True, 'latency_ms': round(1000 * (time.monotonic() - start), 2)}
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+
+    def get_stats(self) -> Dict[str, Any]:
+        pool = self.engine.pool
+        with self.lock:
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'open': pool.checkedin() + pool.checkedout(),
+                'idle': pool.checkedin(),
+                'in_use': pool.checkedout(),
+                'overflow': max(0, pool.overflow()),
+                'connections_created': self.connections_created,
+                'invalidated': self.invalidated,
+                'checkouts': self.checkouts,
+                'avg_wait_ms': round(1000 * self.wait_seconds_total / self.checkouts, 3) if self.checkouts else 0.0,
+                'max_wait_ms': round(1000 * self.wait_seconds_max, 3)
+            }
+
+    def dispose(self):
+        self.engine.dispose()
+
+
+class AsyncDatabasePool:
+    """Pool asyncpg du mode ASGI, cree paresseusement dans la boucle d'evenements courante.
+
+    Les reglages de session (ef_search / probes) sont repris du pool synchrone
+    `settings_pool`, et le type vector est enregistre sur chaque connexion
+    (les vecteurs numpy passent directement en parametre).
+    """
+
+    def __init__(self, db_params: Dict[str, Any], min_size: int = 2, max_size: int = 20,
+                 settings_pool: DatabasePool = None):
+        self.db_params = db_params
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.settings_pool = settings_pool
+        self.pool = None
+        self.loop = None
+        self.create_lock = None
+        self.queries = 0
+
+    @classmethod
+    def from_env(cls, db_params: Dict[str, Any], settings_pool: DatabasePool = None) -> 'AsyncDatabasePool':
+        return cls(
+            db_params,
+            min_size=int(os.getenv('RAG_ASYNC_DB_POOL_MIN', '2')),
+            max_size=int(os.getenv('RAG_ASYNC_DB_POOL_MAX', '20')),
+            settings_pool=settings_pool
+        )
+
+    async def _init_connection(self, conn):
+        from pgvector.asyncpg import register_vector
+        await register_vector(conn)
+        if self.settings_pool is not None:
+            for statement in self.settings_pool.session_settings:
+                await conn.execute(statement)
+
+    async def get_pool(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # Un pool asyncpg est lie a sa boucle d'evenements
+            self.pool, self.loop, self.create_lock = None, loop, asyncio.Lock()
+        async with self.create_lock:
+            if self.pool is None:
+                self.pool = await asyncpg.create_pool(
+                    host=self.db_params.get('host'),
+                    port=int(self.db_params['port']) if self.db_params.get('port') else None,
+                    database=self.db_params.get('database'),
+                    user=self.db_params.get('user'),
+                    password=self.db_params.get('password'),
+                    min_size=self.min_size,
+                    max_size=self.max_size,
+                    init=self._init_connection
+                )
+        return self.pool
+
+    async def fetch(self, query: str, *args):
+        pool = await self.get_pool()
+        self.queries += 1
+        return await pool.fetch(query, *args)
+
+    async def health_check(self) -> Dict[str, Any]:
+        start = time.monotonic()
+        try:
+            pool = await self.get_pool()
+            await pool.fetchval("SELECT 1")
+            return {'ok': True, 'latency_ms': round(1000 * (time.monotonic() - start), 2)}
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {'min_size': self.min_size, 'max_size': self.max_size, 'queries': self.queries}
+        if self.pool is not None:
+            stats['open'] = self.pool.get_size()
+            stats['idle'] = self.pool.get_idle_size()
+        return stats
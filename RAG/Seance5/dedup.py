@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Elimination des quasi-doublons par SimHash - Seance 5
+Empreinte 64 bits des chunks (bigrammes de mots en minuscules), comparee aux dernieres
+empreintes gardees (fenetre bornee, distance de Hamming vectorisee): a l'ingestion (boilerplate repete, voisins trop recouvrants) et sur les resultats de recherche
+"""
+
+import os
+import zlib
+import threading
+from collections import Counter
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple, Callable
+
+import numpy as np
+
+from lexical_index import TOKEN_PATTERN
+from quantization import popcount64
+
+FINGERPRINT_BITS = 64
+
+
+def _mix64(hashes: np.ndarray) -> np.ndarray:
+    """Finaliseur splitmix64: etale les 32 bits du crc32 sur 64 bits (vectorise)"""
+    hashes = (hashes ^ (hashes >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    hashes = (hashes ^ (hashes >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return hashes ^ (hashes >> np.uint64(31))
+
+
+def simhash(text: str) -> Optional[int]:
+    """Empreinte SimHash 64 bits (None si le texte n'a aucun mot).
+
+    Les traits sont les bigrammes de mots en minuscules, ponderes par leur frequence;
+    le hachage (crc32) est stable entre processus, l'empreinte peut etre persistee.
+    """
+    tokens = [token for token in TOKEN_PATTERN.findall(text.casefold()) if len(token) > 1 or token.isdigit()]
+    if not tokens:
+        return None
+    features = Counter(map(' '.join, zip(tokens, tokens[1:]))) if len(tokens) > 1 else Counter(tokens)
+    hashes = _mix64(np.fromiter((zlib.crc32(feature.encode('utf-8')) for feature in features),
+                                dtype=np.uint64, count=len(features)))
+    weights = np.fromiter(features.values(), dtype=np.float64, count=len(features))
+    # Bit i de chaque hachage: +poids s'il vaut 1, -poids sinon
+    bits = np.unpackbits(hashes.astype('<u8').view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    votes = weights @ (2.0 * bits - 1.0)
+    return int.from_bytes(np.packbits(votes > 0, bitorder='little').tobytes(), 'little')
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class SimHashIndex:
+    """Les `window` dernieres empreintes ajoutees, dans un tampon circulaire uint64.
+
+    Une recherche compare l'empreinte a tout le tampon en une passe numpy (cout borne par
+    la fenetre, pas par la taille du fichier). Les tables LSH par bandes degeneraient a
+    distance 7: 8 bandes de 8 bits, seaux surcharges, cout quadratique sur un gros fichier.
+    Un doublon separe de plus de `window` chunks gardes n'est pas detecte.
+    """
+
+    def __init__(self, max_distance: int = 7, window: int = 4096):
+        self.max_distance = max_distance
+        self.window = max(int(window), 1)
+        self.fingerprints = np.zeros(min(self.window, 64), dtype=np.uint64)
+        self.values: List[Any] = []
+        self.count = 0
+
+    def find(self, fingerprint: int) -> Optional[Any]:
+        """Valeur associee a une empreinte proche deja indexee, sinon None"""
+        filled = min(self.count, self.window)
+        if not filled:
+            return None
+        distances = popcount64(self.fingerprints[:filled] ^ np.uint64(fingerprint))
+        matches = np.flatnonzero(distances <= self.max_distance)
+        return self.values[matches[0]] if len(matches) else None
+
+    def add(self, fingerprint: int, value: Any):
+        slot = self.count % self.window
+        if slot >= len(self.fingerprints):
+            # Croissance par doublement jusqu'a la fenetre (petits fichiers: petit tampon)
+            grown = np.zeros(min(2 * len(self.fingerprints), self.window), dtype=np.uint64)
+            grown[:len(self.fingerprints)] = self.fingerprints
+            self.fingerprints = grown
+        self.fingerprints[slot] = fingerprint
+        if slot < len(self.values):
+            self.values[slot] = value
+        else:
+            self.values.append(value)
+        self.count += 1
+
+
+class NearDuplicateFilter:
+    """Filtre SimHash (RAG_NEAR_DUPLICATES, RAG_NEAR_DUPLICATE_DISTANCE, RAG_NEAR_DUPLICATE_WINDOW).
+
+    A l'ingestion, un chunk proche d'un des `window` derniers chunks gardes du meme
+    fichier n'est ni vectorise ni indexe (le decoupage reste deterministe fichier par fichier, compatible
+    avec la reindexation incrementale). Les doublons entre fichiers sont retires des
+    resultats de recherche, avant l'assemblage du contexte.
+    """
+
+    def __init__(self, enabled: bool = True, max_distance: int = 7, window: int = 4096):
+        self.enabled = enabled
+        self.max_distance = max_distance
+        self.window = window
+        self.lock = threading.Lock()
+        self.ingest_seen = 0
+        self.ingest_dropped = 0
+        self.retrieval_seen = 0
+        self.retrieval_dropped = 0
+
+    @classmethod
+    def from_env(cls) -> 'NearDuplicateFilter':
+        return cls(
+            enabled=os.getenv('RAG_NEAR_DUPLICATES', 'true').lower() in ('1', 'true', 'yes'),
+            max_distance=int(os.getenv('RAG_NEAR_DUPLICATE_DISTANCE', '7')),
+            window=int(os.getenv('RAG_NEAR_DUPLICATE_WINDOW', '4096'))
+        )
+
+    @property
+    def config(self) -> Optional[Dict[str, int]]:
+        """Parametres a inclure dans le manifeste (None = desactive)"""
+        return {'max_distance': self.max_distance, 'window': self.window} if self.enabled else None
+
+    def unique(self, items: Iterable[Any], text_of: Callable[[Any], str],
+               record: bool = True) -> Iterator[Tuple[Any, Optional[int]]]:
+        """(element, empreinte) des elements sans quasi-doublon plus tot dans `items`
+        (`record=False`: relecture du corpus, hors statistiques d'ingestion)"""
+        index = SimHashIndex(self.max_distance, self.window)
+        seen = dropped = 0
+        try:
+            for item in items:
+                fingerprint = simhash(text_of(item)) if self.enabled else None
+                seen += 1
+                if fingerprint is not None:
+                    if index.find(fingerprint) is not None:
+                        dropped += 1
+                        continue
+                    index.add(fingerprint, True)
+                yield item, fingerprint
+        finally:
+            if record:
+                with self.lock:
+                    self.ingest_seen += seen
+                    self.ingest_dropped += dropped
+
+    def filter_results(self, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Resultats de recherche sans quasi-doublons (le mieux classe est garde); l'empreinte
+        calculee a l'ingestion (metadata['simhash']) est reutilisee si elle existe"""
+        if not self.enabled or len(docs) < 2:
+            return docs
+        index = SimHashIndex(self.max_distance)
+        kept = []
+        for doc in sorted(docs, key=lambda item: item.get('similarity') or 0.0, reverse=True):
+            stored = (doc.get('metadata') or {}).get('simhash')
+            fingerprint = int(stored, 16) if stored else simhash(doc.get('content') or '')
+            if fingerprint is not None:
+                if index.find(fingerprint) is not None:
+                    continue
+                index.add(fingerprint, True)
+            kept.append(doc)
+        with self.lock:
+            self.retrieval_seen += len(docs)
+            self.retrieval_dropped += len(docs) - len(kept)
+        # Ordre d'origine conserve pour les etapes suivantes
+        kept_ids = {id(doc) for doc in kept}
+        return [doc for doc in docs if id(doc) in kept_ids]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'max_distance': self.max_distance,
+                'window': self.window,
+                'ingest_chunks_seen': self.ingest_seen,
+                'ingest_chunks_dropped': self.ingest_dropped,
+                'retrieval_results_seen': self.retrieval_seen,
+                'retrieval_results_dropped': self.retrieval_dropped
+            }
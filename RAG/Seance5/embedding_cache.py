@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+"""
+Cache persistant des embeddings - Seance 5
+Matrice float32 memory-mappee + journal des cles en ajout seul (cle -> ligne), eviction LRU
+"""
+
+import os
+import re
+import atexit
+import json
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+
+def normalize_text(text: str) -> str:
+    """Normalisation sans effet sur l'embedding: Unicode NFC + espaces regroupes"""
+    text = unicodedata.normalize('NFC', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+class EmbeddingCacheStore:
+    """Stockage disque des vecteurs: vectors.f32 (memmap), index.json (modele, dimension,
+    capacite) et keys.log, journal en ajout seul des affectations cle -> ligne.
+
+    Un ajout ecrit une ligne dans le journal (jamais l'index complet); le journal est
+    compacte quand il depasse deux fois le nombre d'entrees. Au rechargement, l'ordre LRU
+    est celui des derniers ajouts (les lectures ne sont pas journalisees).
+
+    Plusieurs processus (reindex.py, serveur web) partagent le dossier: les ecritures
+    prennent un verrou exclusif (flock sur cache.lock), les lectures un verrou partage, et
+    chacune rattrape d'abord les changements des autres (lignes ajoutees au journal,
+    journal compacte, matrice agrandie).
+    """
+
+    INITIAL_CAPACITY = 1024
+    TOMBSTONE = '-'
+
+    def __init__(self, cache_dir: Path, model_name: str, max_entries: int = 200000,
+                 flush_interval: float = 30.0):
+        self.model_name = model_name
+        self.model_key = hashlib.sha1(model_name.encode('utf-8')).hexdigest()[:12]
+        self.cache_dir = Path(cache_dir) / self.model_key
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.cache_dir / "vectors.f32"
+        self.index_path = self.cache_dir / "index.json"
+        self.log_path = self.cache_dir / "keys.log"
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+
+        self.dim = None
+        self.capacity = 0
+        self.matrix = None
+        self.slots = OrderedDict()  # cle -> ligne, de la moins a la plus recemment utilisee
+        self.slot_keys = {}         # ligne -> cle
+        self.free_slots = []
+        self.log_file = None
+        self.log_inode = None
+        self.log_offset = 0         # octets du journal deja rejoues (lignes completes)
+        self.log_size = 0
+        self.log_lines = 0
+        self.dirty = 0
+        self.last_flush = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        if FCNTL_AVAILABLE:
+            self.lock_file = open(self.cache_dir / "cache.lock", 'a+')
+        else:
+            self.lock_file = None
+            print("[WARNING] fcntl indisponible: cache embeddings a un seul processus ecrivain")
+
+        with self.lock, self._file_lock(exclusive=True):
+            self._load()
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        """Verrou inter-processus sur le dossier du cache (sans effet sans fcntl)"""
+        if self.lock_file is None:
+            yield
+            return
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    # ------------------------------------------------------------------
+    # Chargement et rattrapage (verrou de fichier tenu par l'appelant)
+    # ------------------------------------------------------------------
+    def _load(self):
+        """Relire l'en-tete, mapper la matrice existante et rejouer le journal des cles"""
+        if not self.index_path.exists() or not self.vectors_path.exists():
+            self._reset_files()
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                header = json.load(f)
+            if header.get('model_name') != self.model_name:
+                self._reset_files()
+                return
+
+            self.dim = header['dim']
+            self.capacity = header['capacity']
+            expected_size = self.capacity * self.dim * 4
+            if self.vectors_path.stat().st_size < expected_size:
+                print("[WARNING] Cache embeddings tronque, reinitialisation")
+                self.dim, self.capacity = None, 0
+                self._reset_files()
+                return
+
+            self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r+',
+                                    shape=(self.capacity, self.dim))
+            # Ancien format: toutes les affectations dans index.json
+            for key, slot in header.get('slots', ()):
+                self._apply(key, slot)
+            self._reload_log()
+            if 'slots' in header:
+                self._write_header()
+                self._compact_locked()
+            print(f"[CACHE] Embeddings en cache: {len(self.slots)} vecteurs ({self.model_name})")
+        except Exception as e:
+            print(f"[WARNING] Cache embeddings illisible, reinitialisation: {e}")
+            self.dim, self.capacity, self.matrix = None, 0, None
+            self.slots.clear()
+            self.slot_keys.clear()
+            self.free_slots = []
+            self._reset_files()
+
+    def _apply(self, key: str, slot: int):
+        """Appliquer une ligne du journal (la ligne d'une cle recyclee est liberee)"""
+        previous = self.slot_keys.pop(slot, None)
+        if previous is not None and self.slots.get(previous) == slot:
+            del self.slots[previous]
+        if key == self.TOMBSTONE:
+            self.free_slots.append(slot)
+            return
+        self.slots.pop(key, None)
+        self.slots[key] = slot
+        self.slot_keys[slot] = key
+
+    def _replay_log(self):
+        """Rejouer les lignes completes ajoutees depuis `log_offset`"""
+        with open(self.log_path, 'rb') as f:
+            f.seek(self.log_offset)
+            data = f.read()
+        # Derniere ligne incomplete (ecriture en cours ou arret brutal): ignoree
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].decode('utf-8', errors='replace').splitlines():
+            parts = line.split()
+            if len(parts) != 2 or not parts[1].isdigit():
+                continue
+            if int(parts[1]) < self.capacity:
+                self._apply(parts[0], int(parts[1]))
+            self.log_lines += 1
+        self.log_offset += end
+
+    def _reload_log(self):
+        """Relecture complete du journal (chargement, journal compacte par un autre processus)"""
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+        self.log_offset = self.log_lines = 0
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            self.log_inode, self.log_size = None, 0
+        else:
+            self.log_inode, self.log_size = stat.st_ino, stat.st_size
+            self._replay_log()
+        used = set(self.slot_keys)
+        self.free_slots = [slot for slot in range(self.capacity - 1, -1, -1) if slot not in used]
+
+    def _sync(self):
+        """Rattraper les ecritures des autres processus depuis notre dernier passage"""
+        size = self.vectors_path.stat().st_size if self.vectors_path.exists() else 0
+        if size > self.capacity * (self.dim or 0) * 4:
+            self._remap()
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self.log_inode:
+            self.slots.clear()
+            self.slot_keys.clear()
+            self._reload_log()
+        elif stat.st_size > self.log_offset:
+            self.log_size = stat.st_size
+            self._replay_log()
+
+    def _remap(self):
+        """Matrice creee ou agrandie par un autre processus: nouvel en-tete, nouveau memmap"""
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            header = json.load(f)
+        if header.get('model_name') != self.model_name or header['capacity'] <= self.capacity:
+            return
+        if self.matrix is not None:
+            self.matrix.flush()
+            del self.matrix
+        self.dim = header['dim']
+        self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r+',
+                                shape=(header['capacity'], self.dim))
+        self.free_slots = list(range(header['capacity'] - 1, self.capacity - 1, -1)) + self.free_slots
+        self.capacity = header['capacity']
+
+    def _reset_files(self):
+        """Journal sans en-tete valide: ses lignes ne designent plus rien"""
+        self.log_lines = self.log_offset = self.log_size = 0
+        self.log_inode = None
+        try:
+            self.log_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    # ------------------------------------------------------------------
+    # Ecriture (verrou exclusif tenu par l'appelant)
+    # ------------------------------------------------------------------
+    def _write_header(self):
+        header = {
+            'model_name': self.model_name,
+            'dim': self.dim,
+            'capacity': self.capacity
+        }
+        tmp_path = self.index_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(header, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _grow(self, dim: int):
+        """Allouer ou agrandir la matrice (doublement, plafonne a max_entries)"""
+        if self.dim is None:
+            self.dim = dim
+        new_capacity = min(self.max_entries, max(self.INITIAL_CAPACITY, self.capacity * 2))
+        if new_capacity <= self.capacity:
+            return
+
+        if self.matrix is not None:
+            self.matrix.flush()
+            del self.matrix
+        with open(self.vectors_path, 'ab') as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r+',
+                                shape=(new_capacity, self.dim))
+        self.free_slots = list(range(new_capacity - 1, self.capacity - 1, -1)) + self.free_slots
+        self.capacity = new_capacity
+        # En-tete reecrit avant que le journal ne reference les nouvelles lignes (log2 fois)
+        self._write_header()
+
+    def _append_log(self, key: str, slot: int):
+        """Ligne ecrite et rendue visible aux autres processus avant de rendre le verrou"""
+        if self.log_file is None:
+            self.log_file = open(self.log_path, 'ab')
+            self.log_inode = os.fstat(self.log_file.fileno()).st_ino
+        record = f"{key} {slot}\n".encode('utf-8')
+        if self.log_size > self.log_offset:
+            # Ligne incomplete laissee par un arret brutal: terminee avant la notre
+            record = b'\n' + record
+        self.log_file.write(record)
+        self.log_file.flush()
+        self.log_offset = self.log_size = self.log_size + len(record)
+        self.log_lines += 1
+
+    def _free_slot(self) -> Optional[int]:
+        while self.free_slots:
+            slot = self.free_slots.pop()
+            # Une ligne liberee peut avoir ete reprise par un autre processus entre-temps
+            if slot not in self.slot_keys:
+                return slot
+        return None
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        return self.get_many([key])[0]
+
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        with self.lock, self._file_lock(exclusive=False):
+            self._sync()
+            vectors = []
+            for key in keys:
+                slot = self.slots.get(key)
+                if slot is None:
+                    self.misses += 1
+                    vectors.append(None)
+                    continue
+                self.slots.move_to_end(key)
+                self.hits += 1
+                vectors.append(np.array(self.matrix[slot]))
+            return vectors
+
+    def put(self, key: str, vector):
+        self.put_many([key], [vector])
+
+    def put_many(self, keys: List[str], vectors: List[Any]):
+        with self.lock, self._file_lock(exclusive=True):
+            self._sync()
+            for key, vector in zip(keys, vectors):
+                self._put_locked(key, np.asarray(vector, dtype=np.float32))
+            if time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush_locked()
+
+    def _put_locked(self, key: str, vector: np.ndarray):
+        if self.dim is not None and vector.shape[0] != self.dim:
+            return
+        if key in self.slots:
+            self.slots.move_to_end(key)
+            return
+        slot = self._free_slot()
+        if slot is None:
+            self._grow(vector.shape[0])
+            slot = self._free_slot()
+        if slot is None:
+            # Cache plein: on recycle la ligne la moins recemment utilisee; l'ancienne
+            # cle est retiree du journal avant d'ecraser son vecteur
+            _, slot = self.slots.popitem(last=False)
+            del self.slot_keys[slot]
+            self.evictions += 1
+            self._append_log(self.TOMBSTONE, slot)
+        self.matrix[slot] = vector
+        self.slots[key] = slot
+        self.slot_keys[slot] = key
+        self._append_log(key, slot)
+        self.dirty += 1
+
+    def flush(self):
+        with self.lock, self._file_lock(exclusive=True):
+            self._sync()
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self.last_flush = time.monotonic()
+        if self.matrix is None or not self.dirty:
+            return
+        self.matrix.flush()
+        if self.log_lines > 2 * len(self.slots) + self.INITIAL_CAPACITY:
+            self._compact_locked()
+        self.dirty = 0
+
+    def _compact_locked(self):
+        """Reecrire le journal avec les seules affectations vivantes (ordre LRU conserve);
+        nouveau fichier: les autres processus le relisent en entier"""
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+        tmp_path = self.log_path.with_suffix('.log.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(''.join(f"{key} {slot}\n" for key, slot in self.slots.items()).encode('utf-8'))
+        os.replace(tmp_path, self.log_path)
+        stat = os.stat(self.log_path)
+        self.log_inode, self.log_offset, self.log_size = stat.st_ino, stat.st_size, stat.st_size
+        self.log_lines = len(self.slots)
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'model': self.model_name,
+            'entries': len(self.slots),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'evictions': self.evictions,
+            'log_lines': self.log_lines,
+            'size_bytes': self.capacity * (self.dim or 0) * 4
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings LangChain avec cache disque devant le modele (cle: modele + SHA du texte)"""
+
+    def __init__(self, embeddings: Embeddings, model_name: str, cache_dir: Path,
+                 max_entries: int = 200000):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.store = EmbeddingCacheStore(cache_dir, model_name, max_entries=max_entries)
+        atexit.register(self.store.flush)
+
+    def _key(self, text: str, kind: str) -> str:
+        payload = f"{self.model_name}\0{kind}\0{normalize_text(text)}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def cached_document_vectors(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Vecteurs deja en cache (None pour les textes absents)"""
+        vectors = self.store.get_many([self._key(text, 'document') for text in texts])
+        return [vector.tolist() if vector is not None else None for vector in vectors]
+
+    def cache_document_vectors(self, texts: List[str], vectors: List[List[float]]):
+        """Memoriser des vecteurs calcules hors de ce wrapper (ex: pool d'ingestion)"""
+        self.store.put_many([self._key(text, 'document') for text in texts], vectors)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        results = self.cached_document_vectors(texts)
+
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        if missing:
+            computed = self.embeddings.embed_documents([texts[i] for i in missing])
+            self.cache_document_vectors([texts[i] for i in missing], computed)
+            for i, vector in zip(missing, computed):
+                results[i] = np.asarray(vector, dtype=np.float32).tolist()
+
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text, 'query')
+        vector = self.store.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.store.put(key, vector)
+        return np.asarray(vector, dtype=np.float32).tolist()
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Plusieurs questions: celles absentes du cache sont calculees en une seule passe"""
+        keys = [self._key(text, 'query') for text in texts]
+        vectors = self.store.get_many(keys)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            # sentence-transformers: embed_query == embed_documents pour un texte
+            computed = self.embeddings.embed_documents([texts[i] for i in missing])
+            self.store.put_many([keys[i] for i in missing], computed)
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+        return [np.asarray(vector, dtype=np.float32).tolist() for vector in vectors]
+
+    def flush(self):
+        self.store.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self.store.get_stats()
+
+
+def normalize_query(text: str, fold: bool = False) -> str:
+    """Cle d'une question: espaces normalises; avec `fold`, casse et accents ignores aussi
+    ("Qu'est-ce  qu'un RAG" == "qu'est-ce qu'un rag"), a reserver aux modeles insensibles
+    a la casse et aux accents (sinon deux textes aux vecteurs differents partagent une cle)"""
+    if fold:
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.casefold() if fold else text
+
+
+class QueryEmbeddingLRU:
+    """Vecteurs des questions recentes en memoire, devant le modele (et le cache disque).
+
+    Les vecteurs sont ranges dans une matrice float32 pre-allouee (`capacity` lignes),
+    la cle est la question normalisee (espaces, plus casse et accents si `fold`);
+    la ligne la moins recemment utilisee est recyclee.
+    """
+
+    def __init__(self, capacity: int = 4096, fold: bool = False):
+        self.capacity = max(1, capacity)
+        self.fold = fold
+        self.slab = None                   # (capacity, dim), allouee au premier ajout
+        self.slots = OrderedDict()         # question normalisee -> ligne
+        self.free_slots = list(range(self.capacity - 1, -1, -1))
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls) -> Optional['QueryEmbeddingLRU']:
+        """None si RAG_QUERY_EMBEDDING_CACHE_SIZE=0"""
+        capacity = int(os.getenv('RAG_QUERY_EMBEDDING_CACHE_SIZE', '4096'))
+        fold = os.getenv('RAG_QUERY_EMBEDDING_CACHE_FOLD', 'false').lower() in ('1', 'true', 'yes')
+        return cls(capacity, fold=fold) if capacity > 0 else None
+
+    def get(self, text: str) -> Optional[List[float]]:
+        key = normalize_query(text, self.fold)
+        with self.lock:
+            slot = self.slots.get(key)
+            if slot is None:
+                self.misses += 1
+                return None
+            self.slots.move_to_end(key)
+            self.hits += 1
+            return self.slab[slot].tolist()
+
+    def put(self, text: str, vector):
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        key = normalize_query(text, self.fold)
+        with self.lock:
+            if self.slab is None:
+                self.slab = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+            elif vector.shape[0] != self.slab.shape[1]:
+                return
+            slot = self.slots.get(key)
+            if slot is None:
+                if self.free_slots:
+                    slot = self.free_slots.pop()
+                else:
+                    _, slot = self.slots.popitem(last=False)
+                    self.evictions += 1
+            self.slab[slot] = vector
+            self.slots[key] = slot
+            self.slots.move_to_end(key)
+
+    def embed(self, text: str, compute) -> List[float]:
+        """Vecteur de la question, calcule par `compute(text)` en cas d'absence"""
+        vector = self.get(text)
+        if vector is None:
+            vector = compute(text)
+            self.put(text, vector)
+        return vector
+
+    def embed_many(self, texts: List[str], compute_many) -> List[List[float]]:
+        """Plusieurs questions: les absentes sont calculees en un seul appel a `compute_many`"""
+        vectors = [self.get(text) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = compute_many([texts[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                self.put(texts[i], vector)
+                vectors[i] = vector
+        return vectors
+
+    def clear(self):
+        with self.lock:
+            self.slots = OrderedDict()
+            self.free_slots = list(range(self.capacity - 1, -1, -1))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.slots),
+                'capacity': self.capacity,
+                'fold': self.fold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'size_bytes': int(self.slab.nbytes) if self.slab is not None else 0
+            }
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Pipeline d'ingestion du corpus - Seance 5
+Lecture/decoupage -> embeddings par lots (pool de processus) -> ecriture en base,
+chaque etape reliee par une file bornee
+"""
+
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Iterable, Callable, Optional
+
+_DONE = object()
+
+# Modele charge une seule fois par processus worker
+_worker_embeddings = None
+
+
+def _init_worker(model_name: str, threads_per_worker: int):
+    """Initialiser un worker: limiter les threads BLAS/torch puis charger le modele"""
+    global _worker_embeddings
+    os.environ['OMP_NUM_THREADS'] = str(threads_per_worker)
+    os.environ['MKL_NUM_THREADS'] = str(threads_per_worker)
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+    try:
+        import torch
+        torch.set_num_threads(threads_per_worker)
+    except ImportError:
+        pass
+
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    _worker_embeddings = HuggingFaceEmbeddings(model_name=model_name)
+
+
+def _embed_in_worker(texts: List[str]) -> List[List[float]]:
+    return _worker_embeddings.embed_documents(texts)
+
+
+class IngestionPipeline:
+    """Pipeline d'ingestion a trois etages avec files bornees.
+
+    - un thread lit et decoupe les documents et forme des lots de `batch_size` chunks
+    - le thread appelant vectorise les lots (cache d'abord, puis pool de `workers` processus)
+    - un thread ecrit les lots vectorises via `writer(documents, vectors)`
+    """
+
+    def __init__(self, embeddings, model_name: str, batch_size: int = 64,
+                 workers: int = 1, queue_size: int = 8):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.error = None
+
+    @classmethod
+    def from_env(cls, embeddings, model_name: str) -> 'IngestionPipeline':
+        """Configuration via .env (RAG_INGEST_BATCH_SIZE, RAG_INGEST_WORKERS, RAG_INGEST_QUEUE_SIZE)"""
+        return cls(
+            embeddings,
+            model_name,
+            batch_size=int(os.getenv('RAG_INGEST_BATCH_SIZE', '64')),
+            workers=int(os.getenv('RAG_INGEST_WORKERS', '1')),
+            queue_size=int(os.getenv('RAG_INGEST_QUEUE_SIZE', '8'))
+        )
+
+    def _put(self, q: queue.Queue, item):
+        """put bloquant qui abandonne si un autre etage a echoue"""
+        while self.error is None:
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while self.error is None:
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _read_stage(self, chunks: Iterable, split_queue: queue.Queue, stats: Dict[str, Any]):
+        started = time.monotonic()
+        try:
+            batch = []
+            for chunk in chunks:
+                batch.append(chunk)
+                if len(batch) >= self.batch_size:
+                    if not self._put(split_queue, batch):
+                        return
+                    batch = []
+            if batch:
+                self._put(split_queue, batch)
+        except Exception as e:
+            self.error = e
+        finally:
+            stats['read_seconds'] = time.monotonic() - started
+            self._put(split_queue, _DONE)
+
+    def _write_stage(self, writer: Callable, write_queue: queue.Queue, stats: Dict[str, Any]):
+        try:
+            while True:
+                item = self._get(write_queue)
+                if item is _DONE:
+                    return
+                documents, vectors = item
+                started = time.monotonic()
+                writer(documents, vectors)
+                stats['write_seconds'] += time.monotonic() - started
+                stats['chunks_written'] += len(documents)
+        except Exception as e:
+            self.error = e
+
+    def _cached_vectors(self, texts: List[str]) -> List[Optional[List[float]]]:
+        if hasattr(self.embeddings, 'cached_document_vectors'):
+            return self.embeddings.cached_document_vectors(texts)
+        return [None] * len(texts)
+
+    def _remember_vectors(self, texts: List[str], vectors: List[List[float]]):
+        if hasattr(self.embeddings, 'cache_document_vectors'):
+            self.embeddings.cache_document_vectors(texts, vectors)
+
+    def run(self, chunks: Iterable, writer: Callable[[List[Any], List[List[float]]], None]) -> Dict[str, Any]:
+        """Executer le pipeline sur un iterable de Documents LangChain"""
+        self.error = None
+        stats = {
+            'chunks': 0,
+            'batches': 0,
+            'cache_hits': 0,
+            'chunks_written': 0,
+            'read_seconds': 0.0,
+            'embed_seconds': 0.0,
+            'write_seconds': 0.0,
+            'workers': self.workers,
+            'batch_size': self.batch_size
+        }
+        split_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        started = time.monotonic()
+
+        reader = threading.Thread(target=self._read_stage, args=(chunks, split_queue, stats), daemon=True)
+        writer_thread = threading.Thread(target=self._write_stage, args=(writer, write_queue, stats), daemon=True)
+        reader.start()
+        writer_thread.start()
+
+        pool = None
+        if self.workers > 1:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers)
+            pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.model_name, threads_per_worker)
+            )
+        pending = deque()
+
+        def finish_oldest():
+            documents, vectors, missing, future = pending.popleft()
+            computed = future.result()
+            texts = [documents[i].page_content for i in missing]
+            self._remember_vectors(texts, computed)
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+            return self._put(write_queue, (documents, vectors))
+
+        try:
+            while True:
+                batch = self._get(split_queue)
+                if batch is _DONE:
+                    break
+                embed_started = time.monotonic()
+                texts = [doc.page_content for doc in batch]
+                vectors = self._cached_vectors(texts)
+                missing = [i for i, vector in enumerate(vectors) if vector is None]
+                stats['chunks'] += len(batch)
+                stats['batches'] += 1
+                stats['cache_hits'] += len(batch) - len(missing)
+
+                if not missing:
+                    ok = self._put(write_queue, (batch, vectors))
+                elif pool is None:
+                    computed = self.embeddings.embed_documents([texts[i] for i in missing])
+                    for i, vector in zip(missing, computed):
+                        vectors[i] = vector
+                    ok = self._put(write_queue, (batch, vectors))
+                else:
+                    future = pool.submit(_embed_in_worker, [texts[i] for i in missing])
+                    pending.append((batch, vectors, missing, future))
+                    # Limiter le nombre de lots en vol: la file bornee fait le reste
+                    ok = True
+                    while ok and len(pending) >= self.workers * 2:
+                        ok = finish_oldest()
+                stats['embed_seconds'] += time.monotonic() - embed_started
+                if not ok:
+                    break
+
+            while pending and self.error is None:
+                embed_started = time.monotonic()
+                finish_oldest()
+                stats['embed_seconds'] += time.monotonic() - embed_started
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put(write_queue, _DONE)
+            writer_thread.join()
+            reader.join()
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            if hasattr(self.embeddings, 'flush'):
+                self.embeddings.flush()
+
+        if self.error is not None:
+            raise self.error
+
+        elapsed = time.monotonic() - started
+        stats['seconds'] = round(elapsed, 3)
+        stats['chunks_per_second'] = round(stats['chunks'] / elapsed, 1) if elapsed > 0 else 0.0
+        return stats
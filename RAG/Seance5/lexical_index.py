@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Index lexical BM25 - Seance 5
+Index inverse compact (terme -> postings) et fusion RRF avec la recherche vectorielle
+"""
+
+import os
+import re
+import unicodedata
+from array import array
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+STOPWORDS = {
+    'le', 'la', 'les', 'un', 'une', 'des', 'du', 'de', 'et', 'ou', 'en', 'au', 'aux',
+    'ce', 'ces', 'cet', 'cette', 'est', 'sont', 'que', 'qui', 'quoi', 'dans', 'par',
+    'pour', 'sur', 'avec', 'il', 'elle', 'ils', 'elles', 'on', 'se', 'sa', 'son', 'ses',
+    'the', 'of', 'and', 'to', 'in', 'is', 'a', 'an', 'for', 'on', 'with', 'what', 'how'
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Minuscules, sans accents, mots de 2 caracteres et plus hors mots vides"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return [
+        token for token in TOKEN_PATTERN.findall(text)
+        if (len(token) > 1 or token.isdigit()) and token not in STOPWORDS
+    ]
+
+
+class PostingsBuffer:
+    """Postings de chunks a ajouter, accumules au fil de l'ingestion: tableaux d'entiers
+    compacts (terme, document, tf), le texte des chunks n'est pas garde"""
+
+    def __init__(self):
+        self.vocabulary = {}
+        self.chunk_ids = []
+        self.lengths = array('i')
+        self.terms = array('i')
+        self.docs = array('i')
+        self.tfs = array('i')
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def add(self, chunk_id: str, text: str):
+        tokens = tokenize(text)
+        doc = len(self.chunk_ids)
+        self.chunk_ids.append(chunk_id.encode('utf-8'))
+        self.lengths.append(len(tokens))
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, tf in counts.items():
+            self.terms.append(self.vocabulary.setdefault(token, len(self.vocabulary)))
+            self.docs.append(doc)
+            self.tfs.append(tf)
+
+
+class BM25Index:
+    """Index inverse au format CSR: pour le terme t, ses postings sont
+    doc_ids[indptr[t]:indptr[t+1]] avec les poids BM25 (hors idf) precalcules.
+
+    Les tf bruts et longueurs de documents sont conserves: `update` retire et ajoute
+    des chunks (diff du manifeste) sans relire le corpus, puis recalcule les poids.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.tfs = np.zeros(0, dtype=np.float32)
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+        self.weights = np.zeros(0, dtype=np.float32)
+        self.idf = np.zeros(0, dtype=np.float32)
+        self.chunk_ids = np.zeros(0, dtype='S1')
+        self.fingerprint = None
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    @property
+    def updatable(self) -> bool:
+        """False pour un index d'un ancien format (sans tf bruts): reconstruction necessaire"""
+        return self.tfs is not None
+
+    def build(self, chunks: Iterable[Tuple[str, str]], fingerprint: Optional[str] = None) -> 'BM25Index':
+        """Construire l'index a partir de paires (chunk_id, texte)"""
+        buffer = PostingsBuffer()
+        for chunk_id, text in chunks:
+            buffer.add(chunk_id, text)
+        return self.update(buffer, fingerprint=fingerprint)
+
+    def update(self, added: PostingsBuffer, removed: Iterable[str] = (),
+               fingerprint: Optional[str] = None) -> 'BM25Index':
+        """Retirer les chunks `removed`, ajouter (ou remplacer) ceux de `added`, recalculer les poids"""
+        if not self.updatable:
+            raise ValueError("Index BM25 sans tf bruts (ancien format): reconstruction necessaire")
+        removed = {chunk_id.encode('utf-8') for chunk_id in removed} | set(added.chunk_ids)
+        keep_docs = ~np.isin(self.chunk_ids, np.asarray(sorted(removed))) if removed and len(self) \
+            else np.ones(len(self), dtype=bool)
+        doc_map = np.cumsum(keep_docs) - 1
+        keep_entries = keep_docs[self.doc_ids]
+        kept_docs = int(keep_docs.sum())
+
+        # Postings en COO (terme, document, tf): anciens conserves + ajoutes, vocabulaire fusionne
+        vocabulary = dict(self.vocabulary)
+        added_terms = np.asarray(
+            [vocabulary.setdefault(term, len(vocabulary)) for term in added.vocabulary], dtype=np.int64
+        )
+        old_terms = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64), np.diff(self.indptr))
+        terms = np.concatenate([old_terms[keep_entries],
+                                added_terms[np.frombuffer(added.terms, dtype=np.int32)] if len(added.terms)
+                                else np.zeros(0, dtype=np.int64)])
+        docs = np.concatenate([doc_map[self.doc_ids[keep_entries]],
+                               kept_docs + np.frombuffer(added.docs, dtype=np.int32).astype(np.int64)])
+        tfs = np.concatenate([self.tfs[keep_entries], np.frombuffer(added.tfs, dtype=np.int32).astype(np.float32)])
+
+        # Termes sans postings retires, vocabulaire renumerote dans l'ordre alphabetique
+        counts = np.bincount(terms, minlength=len(vocabulary))
+        live_terms = sorted(term for term, term_id in vocabulary.items() if counts[term_id])
+        remap = np.full(len(vocabulary), -1, dtype=np.int64)
+        remap[[vocabulary[term] for term in live_terms]] = np.arange(len(live_terms))
+        terms = remap[terms]
+        order = np.lexsort((docs, terms))
+
+        self.vocabulary = {term: term_id for term_id, term in enumerate(live_terms)}
+        sizes = np.bincount(terms, minlength=len(live_terms)).astype(np.int64)
+        self.indptr = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+        self.doc_ids = docs[order].astype(np.int32)
+        self.tfs = tfs[order].astype(np.float32)
+        self.doc_lengths = np.concatenate([self.doc_lengths[keep_docs],
+                                           np.frombuffer(added.lengths, dtype=np.int32).astype(np.float32)])
+        width = max([len(chunk_id) for chunk_id in added.chunk_ids] + [self.chunk_ids.dtype.itemsize, 1])
+        self.chunk_ids = np.concatenate([self.chunk_ids[keep_docs].astype(f'S{width}'),
+                                         np.asarray(added.chunk_ids, dtype=f'S{width}')])
+        self._compute_weights()
+        self.fingerprint = fingerprint
+        return self
+
+    def _compute_weights(self):
+        n_docs = len(self.chunk_ids)
+        avg_length = float(self.doc_lengths.mean()) if n_docs else 0.0
+        # Partie tf/longueur de BM25 precalculee: la requete n'a plus qu'a multiplier par idf
+        lengths = self.doc_lengths[self.doc_ids]
+        norm = self.k1 * (1 - self.b + self.b * lengths / max(avg_length, 1e-9))
+        self.weights = (self.tfs * (self.k1 + 1) / (self.tfs + norm)).astype(np.float32)
+        sizes = np.diff(self.indptr).astype(np.float32)
+        self.idf = np.log(1 + (n_docs - sizes + 0.5) / (sizes + 0.5)).astype(np.float32)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """Top-k (chunk_id, score BM25)"""
+        term_ids = [self.vocabulary[token] for token in set(tokenize(query)) if token in self.vocabulary]
+        if not term_ids:
+            return []
+
+        docs = []
+        scores = []
+        for term_id in term_ids:
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs.append(self.doc_ids[start:end])
+            scores.append(self.weights[start:end] * self.idf[term_id])
+        docs = np.concatenate(docs)
+        scores = np.concatenate(scores)
+
+        candidates, inverse = np.unique(docs, return_inverse=True)
+        totals = np.bincount(inverse, weights=scores)
+        k = min(k, len(candidates))
+        top = np.argpartition(-totals, k - 1)[:k] if k < len(candidates) else np.arange(len(candidates))
+        top = top[np.argsort(-totals[top])]
+        return [(self.chunk_ids[candidates[i]].decode('utf-8'), float(totals[i])) for i in top]
+
+    def save(self, path: Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        tmp_path = path.with_name(path.name + '.tmp.npz')
+        np.savez(
+            tmp_path,
+            terms=np.asarray(terms, dtype=str) if terms else np.zeros(0, dtype='U1'),
+            indptr=self.indptr,
+            doc_ids=self.doc_ids,
+            weights=self.weights,
+            tfs=self.tfs if self.tfs is not None else np.zeros(0, dtype=np.float32),
+            doc_lengths=self.doc_lengths if self.doc_lengths is not None else np.zeros(0, dtype=np.float32),
+            updatable=np.asarray(self.updatable),
+            idf=self.idf,
+            chunk_ids=self.chunk_ids,
+            params=np.asarray([self.k1, self.b], dtype=np.float32),
+            fingerprint=np.asarray(self.fingerprint or '')
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional['BM25Index']:
+        path = Path(path)
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            k1, b = (float(value) for value in data['params'])
+            index = cls(k1=k1, b=b)
+            index.vocabulary = {str(term): term_id for term_id, term in enumerate(data['terms'])}
+            index.indptr = data['indptr']
+            index.doc_ids = data['doc_ids']
+            index.weights = data['weights']
+            if 'updatable' in data.files and bool(data['updatable']):
+                index.tfs = data['tfs']
+                index.doc_lengths = data['doc_lengths']
+            else:
+                index.tfs = index.doc_lengths = None
+            index.idf = data['idf']
+            index.chunk_ids = data['chunk_ids']
+            index.fingerprint = str(data['fingerprint']) or None
+        return index
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'documents': len(self),
+            'terms': len(self.vocabulary),
+            'postings': int(len(self.doc_ids)),
+            'size_bytes': int(self.indptr.nbytes + self.doc_ids.nbytes + self.weights.nbytes
+                              + self.idf.nbytes + self.chunk_ids.nbytes
+                              + (self.tfs.nbytes + self.doc_lengths.nbytes if self.updatable else 0))
+        }
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Fusion RRF: score(d) = somme sur les listes de 1 / (k + rang)"""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, 1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Telemetrie des appels LLM - Seance 5
+Tokens (prompt / completion) et latence de generation de chaque appel, agreges sur une
+fenetre glissante: debit en tokens/s, latence p50/p95, tokens par type de question
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from typing import Dict, Any, Optional
+
+import numpy as np
+
+
+class LLMTelemetry:
+    """Fenetre glissante des `window_size` derniers appels LLM (partagee entre sessions).
+
+    Les totaux depuis le demarrage sont conserves a part: la fenetre sert aux
+    percentiles et au debit recent, les totaux a la planification des couts.
+    """
+
+    def __init__(self, window_size: int = 1000):
+        self.window_size = max(1, window_size)
+        self.calls = deque(maxlen=self.window_size)
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+
+        self.total_calls = 0
+        self.total_prompt_tokens = 0
+        self.total_completion_tokens = 0
+        self.estimated_calls = 0
+
+    @classmethod
+    def from_env(cls) -> 'LLMTelemetry':
+        return cls(window_size=int(os.getenv('RAG_TELEMETRY_WINDOW', '1000')))
+
+    def record(self, question_type: str, prompt_tokens: int, completion_tokens: int,
+               latency_s: Optional[float], source: str = 'api', method: str = 'search_rag'):
+        """Un appel LLM termine (`source`: 'api' si l'usage vient de la reponse, 'estimate' sinon)"""
+        with self.lock:
+            self.calls.append({
+                'timestamp': time.time(),
+                'question_type': question_type,
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'latency_s': latency_s,
+                'source': source,
+                'method': method
+            })
+            self.total_calls += 1
+            self.total_prompt_tokens += prompt_tokens
+            self.total_completion_tokens += completion_tokens
+            if source != 'api':
+                self.estimated_calls += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            calls = list(self.calls)
+            totals = {
+                'calls': self.total_calls,
+                'prompt_tokens': self.total_prompt_tokens,
+                'completion_tokens': self.total_completion_tokens,
+                'tokens': self.total_prompt_tokens + self.total_completion_tokens,
+                'estimated_calls': self.estimated_calls,
+                'uptime_s': round(time.time() - self.started_at, 1)
+            }
+
+        stats = {'window_size': self.window_size, 'window_calls': len(calls), 'totals': totals}
+        if not calls:
+            return stats
+
+        latencies = np.array([call['latency_s'] for call in calls if call['latency_s']], dtype=np.float64)
+        completion_tokens = sum(call['completion_tokens'] for call in calls)
+        timed_completion_tokens = sum(call['completion_tokens'] for call in calls if call['latency_s'])
+        stats['window'] = {
+            'prompt_tokens': sum(call['prompt_tokens'] for call in calls),
+            'completion_tokens': completion_tokens,
+            'tokens_per_second': round(timed_completion_tokens / latencies.sum(), 2) if len(latencies) else 0.0,
+            'latency_p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 1) if len(latencies) else None,
+            'latency_p95_ms': round(float(np.percentile(latencies, 95)) * 1000, 1) if len(latencies) else None,
+            'span_s': round(calls[-1]['timestamp'] - calls[0]['timestamp'], 1)
+        }
+
+        by_type = {}
+        for call in calls:
+            entry = by_type.setdefault(call['question_type'], {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0})
+            entry['calls'] += 1
+            entry['prompt_tokens'] += call['prompt_tokens']
+            entry['completion_tokens'] += call['completion_tokens']
+        for entry in by_type.values():
+            entry['avg_tokens_per_query'] = round((entry['prompt_tokens'] + entry['completion_tokens']) / entry['calls'], 1)
+        stats['by_question_type'] = by_type
+        return stats
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+Vector store embarque NumPy - Seance 5
+Matrice float32 normalisee + tableau compact de metadonnees, persistes en .npy et memory-mappes;
+codes quantifies optionnels (int8 / binaire) pour la recherche grossiere
+"""
+
+import os
+import json
+import mmap
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from langchain.schema import Document
+
+from quantization import QuantizationConfig, write_codes, load_codes
+
+COPY_BLOCK_ROWS = 65536
+# Lignes de codes decodees a la fois (int8 -> float32: 25 Mo en 384 dimensions)
+QUANTIZED_SCAN_ROWS = 16384
+# Requetes traitees ensemble pendant le parcours des codes
+QUANTIZED_QUERY_BLOCK = 16
+
+
+class _SharedLock:
+    """Verrou lecteurs/ecrivain: recherches en parallele, remplacement des fichiers mappes exclusif"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+
+    @contextmanager
+    def shared(self):
+        with self.condition:
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        # Attend la fin des recherches en cours; les nouvelles attendent la liberation
+        with self.condition:
+            self.condition.wait_for(lambda: not self.readers)
+            yield
+
+
+class NumpyVectorStore:
+    """Alternative en memoire a PGVector pour les deploiements en lecture intensive.
+
+    Fichiers dans `directory`:
+    - vectors.npy          matrice (N, D) float32, lignes normalisees (cosinus = produit scalaire)
+    - ids.npy              custom_id de chaque ligne (chaines de longueur fixe)
+    - payload.bin          contenu + metadonnees de chaque ligne (JSON utf-8 concatene)
+    - payload_offsets.npy  offsets int64 (N + 1) des lignes dans payload.bin
+    - codes.npy            codes quantifies (N, L) si RAG_VECTOR_QUANTIZATION != none
+    - quantizer.json       parametres du quantificateur (mode, echelles)
+
+    Avec quantification, seuls les codes sont parcourus a chaque requete; la matrice
+    float32 reste sur disque (memory-map) et seules les lignes des candidats re-classes
+    sont lues: la memoire de travail est celle des codes (4x ou 32x plus petite).
+
+    save() ecrit une nouvelle version dans `directory.tmp` puis l'echange par deux renommages
+    (`directory` -> `directory.old`, `directory.tmp` -> `directory`); load() restaure
+    `directory.old` si un arret a eu lieu entre les deux. Les recherches tiennent le verrou
+    partage: les fichiers mappes ne sont fermes qu'une fois les recherches en cours terminees.
+    """
+
+    def __init__(self, directory: Path, embedding_function=None,
+                 quantization: Optional[QuantizationConfig] = None):
+        self.directory = Path(directory)
+        self.embedding_function = embedding_function
+        self.quantization = quantization or QuantizationConfig()
+        self.lock = _SharedLock()
+        self.vectors = None
+        self.codes = None
+        self.quantizer = None
+        self.ids = None
+        self.offsets = None
+        self.payload = None
+        self._payload_file = None
+        self._vectors_file = None
+        self.id_to_row = {}
+        self.pending = []  # (id, vecteur normalise, contenu, metadonnees)
+        self.deleted = set()
+        self.load()
+
+    # ------------------------------------------------------------------
+    # Persistance
+    # ------------------------------------------------------------------
+    def load(self):
+        """Mapper les fichiers existants en memoire (lecture seule)"""
+        backup_dir = self._backup_dir()
+        if not self.directory.exists() and backup_dir.exists():
+            # Arret entre les deux renommages de save(): la version precedente est intacte
+            print(f"[WARN] Store NumPy incomplet, restauration de {backup_dir.name}")
+            os.replace(backup_dir, self.directory)
+        vectors_path = self.directory / "vectors.npy"
+        if not vectors_path.exists():
+            return
+        vectors = np.load(vectors_path, mmap_mode='r')
+        ids = np.load(self.directory / "ids.npy", mmap_mode='r')
+        offsets = np.load(self.directory / "payload_offsets.npy", mmap_mode='r')
+
+        payload_file = open(self.directory / "payload.bin", 'rb')
+        size = os.fstat(payload_file.fileno()).st_size
+        payload = mmap.mmap(payload_file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+        id_to_row = {row_id.decode('utf-8'): row for row, row_id in enumerate(ids.tolist())}
+        quantized = self._load_codes(len(vectors))
+        # Re-classement: lignes candidates lues par pread (pas de pages voisines mappees)
+        vectors_file = open(vectors_path, 'rb') if quantized else None
+        with self.lock.exclusive():
+            self._close_payload()
+            self.vectors, self.ids, self.offsets = vectors, ids, offsets
+            self.payload, self._payload_file = payload, payload_file
+            self.id_to_row = id_to_row
+            self.quantizer, self.codes = quantized or (None, None)
+            self._vectors_file = vectors_file
+
+    def _load_codes(self, rows: int) -> Optional[tuple]:
+        """Codes du mode configure; (re)construits depuis vectors.npy si absents ou d'un autre mode"""
+        if not self.quantization.enabled or not rows:
+            return None
+        quantized = load_codes(self.directory, self.quantization.mode, rows)
+        if quantized is None:
+            print(f"[INFO] Construction des codes {self.quantization.mode} ({rows} vecteurs)...")
+            # Mapping temporaire: les pages float32 lues ici ne restent pas dans self.vectors
+            vectors = np.load(self.directory / "vectors.npy", mmap_mode='r')
+            write_codes(self.directory, vectors, self.quantization.mode)
+            del vectors
+            quantized = load_codes(self.directory, self.quantization.mode, rows)
+        return quantized
+
+    def _backup_dir(self) -> Path:
+        return self.directory.with_name(self.directory.name + ".old")
+
+    def _close_payload(self):
+        if isinstance(self.payload, mmap.mmap):
+            self.payload.close()
+        if self._payload_file is not None:
+            self._payload_file.close()
+        if self._vectors_file is not None:
+            self._vectors_file.close()
+        self.payload, self._payload_file, self._vectors_file = None, None, None
+
+    def save(self):
+        """Ecrire les ajouts/suppressions en attente puis re-mapper les fichiers"""
+        if not self.pending and not self.deleted:
+            return
+
+        pending_ids = {row_id for row_id, _, _, _ in self.pending}
+        keep_rows = [
+            row for row_id, row in self.id_to_row.items()
+            if row_id not in self.deleted and row_id not in pending_ids
+        ]
+        keep_rows.sort()
+        pending = [item for item in self.pending if item[0] not in self.deleted]
+
+        dim = self.vectors.shape[1] if self.vectors is not None else (
+            pending[0][1].shape[0] if pending else 0
+        )
+        total = len(keep_rows) + len(pending)
+        id_width = max([len(row_id.encode('utf-8')) for row_id, _, _, _ in pending] +
+                       [self.ids.dtype.itemsize if self.ids is not None else 1])
+
+        tmp_dir = self.directory.with_name(self.directory.name + ".tmp")
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        tmp_dir.mkdir(parents=True)
+
+        vectors_out = np.lib.format.open_memmap(tmp_dir / "vectors.npy", mode='w+',
+                                                dtype=np.float32, shape=(total, dim))
+        ids_out = np.empty(total, dtype=f'S{id_width}')
+        offsets_out = np.empty(total + 1, dtype=np.int64)
+        offsets_out[0] = 0
+
+        with open(tmp_dir / "payload.bin", 'wb') as payload_out:
+            position = 0
+            # Lignes conservees: copie par blocs depuis les fichiers mappes
+            for start in range(0, len(keep_rows), COPY_BLOCK_ROWS):
+                block = keep_rows[start:start + COPY_BLOCK_ROWS]
+                vectors_out[start:start + len(block)] = self.vectors[block]
+                ids_out[start:start + len(block)] = self.ids[block]
+                for i, row in enumerate(block, start):
+                    data = self.payload[int(self.offsets[row]):int(self.offsets[row + 1])]
+                    payload_out.write(data)
+                    position += len(data)
+                    offsets_out[i + 1] = position
+
+            # Nouvelles lignes
+            base = len(keep_rows)
+            for i, (row_id, vector, content, metadata) in enumerate(pending, base):
+                vectors_out[i] = vector
+                ids_out[i] = row_id.encode('utf-8')
+                data = json.dumps({'c': content, 'm': metadata}, ensure_ascii=False).encode('utf-8')
+                payload_out.write(data)
+                position += len(data)
+                offsets_out[i + 1] = position
+
+        vectors_out.flush()
+        if self.quantization.enabled and total:
+            write_codes(tmp_dir, vectors_out, self.quantization.mode)
+        del vectors_out
+        np.save(tmp_dir / "ids.npy", ids_out)
+        np.save(tmp_dir / "payload_offsets.npy", offsets_out)
+        for path in tmp_dir.iterdir():
+            with open(path, 'rb') as written:
+                os.fsync(written.fileno())
+
+        # Echange par renommages: a tout instant `directory` ou `directory.old` est complet.
+        # Les fichiers deja mappes restent lisibles apres renommage: les recherches en
+        # cours continuent sur l'ancienne version jusqu'au load() (verrou exclusif)
+        backup_dir = self._backup_dir()
+        if backup_dir.exists():
+            shutil.rmtree(backup_dir)
+        if self.directory.exists():
+            os.replace(self.directory, backup_dir)
+        os.replace(tmp_dir, self.directory)
+        self.pending = []
+        self.deleted = set()
+        self.load()
+        shutil.rmtree(backup_dir, ignore_errors=True)
+
+    def clear(self):
+        """Vider le store (reconstruction complete)"""
+        with self.lock.exclusive():
+            self._close_payload()
+            self.vectors = self.ids = self.offsets = self.codes = self.quantizer = None
+            self.id_to_row = {}
+        self.pending = []
+        self.deleted = set()
+        for directory in (self.directory, self._backup_dir()):
+            if directory.exists():
+                shutil.rmtree(directory)
+
+    def __len__(self) -> int:
+        return len(self.id_to_row)
+
+    # ------------------------------------------------------------------
+    # Ecriture (meme interface que PGVector pour le pipeline d'ingestion)
+    # ------------------------------------------------------------------
+    def add_embeddings(self, texts: List[str], embeddings: List[List[float]],
+                       metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None, **kwargs):
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(i) for i in range(len(self) + len(self.pending), len(self) + len(self.pending) + len(texts))]
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+        for row_id, vector, text, metadata in zip(ids, vectors, texts, metadatas):
+            self.deleted.discard(row_id)
+            self.pending.append((row_id, vector, text, metadata))
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs):
+        if ids:
+            deleted = set(ids)
+            self.pending = [item for item in self.pending if item[0] not in deleted]
+            self.deleted.update(row_id for row_id in deleted if row_id in self.id_to_row)
+
+    # ------------------------------------------------------------------
+    # Recherche
+    # ------------------------------------------------------------------
+    def _row_document(self, row: int) -> Document:
+        data = json.loads(bytes(self.payload[int(self.offsets[row]):int(self.offsets[row + 1])]))
+        return Document(page_content=data['c'], metadata=data['m'])
+
+    def search_vectors(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k pour une ou plusieurs requetes: (indices, similarites cosinus) tries"""
+        with self.lock.shared():
+            return self._search_vectors(queries, k)
+
+    def _search_vectors(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        vectors = self.vectors
+        if vectors is None or not len(vectors):
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        codes, quantizer = self.codes, self.quantizer
+        if codes is not None and self.quantization.candidates(k) < len(codes):
+            return self._search_quantized(queries, k, vectors, codes, quantizer)
+
+        scores = (vectors @ queries.T).T
+        k = min(k, scores.shape[1])
+        if k < scores.shape[1]:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(scores.shape[1]), (len(queries), 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def _read_rows(self, vectors: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Lignes float32 lues dans vectors.npy sans passer par le memory-map: le fault-around
+        du noyau mapperait les pages voisines et le RSS rejoindrait la taille de la matrice"""
+        vectors_file = self._vectors_file
+        if vectors_file is None:
+            return np.asarray(vectors[rows], dtype=np.float32)
+        row_bytes = vectors.shape[1] * 4
+        fd = vectors_file.fileno()
+        data = b''.join(os.pread(fd, row_bytes, vectors.offset + int(row) * row_bytes) for row in rows)
+        return np.frombuffer(data, dtype=np.float32).reshape(len(rows), vectors.shape[1])
+
+    def _search_quantized(self, queries: np.ndarray, k: int, vectors: np.ndarray, codes: np.ndarray,
+                          quantizer) -> Tuple[np.ndarray, np.ndarray]:
+        """Parcours des codes (top k * oversample approche) puis re-classement exact en float32"""
+        candidates = self.quantization.candidates(k)
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        for query_start in range(0, len(queries), QUANTIZED_QUERY_BLOCK):
+            block_queries = queries[query_start:query_start + QUANTIZED_QUERY_BLOCK]
+            # Meilleurs candidats courants, fusionnes bloc par bloc (memoire bornee)
+            best_rows = np.empty((len(block_queries), 0), dtype=np.int64)
+            best_scores = np.empty((len(block_queries), 0), dtype=np.float32)
+            for start in range(0, len(codes), QUANTIZED_SCAN_ROWS):
+                block_scores = quantizer.scores(codes[start:start + QUANTIZED_SCAN_ROWS], block_queries)
+                rows = np.broadcast_to(np.arange(start, start + block_scores.shape[1]), block_scores.shape)
+                best_rows = np.concatenate([best_rows, rows], axis=1)
+                best_scores = np.concatenate([best_scores, block_scores], axis=1)
+                if best_scores.shape[1] > candidates:
+                    keep = np.argpartition(-best_scores, candidates - 1, axis=1)[:, :candidates]
+                    best_rows = np.take_along_axis(best_rows, keep, axis=1)
+                    best_scores = np.take_along_axis(best_scores, keep, axis=1)
+
+            for i, (query, rows) in enumerate(zip(block_queries, best_rows), query_start):
+                # Lignes triees: lectures dans l'ordre du fichier
+                rows = np.sort(rows)
+                exact = self._read_rows(vectors, rows) @ query
+                top = np.argpartition(-exact, k - 1)[:k]
+                top = top[np.argsort(-exact[top])]
+                indices[i], scores[i] = rows[top], exact[top]
+        return indices, scores
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                                **kwargs) -> List[Tuple[Document, float]]:
+        with self.lock.shared():
+            indices, scores = self._search_vectors(np.asarray(embedding, dtype=np.float32), k)
+            # Distance cosinus comme pgvector: 1 - similarite
+            return [(self._row_document(int(row)), float(1 - score)) for row, score in zip(indices[0], scores[0])]
+
+    def similarity_search_with_score_by_vectors(self, embeddings: List[List[float]], k: int = 4,
+                                                 block_size: int = 256) -> List[List[Tuple[Document, float]]]:
+        """Recherche multi-requetes: un produit matriciel par bloc de `block_size` requetes"""
+        results = []
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        for start in range(0, len(embeddings), block_size):
+            with self.lock.shared():
+                indices, scores = self._search_vectors(embeddings[start:start + block_size], k)
+                results.extend(
+                    [(self._row_document(int(row)), float(1 - score)) for row, score in zip(rows, row_scores)]
+                    for rows, row_scores in zip(indices, scores)
+                )
+        return results
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k=k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k)]
+
+    def get_by_ids(self, ids: List[str]) -> Dict[str, Document]:
+        """Contenu des chunks par custom_id (absents ignores)"""
+        with self.lock.shared():
+            id_to_row = self.id_to_row
+            return {row_id: self._row_document(id_to_row[row_id]) for row_id in ids if row_id in id_to_row}
+
+    def get_vectors_by_ids(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        """Vecteurs normalises stockes (lignes lues par pread si quantification), absents ignores"""
+        with self.lock.shared():
+            found = [(row_id, self.id_to_row[row_id]) for row_id in ids if row_id in self.id_to_row]
+            if not found or self.vectors is None:
+                return {}
+            rows = self._read_rows(self.vectors, np.asarray([row for _, row in found], dtype=np.int64))
+            return {row_id: vector for (row_id, _), vector in zip(found, rows)}
+
+    def get_stats(self) -> Dict[str, Any]:
+        matrix_bytes = int(self.vectors.nbytes) if self.vectors is not None else 0
+        code_bytes = int(self.codes.nbytes) if self.codes is not None else 0
+        return {
+            'backend': 'numpy',
+            'vectors': len(self),
+            'dimension': int(self.vectors.shape[1]) if self.vectors is not None else 0,
+            'matrix_bytes': matrix_bytes,
+            'quantization': self.quantization.mode if self.codes is not None else 'none',
+            'code_bytes': code_bytes,
+            # Octets parcourus par requete (memoire de travail de la recherche)
+            'scan_bytes': code_bytes or matrix_bytes,
+            'compression_ratio': round(matrix_bytes / code_bytes, 1) if code_bytes else 1.0,
+            'oversample': self.quantization.oversample if self.codes is not None else None
+        }
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Ecriture en masse dans la table langchain_pg_embedding - Seance 5
+COPY ... FROM STDIN (format texte ou binaire) au lieu des INSERT ligne a ligne de l'ORM
+"""
+
+import io
+import json
+import uuid
+import struct
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+import psycopg2
+
+EMBEDDING_TABLE = "langchain_pg_embedding"
+COLLECTION_TABLE = "langchain_pg_collection"
+COPY_COLUMNS = "(uuid, collection_id, embedding, document, cmetadata, custom_id)"
+
+PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('!h', -1)
+
+
+def _escape_copy_text(value: str) -> str:
+    """Echappement du format texte de COPY"""
+    return (value.replace('\\', '\\\\')
+                 .replace('\t', '\\t')
+                 .replace('\n', '\\n')
+                 .replace('\r', '\\r'))
+
+
+class PGVectorBulkWriter:
+    """Upsert par lots dans la collection PGVector via COPY FROM STDIN.
+
+    Les lignes sont accumulees jusqu'a `batch_size`, puis chaque lot est ecrit
+    dans une transaction: suppression des custom_id existants puis COPY.
+    Avec `pool`, la connexion est empruntee au pool partage et lui est rendue a la fin.
+    """
+
+    def __init__(self, db_params: Dict[str, Any], collection_name: str,
+                 copy_format: str = 'text', batch_size: int = 5000, connection=None, pool=None):
+        if copy_format not in ('text', 'binary'):
+            raise ValueError(f"Format COPY inconnu: {copy_format} (text ou binary)")
+        self.db_params = db_params
+        self.collection_name = collection_name
+        self.copy_format = copy_format
+        self.batch_size = max(1, batch_size)
+        self.conn = connection
+        self.pool = pool
+        self.owns_connection = connection is None
+        self.collection_id = None
+        self.jsonb_metadata = False
+        self.pending = []
+        self.rows_written = 0
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = self.pool.raw_connection() if self.pool is not None else psycopg2.connect(**self.db_params)
+        if self.collection_id is None:
+            with self.conn.cursor() as cursor:
+                cursor.execute(f"SELECT uuid FROM {COLLECTION_TABLE} WHERE name = %s", (self.collection_name,))
+                row = cursor.fetchone()
+                if not row:
+                    raise ValueError(f"Collection {self.collection_name} introuvable")
+                self.collection_id = uuid.UUID(str(row[0]))
+
+                # cmetadata est JSON ou JSONB selon la version de langchain
+                cursor.execute(
+                    "SELECT data_type FROM information_schema.columns "
+                    "WHERE table_name = %s AND column_name = 'cmetadata'",
+                    (EMBEDDING_TABLE,)
+                )
+                row = cursor.fetchone()
+                self.jsonb_metadata = bool(row) and row[0] == 'jsonb'
+            self.conn.commit()
+        return self.conn
+
+    def add_embeddings(self, texts: List[str], embeddings: List[List[float]],
+                       metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None):
+        """Ajouter des lignes au lot courant (ecrit des que batch_size est atteint)"""
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        for row in zip(texts, embeddings, metadatas, ids):
+            self.pending.append(row)
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """Ecrire le lot en attente"""
+        if not self.pending:
+            return
+        conn = self._connect()
+        rows, self.pending = self.pending, []
+
+        if self.copy_format == 'binary':
+            buffer = self._encode_binary(rows)
+            copy_sql = f"COPY {EMBEDDING_TABLE} {COPY_COLUMNS} FROM STDIN WITH (FORMAT binary)"
+        else:
+            buffer = self._encode_text(rows)
+            copy_sql = f"COPY {EMBEDDING_TABLE} {COPY_COLUMNS} FROM STDIN"
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {EMBEDDING_TABLE} WHERE collection_id = %s AND custom_id = ANY(%s)",
+                    (str(self.collection_id), [row[3] for row in rows])
+                )
+                cursor.copy_expert(copy_sql, buffer)
+            conn.commit()
+            self.rows_written += len(rows)
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _encode_text(self, rows) -> io.StringIO:
+        collection_id = str(self.collection_id)
+        lines = []
+        for text, embedding, metadata, custom_id in rows:
+            vector = '[' + ','.join(repr(float(x)) for x in embedding) + ']'
+            lines.append('\t'.join((
+                str(uuid.uuid4()),
+                collection_id,
+                vector,
+                _escape_copy_text(text),
+                _escape_copy_text(json.dumps(metadata, ensure_ascii=False)),
+                _escape_copy_text(custom_id)
+            )))
+        return io.StringIO('\n'.join(lines) + '\n')
+
+    def _encode_binary(self, rows) -> io.BytesIO:
+        buffer = io.BytesIO()
+        buffer.write(PGCOPY_HEADER)
+        collection_id = self.collection_id.bytes
+        field_count = struct.pack('!h', 6)
+        for text, embedding, metadata, custom_id in rows:
+            vector = np.asarray(embedding, dtype='>f4')
+            # Format binaire pgvector: dim (int16), reserve (int16), float4[]
+            vector_bytes = struct.pack('!HH', vector.shape[0], 0) + vector.tobytes()
+            metadata_bytes = json.dumps(metadata, ensure_ascii=False).encode('utf-8')
+            if self.jsonb_metadata:
+                metadata_bytes = b'\x01' + metadata_bytes
+
+            buffer.write(field_count)
+            for field in (uuid.uuid4().bytes, collection_id, vector_bytes,
+                          text.encode('utf-8'), metadata_bytes, custom_id.encode('utf-8')):
+                buffer.write(struct.pack('!i', len(field)))
+                buffer.write(field)
+        buffer.write(PGCOPY_TRAILER)
+        buffer.seek(0)
+        return buffer
+
+    def abort(self):
+        """Abandonner le lot en attente (pipeline en echec)"""
+        self.pending = []
+        if self.conn is not None and self.owns_connection:
+            self.conn.close()
+            self.conn = None
+
+    def close(self):
+        """Ecrire le dernier lot et liberer la connexion"""
+        try:
+            self.flush()
+        finally:
+            if self.conn is not None and self.owns_connection:
+                self.conn.close()
+                self.conn = None
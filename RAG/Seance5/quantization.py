@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Quantification des embeddings du store NumPy - Seance 5
+Codes int8 (scalaire, 4x plus petits) ou binaires (bit de signe, 32x) parcourus en
+recherche grossiere; les meilleurs candidats sont re-classes sur les vecteurs float32
+"""
+
+import os
+import json
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+import numpy as np
+
+QUANTIZATION_MODES = ('none', 'int8', 'binary')
+# Candidats re-classes en float32 = k * facteur (le binaire perd plus d'information)
+DEFAULT_OVERSAMPLE = {'int8': 4, 'binary': 40}
+SCAN_BLOCK_ROWS = 65536
+
+# Masques du comptage de bits par mots de 64 bits (SWAR)
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+
+
+def popcount64(words: np.ndarray) -> np.ndarray:
+    """Nombre de bits a 1 de chaque uint64 (numpy < 2 n'a pas bitwise_count)"""
+    words = words - ((words >> np.uint64(1)) & _M1)
+    words = (words & _M2) + ((words >> np.uint64(2)) & _M2)
+    words = (words + (words >> np.uint64(4))) & _M4
+    return (words * _H01) >> np.uint64(56)
+
+
+class QuantizationConfig:
+    """Mode de quantification lu depuis .env (RAG_VECTOR_QUANTIZATION)"""
+
+    def __init__(self, mode: str = 'none', oversample: int = 0, min_candidates: int = 64):
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Quantification inconnue: {mode} (none, int8 ou binary)")
+        self.mode = mode
+        self.oversample = oversample or DEFAULT_OVERSAMPLE.get(mode, 1)
+        self.min_candidates = min_candidates
+
+    @classmethod
+    def from_env(cls) -> 'QuantizationConfig':
+        return cls(
+            mode=os.getenv('RAG_VECTOR_QUANTIZATION', 'none').lower(),
+            oversample=int(os.getenv('RAG_QUANTIZATION_OVERSAMPLE', '0')),
+            min_candidates=int(os.getenv('RAG_QUANTIZATION_MIN_CANDIDATES', '64'))
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != 'none'
+
+    def candidates(self, k: int) -> int:
+        return max(k * self.oversample, self.min_candidates)
+
+
+class ScalarQuantizer:
+    """int8 symetrique par dimension: code = round(v / echelle), echelle = max|v| / 127"""
+
+    kind = 'int8'
+    dtype = np.int8
+
+    def __init__(self, scale: np.ndarray):
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray) -> 'ScalarQuantizer':
+        peak = np.zeros(vectors.shape[1], dtype=np.float32)
+        for start in range(0, len(vectors), SCAN_BLOCK_ROWS):
+            block = np.abs(np.asarray(vectors[start:start + SCAN_BLOCK_ROWS], dtype=np.float32))
+            np.maximum(peak, block.max(axis=0), out=peak)
+        return cls(np.maximum(peak, 1e-12) / 127.0)
+
+    def code_width(self, dimension: int) -> int:
+        return dimension
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def scores(self, codes: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """Produit scalaire approche (requetes, lignes): l'echelle est appliquee a la requete"""
+        return (queries * self.scale) @ np.asarray(codes, dtype=np.float32).T
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'kind': self.kind, 'scale': self.scale.tolist()}
+
+
+class BinaryQuantizer:
+    """Bit de signe de chaque dimension; similarite = dimension - 2 * distance de Hamming"""
+
+    kind = 'binary'
+    dtype = np.uint8
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray) -> 'BinaryQuantizer':
+        return cls(vectors.shape[1])
+
+    def code_width(self, dimension: int) -> int:
+        # Complete a un multiple de 8 octets pour le comptage de bits par uint64
+        return -(-dimension // 64) * 8
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        bits = np.packbits(np.asarray(vectors) > 0, axis=1)
+        width = self.code_width(self.dimension)
+        if bits.shape[1] < width:
+            bits = np.pad(bits, ((0, 0), (0, width - bits.shape[1])))
+        return bits
+
+    def scores(self, codes: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        words = np.ascontiguousarray(codes).view(np.uint64)
+        query_words = self.encode(queries).view(np.uint64)
+        scores = np.empty((len(queries), len(words)), dtype=np.float32)
+        for i, query in enumerate(query_words):
+            hamming = popcount64(words ^ query).sum(axis=1)
+            scores[i] = self.dimension - 2.0 * hamming
+        return scores
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'kind': self.kind, 'dimension': self.dimension}
+
+
+QUANTIZERS = {'int8': ScalarQuantizer, 'binary': BinaryQuantizer}
+
+
+def quantizer_from_dict(data: Dict[str, Any]):
+    if data.get('kind') == 'int8':
+        return ScalarQuantizer(np.asarray(data['scale'], dtype=np.float32))
+    if data.get('kind') == 'binary':
+        return BinaryQuantizer(int(data['dimension']))
+    raise ValueError(f"Quantificateur inconnu: {data.get('kind')}")
+
+
+def write_codes(directory: Path, vectors: np.ndarray, mode: str):
+    """Entrainer le quantificateur et ecrire codes.npy + quantizer.json (ecrit en dernier:
+    sa presence marque des codes complets)"""
+    directory = Path(directory)
+    quantizer = QUANTIZERS[mode].fit(vectors)
+    rows, dimension = vectors.shape
+    codes = np.lib.format.open_memmap(directory / "codes.npy", mode='w+', dtype=quantizer.dtype,
+                                      shape=(rows, quantizer.code_width(dimension)))
+    for start in range(0, rows, SCAN_BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + SCAN_BLOCK_ROWS], dtype=np.float32)
+        codes[start:start + len(block)] = quantizer.encode(block)
+    codes.flush()
+    del codes
+    with open(directory / "quantizer.json", 'w', encoding='utf-8') as f:
+        json.dump(dict(quantizer.to_dict(), rows=rows), f)
+
+
+def load_codes(directory: Path, mode: str, rows: int) -> Optional[tuple]:
+    """(quantificateur, codes memory-mappes), ou None si absents ou d'un autre mode"""
+    directory = Path(directory)
+    try:
+        with open(directory / "quantizer.json", 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get('kind') != mode or data.get('rows') != rows or not (directory / "codes.npy").exists():
+        return None
+    return quantizer_from_dict(data), np.load(directory / "codes.npy", mmap_mode='r')
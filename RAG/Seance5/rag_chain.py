@@ -5,9 +5,16 @@ MEME ARCHITECTURE que Seance 4, mais avec chargement automatique des documents .
 """
 
 import os
+import re
 import json
+import unicodedata
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
-from typing import List, Dict, Any, Optional
+import numpy as np
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator, Tuple, Callable
 from datetime import datetime
 from pathlib import Path
 
@@ -19,14 +26,20 @@ except ImportError:
 
 try:
     import litellm
-    from litellm import completion
+    from litellm import completion, acompletion
     LITELLM_AVAILABLE = True
 except ImportError:
     LITELLM_AVAILABLE = False
 
+# Client HTTP asynchrone (mode ASGI): connexions keep-alive partagees
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
 # LangChain OBLIGATOIRE pour Séance 5
 try:
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
     from langchain_community.embeddings import HuggingFaceEmbeddings
     from langchain_community.vectorstores import PGVector
     from langchain.schema import Document
@@ -37,15 +50,160 @@ except ImportError as e:
     print("Installation requise: pip install langchain langchain-community")
     raise ImportError("LangChain est OBLIGATOIRE pour la Séance 5") from e
 
+from chunker import StreamingChunker
+from dedup import NearDuplicateFilter
+from corpus_manifest import CorpusManifest, ManifestFingerprint, hash_file, hash_text, make_chunk_id
+from embedding_cache import CachedEmbeddings, QueryEmbeddingLRU
+from ingestion_pipeline import IngestionPipeline
+from pgvector_bulk import PGVectorBulkWriter
+from vector_index import PGVectorIndexManager, VectorIndexConfig, OPERATOR_CLASSES, collection_predicate
+from numpy_store import NumpyVectorStore
+from quantization import QuantizationConfig
+from lexical_index import BM25Index, PostingsBuffer, reciprocal_rank_fusion
+from semantic_cache import SemanticAnswerCache
+from db_pool import DatabasePool, AsyncDatabasePool, ASYNCPG_AVAILABLE
+from session_store import SessionStore
+from context_packer import ContextPacker
+from llm_telemetry import LLMTelemetry
+from tracing import Tracer
+import tracing
+
+# Marqueurs de reference au contexte conversationnel precedent
+CONTEXT_INDICATORS = [
+    'cette', 'cela', 'ca', 'precedent', 'precedente', 'precedemment', 'ci-dessus', 'avant',
+    'le point', 'la point', 'point', 'cette information',
+    'ce que tu as dit', 'tu as mentionne', 'plus haut',
+    'dans ta reponse', 'tu disais', 'ses', 'son', 'sa',
+    'leurs', 'leur', 'elle', 'il', 'ils', 'elles'
+]
+CONTEXT_WORDS_PATTERN = re.compile(
+    r"\b(?:" + "|".join(re.escape(indicator) for indicator in CONTEXT_INDICATORS) + r")\b"
+)
+
+CODESTRAL_CHAT_URL = "https://codestral.mistral.ai/v1/chat/completions"
+
+def usage_from_response(usage) -> Optional[Dict[str, int]]:
+    """Champ `usage` d'une reponse de l'API (dict JSON ou objet litellm) -> tokens prompt / completion"""
+    if not usage:
+        return None
+    if not isinstance(usage, dict):
+        usage = {name: getattr(usage, name, None) for name in ('prompt_tokens', 'completion_tokens')}
+    if usage.get('prompt_tokens') is None and usage.get('completion_tokens') is None:
+        return None
+    return {
+        'prompt_tokens': int(usage.get('prompt_tokens') or 0),
+        'completion_tokens': int(usage.get('completion_tokens') or 0)
+    }
+
+def parse_sse_line(line: str) -> Tuple[bool, Optional[str], Optional[Dict[str, int]]]:
+    """Ligne Server-Sent Events de l'API -> (flux termine, fragment de texte, usage)
+    (l'usage en tokens arrive avec le dernier fragment)"""
+    if not line or not line.startswith('data:'):
+        return False, None, None
+    data = line[len('data:'):].strip()
+    if data == '[DONE]':
+        return True, None, None
+    payload = json.loads(data)
+    choices = payload.get('choices') or [{}]
+    return False, (choices[0].get('delta') or {}).get('content'), usage_from_response(payload.get('usage'))
+
+class SharedAsyncHTTPClient:
+    """httpx.AsyncClient partage par toutes les sessions (keep-alive), recree si la
+    boucle d'evenements change"""
+    
+    def __init__(self, max_connections: int = 200, timeout: float = 60):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.client = None
+        self.loop = None
+    
+    def get(self) -> 'httpx.AsyncClient':
+        loop = asyncio.get_running_loop()
+        if self.client is None or self.loop is not loop:
+            self.client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+            self.loop = loop
+        return self.client
+    
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
 class PostgreSQLRAGSystem:
     """Systeme RAG avec PostgreSQL + pgvector - IDENTIQUE Seance 4 mais avec corpus .md"""
     
-    def __init__(self, session_name: str = None):
+    # Ressources lourdes partagees entre sessions (modele, index, caches, pool)
+    SHARED_ATTRIBUTES = (
+        'api_key', 'sessions_dir', 'session_store', 'index_dir', 'corpus_base_dir', 'corpus_fingerprint',
+        'manifest_fingerprint', 'index_manager',
+        'vector_backend', 'hybrid_search', 'rrf_k', 'lexical_index', 'answer_cache',
+        'splitter_config', 'db_params', 'db_pool', 'embedding_model_name', 'embeddings',
+        'pgvector_config', 'vector_store', 'async_db_pool', 'async_http', 'batch_concurrency',
+        'context_packer', 'llm_telemetry', 'tracer', 'query_embeddings', 'near_duplicates'
+    )
+    
+    def __init__(self, session_name: str = None, on_progress: Optional[Callable[[str], None]] = None):
         self.session_name = session_name or f"session_seance5_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         self.api_key = os.getenv('CODESTRAL_API_KEY')
         self.conversation_history = []
-        self.sessions_dir = Path(__file__).parent / "sessions"
-        self.sessions_dir.mkdir(exist_ok=True)
+        self.persisted_turns = None  # echanges deja dans le journal (None: reecrire)
+        self.session_lock = threading.RLock()
+        self.sessions_dir = Path(os.getenv('RAG_SESSIONS_DIR', Path(__file__).parent / "sessions"))
+        self.sessions_dir.mkdir(parents=True, exist_ok=True)
+        self.session_store = SessionStore.shared(self.sessions_dir)
+        self.index_dir = Path(os.getenv('RAG_INDEX_DIR', Path(__file__).parent / "index_data"))
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        # Dossier contenant Corpus/ (corpus synthetique du benchmark par exemple)
+        self.corpus_base_dir = Path(os.getenv('RAG_CORPUS_BASE_DIR', Path(__file__).parent))
+        self.corpus_fingerprint = None
+        self.manifest_fingerprint = None  # empreinte relue si un autre processus re-indexe
+        self.index_manager = None
+        
+        # Backend vectoriel: pgvector (PostgreSQL) ou numpy (index embarque memory-mappe)
+        self.vector_backend = os.getenv('RAG_VECTOR_BACKEND', 'pgvector').lower()
+        
+        # Recherche hybride: BM25 + vecteurs fusionnes par RRF
+        self.hybrid_search = os.getenv('RAG_HYBRID_SEARCH', 'true').lower() in ('1', 'true', 'yes')
+        self.rrf_k = int(os.getenv('RAG_RRF_K', '60'))
+        self.lexical_index = None
+        
+        # Cache semantique des reponses (questions non contextuelles)
+        self.answer_cache = None
+        if os.getenv('RAG_SEMANTIC_CACHE', 'true').lower() in ('1', 'true', 'yes'):
+            self.answer_cache = SemanticAnswerCache.from_env()
+        
+        # Vecteurs des questions recentes en memoire (cle: texte aux espaces normalises)
+        self.query_embeddings = QueryEmbeddingLRU.from_env()
+        
+        # Requetes par lot (query_many): appels LLM simultanes au maximum
+        self.batch_concurrency = int(os.getenv('RAG_BATCH_CONCURRENCY', '8'))
+        
+        # Tokens et latence des appels LLM (fenetre glissante, /api/rag/stats)
+        self.llm_telemetry = LLMTelemetry.from_env()
+        
+        # Traces par etape des requetes (RAG_TRACING, export OTLP/JSON via RAG_TRACE_FILE)
+        self.tracer = Tracer.shared()
+        
+        # Quasi-doublons SimHash ecartes a l'ingestion et des resultats de recherche
+        self.near_duplicates = NearDuplicateFilter.from_env()
+        
+        # Decoupage des documents (CHUNK_SIZE / CHUNK_OVERLAP dans .env); 'strategy' et le
+        # filtre de doublons dans le manifeste: les changer impose une reconstruction
+        self.splitter_config = {
+            'chunk_size': int(os.getenv('CHUNK_SIZE', '1000')),
+            'chunk_overlap': int(os.getenv('CHUNK_OVERLAP', '200')),
+            'strategy': 'markdown_stream',
+            'near_duplicates': self.near_duplicates.config
+        }
+        
+        # Contexte du prompt sous budget de tokens (RAG_CONTEXT_TOKEN_BUDGET)
+        self.context_packer = ContextPacker.from_env(chunk_overlap=self.splitter_config['chunk_overlap'])
         
         # Configuration PostgreSQL depuis .env
         self.db_params = {
@@ -56,10 +214,23 @@ class PostgreSQLRAGSystem:
             "password": os.getenv('DB_PASSWORD')
         }
         
+        # Pool de connexions partage par tous les acces PostgreSQL (ouverture paresseuse)
+        self.db_pool = DatabasePool.shared(self.db_params)
+        
+        # Mode asynchrone (ASGI): pool asyncpg et client HTTP keep-alive, crees a la demande
+        self.async_db_pool = AsyncDatabasePool.from_env(self.db_params, self.db_pool) if ASYNCPG_AVAILABLE else None
+        self.async_http = SharedAsyncHTTPClient(
+            max_connections=int(os.getenv('RAG_ASYNC_HTTP_MAX_CONNECTIONS', '200'))
+        ) if HTTPX_AVAILABLE else None
+        
         # Setup LangChain + PostgreSQL (obligatoire)
+        if on_progress:
+            on_progress('loading_model')
         self._setup_langchain_postgresql()
         
         # Charger les documents (.md pour Seance 5)
+        if on_progress:
+            on_progress('indexing')
         self._load_documents()
         
         print(f"[INIT] PostgreSQL RAG System Seance 5 - Session: {self.session_name}")
@@ -67,10 +238,20 @@ class PostgreSQLRAGSystem:
     def _setup_langchain_postgresql(self):
         """Configurer LangChain avec PostgreSQL + pgvector"""
         try:
-            # Embeddings
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name="sentence-transformers/all-MiniLM-L6-v2"
+            # Embeddings (avec cache disque devant le modele)
+            self.embedding_model_name = os.getenv('RAG_MODEL', "sentence-transformers/all-MiniLM-L6-v2")
+            base_embeddings = HuggingFaceEmbeddings(
+                model_name=self.embedding_model_name
             )
+            if os.getenv('RAG_EMBEDDING_CACHE', 'true').lower() in ('1', 'true', 'yes'):
+                self.embeddings = CachedEmbeddings(
+                    base_embeddings,
+                    model_name=self.embedding_model_name,
+                    cache_dir=self.index_dir / "embedding_cache",
+                    max_entries=int(os.getenv('RAG_EMBEDDING_CACHE_MAX_ENTRIES', '200000'))
+                )
+            else:
+                self.embeddings = base_embeddings
             
             # Connection string pour PGVector
             connection_string = f"postgresql://{self.db_params['user']}:{self.db_params['password']}@{self.db_params['host']}:{self.db_params['port']}/{self.db_params['database']}"
@@ -84,11 +265,7 @@ class PostgreSQLRAGSystem:
             }
             
             # Memoire conversationnelle LangChain
-            self.memory = ConversationBufferWindowMemory(
-                memory_key="chat_history",
-                return_messages=True,
-                k=10
-            )
+            self.memory = self._create_memory()
             
             # Le vector store sera cree lors du chargement des documents
             self.vector_store = None
@@ -100,168 +277,616 @@ class PostgreSQLRAGSystem:
             self.embeddings = None
             self.memory = None
     
+    @staticmethod
+    def _create_memory():
+        return ConversationBufferWindowMemory(
+            memory_key="chat_history",
+            return_messages=True,
+            k=10
+        )
+    
+    def spawn_session(self, session_name: str = None) -> 'PostgreSQLRAGSystem':
+        """Nouvelle session legere: historique et memoire propres, ressources lourdes
+        (embeddings, vector store, index, caches, pool) partagees avec cette instance"""
+        session = object.__new__(type(self))
+        for name in self.SHARED_ATTRIBUTES:
+            setattr(session, name, getattr(self, name, None))
+        session.session_name = session_name or f"session_seance5_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        session.conversation_history = []
+        session.persisted_turns = None
+        session.session_lock = threading.RLock()
+        session.memory = self._create_memory() if getattr(self, 'memory', None) is not None else None
+        return session
+    
     def _load_documents(self):
-        """Charger et indexer les documents .md dans PostgreSQL via LangChain"""
+        """Indexer le corpus (.md + .txt) de maniere incrementale via le manifeste.
+
+        Seuls les chunks nouveaux ou modifies sont vectorises, les chunks des
+        fichiers modifies ou supprimes sont retires de PostgreSQL.
+        """
         if not hasattr(self, 'embeddings') or not self.embeddings:
             print("[ERROR] Embeddings non initialises")
             return
         
+        with self.tracer.trace('rag.load_documents', backend=self.vector_backend):
+            try:
+                start_time = time.monotonic()
+                
+                collection_name = self.pgvector_config['collection_name']
+                if self.vector_backend == 'numpy':
+                    # Index embarque: aucune base de donnees dans le chemin des requetes
+                    store = NumpyVectorStore(self.index_dir / f"{collection_name}_numpy", self.embeddings,
+                                             QuantizationConfig.from_env())
+                    manifest_name = f"{collection_name}_numpy_manifest.json"
+                else:
+                    # Cree la collection si elle n'existe pas encore
+                    store = PGVector(
+                        connection_string=self.pgvector_config['connection_string'],
+                        embedding_function=self.embeddings,
+                        collection_name=collection_name,
+                        distance_strategy=self.pgvector_config['distance_strategy'],
+                        connection=self.db_pool.engine
+                    )
+                    manifest_name = f"{collection_name}_manifest.json"
+                
+                with tracing.span('manifest_load'):
+                    manifest = CorpusManifest(
+                        self.index_dir / manifest_name,
+                        collection_name=collection_name,
+                        splitter_config=self.splitter_config
+                    ).load()
+                
+                force_reindex = os.getenv('RAG_FORCE_REINDEX', '').lower() in ('1', 'true', 'yes')
+                store_lost = isinstance(store, NumpyVectorStore) and not len(store) and manifest.total_chunks()
+                if force_reindex or store_lost or not manifest.is_compatible():
+                    # Collection sans manifeste (ancien format) ou decoupage modifie:
+                    # les IDs des chunks existants sont inconnus, on repart de zero
+                    print(f"[INFO] Reconstruction complete de la collection {collection_name}")
+                    if isinstance(store, NumpyVectorStore):
+                        store.clear()
+                    else:
+                        store.delete_collection()
+                        store.create_collection()
+                    manifest.reset()
+                
+                # Etat du corpus avant cette indexation: l'index BM25 qui lui correspond est
+                # mis a jour avec le diff (chunks ajoutes / supprimes), sans relire le corpus
+                lexical_base = manifest.fingerprint()
+                lexical_from_empty = not manifest.total_chunks()
+                lexical_added = PostingsBuffer() if self.hybrid_search else None
+                
+                chunker = StreamingChunker(
+                    chunk_size=self.splitter_config['chunk_size'],
+                    chunk_overlap=self.splitter_config['chunk_overlap']
+                )
+                
+                base_dir = self.corpus_base_dir
+                with tracing.span('discover_files') as discover_span:
+                    corpus_files = self._discover_corpus_files(base_dir)
+                    discover_span.set_attribute('files', len(corpus_files))
+                
+                ids_to_delete = []
+                counters = {'changed_files': 0}
+                
+                pipeline = IngestionPipeline.from_env(self.embeddings, self.embedding_model_name)
+                bulk_writer = self._make_bulk_writer() if not isinstance(store, NumpyVectorStore) else None
+                try:
+                    # Decoupage, vectorisation et ecriture en parallele (threads/processus de la pipeline)
+                    with tracing.span('ingest') as ingest_span:
+                        ingest_stats = pipeline.run(
+                            self._iter_changed_chunks(manifest, corpus_files, base_dir, chunker, ids_to_delete, counters,
+                                                      lexical_added),
+                            writer=lambda documents, vectors: self._write_chunks(store, documents, vectors, bulk_writer)
+                        )
+                        if bulk_writer:
+                            bulk_writer.close()
+                        ingest_span.set_attribute('chunks', ingest_stats['chunks'])
+                        ingest_span.set_attribute('workers', ingest_stats['workers'])
+                except Exception:
+                    if bulk_writer:
+                        bulk_writer.abort()
+                    raise
+                
+                # Fichiers supprimes du corpus
+                for relative_path in manifest.vanished_files(
+                    str(file_path.relative_to(base_dir)) for file_path, _ in corpus_files
+                ):
+                    removed = manifest.remove_file(relative_path)
+                    ids_to_delete.extend(removed)
+                    print(f"[REMOVE] {relative_path}: -{len(removed)} chunks")
+                
+                if ids_to_delete:
+                    with tracing.span('delete_chunks', chunks=len(ids_to_delete)):
+                        store.delete(ids=ids_to_delete, collection_only=True)
+                
+                if isinstance(store, NumpyVectorStore):
+                    with tracing.span('store_save'):
+                        store.save()
+                else:
+                    with tracing.span('vector_index'):
+                        self._setup_vector_index(store)
+                with tracing.span('manifest_save'):
+                    manifest.save()
+                self.vector_store = store
+                if self.manifest_fingerprint is None:
+                    self.manifest_fingerprint = ManifestFingerprint(manifest)
+                self.corpus_fingerprint = self.manifest_fingerprint.set(manifest)
+                
+                if self.hybrid_search:
+                    with tracing.span('lexical_index'):
+                        self._setup_lexical_index(
+                            self.index_dir / manifest_name.replace('_manifest.json', '_bm25.npz'),
+                            corpus_files, base_dir, chunker,
+                            delta=(lexical_base, lexical_from_empty, lexical_added, ids_to_delete)
+                        )
+                
+                elapsed = time.monotonic() - start_time
+                if counters['changed_files'] or ids_to_delete:
+                    print(f"[INDEX] {counters['changed_files']} fichiers modifies, {ingest_stats['chunks']} chunks indexes "
+                          f"({ingest_stats['chunks_per_second']} chunks/s, {ingest_stats['workers']} workers), "
+                          f"{len(ids_to_delete)} chunks supprimes en {elapsed:.2f}s "
+                          f"({manifest.total_chunks()} chunks au total)")
+                else:
+                    print(f"[INFO] Collection {collection_name} ({self.vector_backend}) a jour "
+                          f"({manifest.total_chunks()} chunks, verifie en {elapsed:.2f}s)")
+                    
+            except Exception as e:
+                print(f"[ERROR] Chargement documents: {e}")
+                self.vector_store = None
+    
+    def _setup_vector_index(self, store):
+        """Creer/mettre a jour l'index ANN (HNSW ou IVFFlat) et regler les recherches"""
+        collection_name = self.pgvector_config['collection_name']
+        self.index_manager = PGVectorIndexManager(
+            self.db_params,
+            collection_name,
+            VectorIndexConfig.from_env(self.pgvector_config['distance_strategy']),
+            self.index_dir / f"{collection_name}_vector_index.json",
+            pool=self.db_pool
+        )
+        if not self.index_manager.config.enabled:
+            return
+        try:
+            self.index_manager.ensure_index()
+            self.index_manager.apply_search_settings(store)
+        except Exception as e:
+            print(f"[WARNING] Index vectoriel {self.index_manager.config.index_type}: {e}")
+    
+    def _setup_lexical_index(self, index_path: Path, corpus_files: List[tuple], base_dir: Path, chunker,
+                             delta: Optional[tuple] = None):
+        """Charger l'index BM25 et lui appliquer le diff de l'indexation (`delta`: empreinte du
+        corpus avant, corpus vide avant, postings ajoutes, IDs supprimes). Reconstruction
+        complete seulement si l'index ne correspond pas a l'etat de depart (absent, ancien
+        format, indexation precedente interrompue)"""
         try:
-            # Vérifier si la collection existe déjà avec des documents
+            index = BM25Index.load(index_path)
+            base_fingerprint, from_empty, added, removed = delta or (None, False, None, ())
+            if from_empty and added is not None:
+                index = BM25Index()
+                base_fingerprint = index.fingerprint
+            incremental = (
+                index is not None and index.updatable and added is not None
+                and index.fingerprint == base_fingerprint
+            )
+            if index is not None and index.fingerprint == self.corpus_fingerprint:
+                pass
+            elif incremental:
+                start = time.monotonic()
+                index.update(added, removed, fingerprint=self.corpus_fingerprint)
+                index.save(index_path)
+                print(f"[BM25] Index lexical mis a jour: +{len(added)} / -{len(removed)} chunks "
+                      f"({len(index)} chunks, {len(index.vocabulary)} termes) en {time.monotonic() - start:.2f}s")
+            else:
+                start = time.monotonic()
+                chunks = (
+                    (chunk.metadata['chunk_id'], chunk.page_content)
+                    for chunk in self._iter_corpus_chunks(corpus_files, base_dir, chunker)
+                )
+                index = BM25Index().build(chunks, fingerprint=self.corpus_fingerprint)
+                index.save(index_path)
+                print(f"[BM25] Index lexical construit: {len(index)} chunks, "
+                      f"{len(index.vocabulary)} termes en {time.monotonic() - start:.2f}s")
+            self.lexical_index = index
+        except Exception as e:
+            print(f"[WARNING] Index lexical BM25 indisponible: {e}")
+            self.lexical_index = None
+    
+    def _iter_corpus_chunks(self, corpus_files: List[tuple], base_dir: Path, chunker: StreamingChunker):
+        """Tous les chunks du corpus (memes IDs que ceux du vector store)"""
+        for file_path, document_type in corpus_files:
+            relative_path = str(file_path.relative_to(base_dir))
+            try:
+                yield from self._split_corpus_file(file_path, relative_path, document_type, chunker, record=False)
+            except Exception as e:
+                print(f"[ERROR] {file_path.name}: {e}")
+    
+    def _iter_changed_chunks(self, manifest: CorpusManifest, corpus_files: List[tuple], base_dir: Path,
+                             chunker: StreamingChunker, ids_to_delete: List[str], counters: Dict[str, int],
+                             lexical_added: Optional[PostingsBuffer] = None):
+        """Generer les chunks nouveaux ou modifies (etage lecture/decoupage du pipeline).
+
+        Les chunks d'un fichier sont produits au fil de la lecture: seuls leurs IDs sont
+        gardes jusqu'a la mise a jour du manifeste en fin de fichier (et leurs postings
+        BM25 dans `lexical_added`, sans le texte).
+        """
+        for file_path, document_type in corpus_files:
+            relative_path = str(file_path.relative_to(base_dir))
             try:
-                existing_store = PGVector(
-                    connection_string=self.pgvector_config['connection_string'],
-                    embedding_function=self.embeddings,
-                    collection_name=self.pgvector_config['collection_name']
+                stat = file_path.stat()
+                if manifest.is_unchanged(relative_path, stat.st_size, stat.st_mtime):
+                    continue
+                
+                file_hash = hash_file(file_path)
+                entry = manifest.get_file(relative_path)
+                if entry and entry.get('file_hash') == file_hash:
+                    manifest.touch_file(relative_path, stat.st_size, stat.st_mtime)
+                    continue
+                
+                old_ids = set(manifest.chunk_ids(relative_path))
+                chunk_ids = []
+                dropped_before = self.near_duplicates.ingest_dropped
+                for chunk in self._split_corpus_file(file_path, relative_path, document_type, chunker):
+                    chunk_ids.append(chunk.metadata['chunk_id'])
+                    if chunk_ids[-1] not in old_ids:
+                        if lexical_added is not None:
+                            lexical_added.add(chunk_ids[-1], chunk.page_content)
+                        yield chunk
+                
+                to_add, to_delete = manifest.update_file(
+                    relative_path, file_hash, stat.st_size, stat.st_mtime, chunk_ids
                 )
-                # Test de recherche pour voir si des documents existent
-                test_docs = existing_store.similarity_search("test", k=1)
-                if test_docs:
-                    print(f"[INFO] Collection {self.pgvector_config['collection_name']} existe déjà avec {len(test_docs)} documents")
-                    self.vector_store = existing_store
-                    return
+                ids_to_delete.extend(to_delete)
+                counters['changed_files'] += 1
+                dropped = self.near_duplicates.ingest_dropped - dropped_before
+                print(f"[LOAD] {file_path.name}: +{len(to_add)} / -{len(to_delete)} chunks"
+                      + (f" ({dropped} quasi-doublons ignores)" if dropped else ""))
+            
             except Exception as e:
-                print(f"[INFO] Collection n'existe pas encore, création: {e}")
+                print(f"[ERROR] {file_path.name}: {e}")
+    
+    def _make_bulk_writer(self) -> Optional[PGVectorBulkWriter]:
+        """Writer COPY FROM STDIN (RAG_BULK_WRITE=copy) ou None pour les INSERT de l'ORM"""
+        if os.getenv('RAG_BULK_WRITE', 'copy').lower() != 'copy':
+            return None
+        return PGVectorBulkWriter(
+            self.db_params,
+            self.pgvector_config['collection_name'],
+            copy_format=os.getenv('RAG_COPY_FORMAT', 'text').lower(),
+            batch_size=int(os.getenv('RAG_COPY_BATCH_SIZE', '5000')),
+            pool=self.db_pool
+        )
+    
+    def _write_chunks(self, store, documents: List[Document], vectors: List[List[float]],
+                      bulk_writer: Optional[PGVectorBulkWriter] = None):
+        """Ecrire un lot de chunks vectorises (upsert par custom_id)"""
+        ids = [doc.metadata['chunk_id'] for doc in documents]
+        if bulk_writer is not None:
+            bulk_writer.add_embeddings(
+                texts=[doc.page_content for doc in documents],
+                embeddings=vectors,
+                metadatas=[doc.metadata for doc in documents],
+                ids=ids
+            )
+            return
+        
+        # Purger d'abord: une indexation interrompue ne laisse pas de doublons a la reprise
+        store.delete(ids=ids, collection_only=True)
+        store.add_embeddings(
+            texts=[doc.page_content for doc in documents],
+            embeddings=vectors,
+            metadatas=[doc.metadata for doc in documents],
+            ids=ids
+        )
+    
+    def _discover_corpus_files(self, base_dir: Path) -> List[tuple]:
+        """Lister les fichiers du corpus: (chemin, type de document)"""
+        corpus_files = []
+        loaded_files = set()  # Pour éviter les doublons
+        
+        # SEANCE 5: les fichiers .md du dossier "Corpus/Corpus documentaire" (pas récursif)
+        corpus_dir = base_dir / "Corpus" / "Corpus documentaire"
+        if corpus_dir.exists():
+            for md_file in sorted(corpus_dir.glob("*.md")):
+                if md_file.name not in loaded_files:
+                    corpus_files.append((md_file, 'markdown'))
+                    loaded_files.add(md_file.name)
+                else:
+                    print(f"[SKIP] {md_file.name} (déjà chargé)")
+        else:
+            print(f"[WARNING] Dossier corpus non trouvé: {corpus_dir}")
+        
+        # Tous les fichiers .txt du dossier Corpus (corpus_intelligence_artificielle.txt, gymWiki.txt, etc.)
+        corpus_base_dir = base_dir / "Corpus"
+        if corpus_base_dir.exists():
+            for txt_file in sorted(corpus_base_dir.glob("*.txt")):
+                if txt_file.name not in loaded_files:
+                    corpus_files.append((txt_file, 'text'))
+                    loaded_files.add(txt_file.name)
+                else:
+                    print(f"[SKIP] {txt_file.name} (déjà chargé)")
+        
+        return corpus_files
+    
+    def _split_corpus_file(self, file_path: Path, relative_path: str, document_type: str,
+                           chunker: StreamingChunker, record: bool = True) -> Iterator[Document]:
+        """Lire et decouper un fichier en flux (Unicode conserve); chaque chunk recoit un ID
+        deterministe et le chemin des titres markdown qui le precedent. Les quasi-doublons
+        d'un chunk deja produit pour ce fichier sont ecartes avant vectorisation."""
+        loaded_at = datetime.now().isoformat()
+        occurrences = {}
+        chunks = ((text, heading_path) for text, heading_path in chunker.split_file(file_path) if text.strip())
+        for (text, heading_path), fingerprint in self.near_duplicates.unique(chunks, lambda chunk: chunk[0], record):
+            chunk_hash = hash_text(text)
+            occurrence = occurrences.get(chunk_hash, 0)
+            occurrences[chunk_hash] = occurrence + 1
+            metadata = {
+                'source': str(file_path),
+                'filename': file_path.name,
+                'relative_path': relative_path,
+                'session': self.session_name,
+                'document_type': document_type,
+                'loaded_at': loaded_at,
+                'heading_path': heading_path,
+                'chunk_hash': chunk_hash,
+                'chunk_id': make_chunk_id(relative_path, chunk_hash, occurrence)
+            }
+            if fingerprint is not None:
+                metadata['simhash'] = f"{fingerprint:016x}"
+            yield Document(page_content=text, metadata=metadata)
+    
+    def search_documents(self, query: str, k: int = 5, query_vector: Optional[List[float]] = None) -> List[Dict]:
+        """Rechercher dans le vector store (PGVector ou index NumPy embarque).
+
+        Si l'index BM25 est disponible, les resultats vectoriels et lexicaux
+        sont fusionnes par Reciprocal Rank Fusion. `query_vector` evite de
+        recalculer l'embedding de la question s'il est deja connu.
+        """
+        if not self.vector_store:
+            return []
+        
+        try:
+            hybrid = self.lexical_index is not None and len(self.lexical_index) > 0
+            fetch_k = k * 2 if hybrid else k
             
-            documents = []
-            base_dir = Path(__file__).parent
+            # Recherche avec scores de similarite
+            if query_vector is None:
+                query_vector = self._embed_question(query)
+            with tracing.span('vector_search', backend=self.vector_backend, k=fetch_k):
+                docs_with_scores = self.vector_store.similarity_search_with_score_by_vector(query_vector, k=fetch_k)
+            results = [self._format_search_result(doc, score) for doc, score in docs_with_scores]
             
-            # SEANCE 5: Charger UNIQUEMENT les fichiers .md du dossier "Corpus/Corpus documentaire"
-            corpus_dir = base_dir / "Corpus" / "Corpus documentaire"
-            loaded_files = set()  # Pour éviter les doublons
-            total_files = 0
+            if hybrid:
+                with tracing.span('lexical_fusion'):
+                    results = self._fuse_lexical_results(query, results, fetch_k, query_vector)
             
-            if corpus_dir.exists():
-                print(f"[INFO] Chargement depuis: {corpus_dir}")
-                # Charger tous les .md dans ce dossier UNIQUEMENT (pas récursif)
-                for md_file in corpus_dir.glob("*.md"):
-                    file_key = md_file.name
-                    
-                    if file_key not in loaded_files:
-                        try:
-                            with open(md_file, 'r', encoding='utf-8') as f:
-                                content = f.read()
-                            
-                            # Nettoyer les caracteres non-ASCII
-                            content = content.encode('ascii', errors='ignore').decode('ascii')
-                            
-                            if content.strip():  # Ignorer fichiers vides
-                                doc = Document(
-                                    page_content=content,
-                                    metadata={
-                                        'source': str(md_file),
-                                        'filename': md_file.name,
-                                        'relative_path': str(md_file.relative_to(base_dir)),
-                                        'session': self.session_name,
-                                        'document_type': 'markdown',
-                                        'loaded_at': datetime.now().isoformat()
-                                    }
-                                )
-                                documents.append(doc)
-                                loaded_files.add(file_key)
-                                total_files += 1
-                                print(f"[LOAD] {md_file.name}")
-                        
-                        except Exception as e:
-                            print(f"[ERROR] {md_file.name}: {e}")
-                    else:
-                        print(f"[SKIP] {file_key} (déjà chargé)")
-            else:
-                print(f"[WARNING] Dossier corpus non trouvé: {corpus_dir}")
-                
-            # Ajouter tous les fichiers .txt du dossier Corpus (corpus_intelligence_artificielle.txt, gymWiki.txt, etc.)
-            corpus_base_dir = base_dir / "Corpus"
-            if corpus_base_dir.exists():
-                print(f"[INFO] Recherche fichiers .txt dans: {corpus_base_dir}")
-                for txt_file in corpus_base_dir.glob("*.txt"):
-                    file_key = txt_file.name
-                    
-                    if file_key not in loaded_files:
-                        try:
-                            with open(txt_file, 'r', encoding='utf-8') as f:
-                                content = f.read()
-                            
-                            content = content.encode('ascii', errors='ignore').decode('ascii')
-                            
-                            if content.strip():
-                                doc = Document(
-                                    page_content=content,
-                                    metadata={
-                                        'source': str(txt_file),
-                                        'filename': txt_file.name,
-                                        'relative_path': str(txt_file.relative_to(base_dir)),
-                                        'session': self.session_name,
-                                        'document_type': 'text',
-                                        'loaded_at': datetime.now().isoformat()
-                                    }
-                                )
-                                documents.append(doc)
-                                loaded_files.add(file_key)
-                                total_files += 1
-                                print(f"[LOAD] {txt_file.name}")
-                        
-                        except Exception as e:
-                            print(f"[ERROR] {txt_file.name}: {e}")
-                    else:
-                        print(f"[SKIP] {file_key} (déjà chargé)")
+            return results[:k]
+        except Exception as e:
+            print(f"[ERROR] Recherche PostgreSQL: {e}")
+            return []
+    
+    def search_documents_many(self, queries: List[str], query_vectors: List[List[float]],
+                              k: int = 5) -> List[List[Dict]]:
+        """Recherche pour plusieurs questions en une seule requete vectorielle
+        (produit matriciel NumPy ou LATERAL pgvector), fusion BM25 par question"""
+        if not self.vector_store or not queries:
+            return [[] for _ in queries]
+        
+        try:
+            hybrid = self.lexical_index is not None and len(self.lexical_index) > 0
+            fetch_k = k * 2 if hybrid else k
             
+            if hasattr(self.vector_store, 'similarity_search_with_score_by_vectors'):
+                batches = self.vector_store.similarity_search_with_score_by_vectors(query_vectors, k=fetch_k)
+            else:
+                batches = self._pgvector_search_many(query_vectors, fetch_k)
             
-            if documents:
-                # Text splitter
-                splitter = RecursiveCharacterTextSplitter(
-                    chunk_size=1000,
-                    chunk_overlap=200
-                )
-                splits = splitter.split_documents(documents)
-                
-                # Creer le vector store PostgreSQL via LangChain
-                self.vector_store = PGVector.from_documents(
-                    documents=splits,
-                    embedding=self.embeddings,
-                    connection_string=self.pgvector_config['connection_string'],
-                    collection_name=self.pgvector_config['collection_name'],
-                    distance_strategy=self.pgvector_config['distance_strategy']
+            all_results = []
+            for query, query_vector, docs_with_scores in zip(queries, query_vectors, batches):
+                results = [self._format_search_result(doc, score) for doc, score in docs_with_scores]
+                if hybrid:
+                    results = self._fuse_lexical_results(query, results, fetch_k, query_vector)
+                all_results.append(results[:k])
+            return all_results
+        except Exception as e:
+            print(f"[ERROR] Recherche multiple: {e} - recherche question par question")
+            return [
+                self.search_documents(query, k=k, query_vector=query_vector)
+                for query, query_vector in zip(queries, query_vectors)
+            ]
+    
+    def _pgvector_search_many(self, query_vectors: List[List[float]], k: int,
+                              block_size: int = 256) -> List[List[Tuple[Document, float]]]:
+        """Top-k de chaque vecteur en une requete par bloc (CROSS JOIN LATERAL, index ANN utilise)"""
+        _, operator = OPERATOR_CLASSES[self.pgvector_config['distance_strategy']]
+        results = []
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT uuid FROM langchain_pg_collection WHERE name = %s",
+                    (self.pgvector_config['collection_name'],)
                 )
+                row = cursor.fetchone()
+                if row is None:
+                    return [[] for _ in query_vectors]
+                collection_id = row[0]
                 
-                print(f"[INDEX] {total_files} fichiers traites, {len(splits)} chunks indexes dans PostgreSQL")
-            else:
-                print("[WARNING] Aucun document charge")
-                
-        except Exception as e:
-            print(f"[ERROR] Chargement documents: {e}")
-            self.vector_store = None
+                for start in range(0, len(query_vectors), block_size):
+                    block = query_vectors[start:start + block_size]
+                    literals = ['[' + ','.join(repr(float(value)) for value in vector) + ']' for vector in block]
+                    cursor.execute(
+                        f"SELECT q.ord, r.document, r.cmetadata, r.distance "
+                        f"FROM unnest(%s::text[]) WITH ORDINALITY AS q(vec, ord) "
+                        f"CROSS JOIN LATERAL ("
+                        f"  SELECT e.document, e.cmetadata, e.embedding {operator} q.vec::vector AS distance "
+                        f"  FROM langchain_pg_embedding e WHERE {collection_predicate(collection_id, 'e')} "
+                        f"  ORDER BY e.embedding {operator} q.vec::vector LIMIT %s"
+                        f") r ORDER BY q.ord, r.distance",
+                        (literals, k)
+                    )
+                    block_results = [[] for _ in block]
+                    for ordinal, document, metadata, distance in cursor.fetchall():
+                        block_results[ordinal - 1].append(
+                            (Document(page_content=document, metadata=metadata or {}), float(distance))
+                        )
+                    results.extend(block_results)
+        return results
     
-    def search_documents(self, query: str, k: int = 5) -> List[Dict]:
-        """Rechercher dans PostgreSQL via LangChain PGVector"""
+    async def asearch_documents(self, query: str, k: int = 5,
+                                query_vector: Optional[List[float]] = None) -> List[Dict]:
+        """Version asynchrone de search_documents (mode ASGI): requete pgvector via
+        asyncpg, embedding et fusion BM25 hors de la boucle d'evenements"""
         if not self.vector_store:
             return []
         
         try:
-            # Recherche avec scores de similarite
-            docs_with_scores = self.vector_store.similarity_search_with_score(query, k=k)
-            results = []
+            hybrid = self.lexical_index is not None and len(self.lexical_index) > 0
+            fetch_k = k * 2 if hybrid else k
             
-            for doc, score in docs_with_scores:
-                # Calculer la similarité correctement (pgvector retourne distance cosine)
-                similarity = max(0, 1 - score) if score <= 1 else 1 / (1 + score)
-                
-                results.append({
-                    'content': doc.page_content,
-                    'source': doc.metadata.get('filename', 'Unknown'),
-                    'similarity': round(similarity, 3),
-                    'metadata': doc.metadata
-                })
-            
-            return results
+            if query_vector is None:
+                query_vector = await asyncio.to_thread(self._embed_question, query)
+            with tracing.span('vector_search', backend=self.vector_backend, k=fetch_k):
+                if self.async_db_pool is not None and self.vector_backend != 'numpy':
+                    docs_with_scores = await self._apgvector_search(query_vector, fetch_k)
+                else:
+                    docs_with_scores = await asyncio.to_thread(
+                        self.vector_store.similarity_search_with_score_by_vector, query_vector, fetch_k
+                    )
+            results = [self._format_search_result(doc, score) for doc, score in docs_with_scores]
+            
+            if hybrid:
+                with tracing.span('lexical_fusion'):
+                    results = await asyncio.to_thread(
+                        self._fuse_lexical_results, query, results, fetch_k, query_vector
+                    )
+            
+            return results[:k]
         except Exception as e:
-            print(f"[ERROR] Recherche PostgreSQL: {e}")
+            print(f"[ERROR] Recherche PostgreSQL (async): {e}")
+            return []
+    
+    async def _apgvector_search(self, query_vector: List[float], k: int) -> List[Tuple[Document, float]]:
+        """Plus proches voisins dans langchain_pg_embedding (meme distance que PGVector)"""
+        _, operator = OPERATOR_CLASSES[self.pgvector_config['distance_strategy']]
+        collection = await self.async_db_pool.fetch(
+            "SELECT uuid FROM langchain_pg_collection WHERE name = $1",
+            self.pgvector_config['collection_name']
+        )
+        if not collection:
             return []
+        # collection_id en litteral: index partiel de la collection utilisable (plan generique inclus)
+        rows = await self.async_db_pool.fetch(
+            f"SELECT e.document, e.cmetadata, e.embedding {operator} $1 AS distance "
+            f"FROM langchain_pg_embedding e WHERE {collection_predicate(collection[0]['uuid'], 'e')} "
+            f"ORDER BY distance LIMIT $2",
+            np.asarray(query_vector, dtype=np.float32),
+            k
+        )
+        results = []
+        for row in rows:
+            metadata = row['cmetadata']
+            if isinstance(metadata, str):
+                metadata = json.loads(metadata)
+            results.append((Document(page_content=row['document'], metadata=metadata or {}), float(row['distance'])))
+        return results
+    
+    def _format_search_result(self, doc: Document, score: float) -> Dict:
+        # Calculer la similarité correctement (pgvector retourne distance cosine)
+        similarity = max(0, 1 - score) if score <= 1 else 1 / (1 + score)
+        
+        return {
+            'content': doc.page_content,
+            'source': doc.metadata.get('filename', 'Unknown'),
+            'similarity': round(similarity, 3),
+            'metadata': doc.metadata
+        }
+    
+    def _fuse_lexical_results(self, query: str, dense_results: List[Dict], fetch_k: int,
+                              query_vector: List[float]) -> List[Dict]:
+        """Fusion RRF des resultats vectoriels et BM25"""
+        lexical = self.lexical_index.search(query, k=fetch_k)
+        bm25_scores = dict(lexical)
+        by_id = {
+            result['metadata'].get('chunk_id'): result
+            for result in dense_results if result['metadata'].get('chunk_id')
+        }
+        fused = reciprocal_rank_fusion(
+            [list(by_id), [chunk_id for chunk_id, _ in lexical]], k=self.rrf_k
+        )[:fetch_k]
+        
+        # Chunks trouves uniquement par BM25: contenu et vecteur lus dans le vector store
+        # (aucun appel au modele d'embeddings), similarite cosine avec la question
+        missing = [chunk_id for chunk_id, _ in fused if chunk_id not in by_id]
+        if missing:
+            query_vector = np.asarray(query_vector, dtype=np.float32)
+            query_norm = max(float(np.linalg.norm(query_vector)), 1e-12)
+            for chunk_id, (doc, vector) in self._get_chunks_with_vectors(missing).items():
+                similarity = float(vector @ query_vector) / max(float(np.linalg.norm(vector)) * query_norm, 1e-12)
+                by_id[chunk_id] = self._format_search_result(doc, 1 - similarity)
+        
+        results = []
+        for chunk_id, rrf_score in fused:
+            result = by_id.get(chunk_id)
+            if result is None:
+                continue
+            result['bm25_score'] = round(bm25_scores.get(chunk_id, 0.0), 3)
+            result['rrf_score'] = round(rrf_score, 4)
+            results.append(result)
+        return results
+    
+    def _get_chunks_by_ids(self, chunk_ids: List[str]) -> Dict[str, Document]:
+        """Lire des chunks par ID (custom_id) dans le vector store courant"""
+        if hasattr(self.vector_store, 'get_by_ids'):
+            return self.vector_store.get_by_ids(chunk_ids)
+        
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT e.custom_id, e.document, e.cmetadata FROM langchain_pg_embedding e "
+                    "JOIN langchain_pg_collection c ON e.collection_id = c.uuid "
+                    "WHERE c.name = %s AND e.custom_id = ANY(%s)",
+                    (self.pgvector_config['collection_name'], list(chunk_ids))
+                )
+                return {
+                    custom_id: Document(page_content=document, metadata=metadata or {})
+                    for custom_id, document, metadata in cursor.fetchall()
+                }
     
-    def call_api(self, prompt: str) -> str:
-        """Appeler l'API Codestral"""
+    def _get_chunks_with_vectors(self, chunk_ids: List[str]) -> Dict[str, Tuple[Document, np.ndarray]]:
+        """Chunks par ID avec leur vecteur stocke (ligne du store NumPy ou colonne embedding)"""
+        if hasattr(self.vector_store, 'get_vectors_by_ids'):
+            documents = self.vector_store.get_by_ids(chunk_ids)
+            vectors = self.vector_store.get_vectors_by_ids(list(documents))
+            return {chunk_id: (doc, vectors[chunk_id]) for chunk_id, doc in documents.items() if chunk_id in vectors}
+        
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT e.custom_id, e.document, e.cmetadata, e.embedding::text FROM langchain_pg_embedding e "
+                    "JOIN langchain_pg_collection c ON e.collection_id = c.uuid "
+                    "WHERE c.name = %s AND e.custom_id = ANY(%s)",
+                    (self.pgvector_config['collection_name'], list(chunk_ids))
+                )
+                return {
+                    custom_id: (Document(page_content=document, metadata=metadata or {}),
+                                np.asarray(json.loads(embedding), dtype=np.float32))
+                    for custom_id, document, metadata, embedding in cursor.fetchall()
+                }
+    
+    @staticmethod
+    def _report_usage(usage: Optional[Dict[str, Any]], started: float, api_usage: Optional[Dict[str, int]] = None):
+        """Completer le dict `usage` de l'appelant: duree de generation et tokens renvoyes par l'API"""
+        if usage is None:
+            return
+        usage['latency_s'] = time.perf_counter() - started
+        if api_usage:
+            usage.update(api_usage, source='api')
+    
+    def call_api(self, prompt: str, usage: Optional[Dict[str, Any]] = None) -> str:
+        """Appeler l'API Codestral (`usage`: dict rempli avec tokens et duree de l'appel)"""
         if not self.api_key:
             return "Erreur: Cle API manquante"
         
+        started = time.perf_counter()
         try:
             if LITELLM_AVAILABLE:
                 response = completion(
@@ -271,6 +896,7 @@ class PostgreSQLRAGSystem:
                     max_tokens=2000,
                     temperature=0.1
                 )
+                self._report_usage(usage, started, usage_from_response(getattr(response, 'usage', None)))
                 return response.choices[0].message.content
             else:
                 import requests
@@ -295,35 +921,187 @@ class PostgreSQLRAGSystem:
                 )
                 
                 if response.status_code == 200:
-                    return response.json()['choices'][0]['message']['content']
+                    data = response.json()
+                    self._report_usage(usage, started, usage_from_response(data.get('usage')))
+                    return data['choices'][0]['message']['content']
                 else:
                     return f"Erreur API: {response.status_code}"
         
         except Exception as e:
             return f"Erreur: {e}"
     
-    def detect_context_reference(self, question: str) -> bool:
-        """Detecter reference au contexte precedent"""
-        indicators = [
-            'cette', 'cela', 'ca', 'precedent', 'ci-dessus', 'avant',
-            'le point', 'la point', 'point', 'cette information',
-            'ce que tu as dit', 'tu as mentionne', 'plus haut',
-            'dans ta reponse', 'tu disais', 'ses', 'son', 'sa',
-            'leurs', 'leur', 'elle', 'il', 'ils', 'elles'
-        ]
-        
-        question_lower = question.lower().strip()
-        
-        # Détecter les références directes
-        if any(word in question_lower for word in indicators):
-            return True
+    def call_api_stream(self, prompt: str, usage: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """Appeler l'API Codestral en streaming: generateur des fragments de texte
+        (`usage` rempli a la fin du flux)"""
+        if not self.api_key:
+            yield "Erreur: Cle API manquante"
+            return
         
-        # Détecter les questions qui commencent par des références
-        context_starters = ['ses ', 'son ', 'sa ', 'leur ', 'leurs ']
-        if any(question_lower.startswith(starter) for starter in context_starters):
-            return True
-            
-        return False
+        started = time.perf_counter()
+        api_usage = None
+        try:
+            if LITELLM_AVAILABLE:
+                response = completion(
+                    model="codestral/codestral-latest",
+                    messages=[{"role": "user", "content": prompt}],
+                    api_key=self.api_key,
+                    max_tokens=2000,
+                    temperature=0.1,
+                    stream=True
+                )
+                for chunk in response:
+                    api_usage = usage_from_response(getattr(chunk, 'usage', None)) or api_usage
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        yield delta
+                self._report_usage(usage, started, api_usage)
+            else:
+                import requests
+                
+                headers = {
+                    'Authorization': f'Bearer {self.api_key}',
+                    'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream'
+                }
+                
+                payload = {
+                    'model': 'codestral-latest',
+                    'messages': [{"role": "user", "content": prompt}],
+                    'max_tokens': 2000,
+                    'temperature': 0.1,
+                    'stream': True
+                }
+                
+                with requests.post(
+                    CODESTRAL_CHAT_URL,
+                    headers=headers,
+                    json=payload,
+                    timeout=30,
+                    stream=True
+                ) as response:
+                    if response.status_code != 200:
+                        yield f"Erreur API: {response.status_code}"
+                        return
+                    
+                    # Server-Sent Events: lignes "data: {...}" terminees par "data: [DONE]"
+                    for line in response.iter_lines(decode_unicode=True):
+                        done, delta, line_usage = parse_sse_line(line)
+                        api_usage = line_usage or api_usage
+                        if done:
+                            break
+                        if delta:
+                            yield delta
+                    self._report_usage(usage, started, api_usage)
+        
+        except Exception as e:
+            yield f"Erreur: {e}"
+    
+    def _codestral_request(self, prompt: str, stream: bool = False) -> Tuple[Dict[str, str], Dict[str, Any]]:
+        """En-tetes et corps d'un appel direct a l'API Codestral"""
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        }
+        payload = {
+            'model': 'codestral-latest',
+            'messages': [{"role": "user", "content": prompt}],
+            'max_tokens': 2000,
+            'temperature': 0.1
+        }
+        if stream:
+            headers['Accept'] = 'text/event-stream'
+            payload['stream'] = True
+        return headers, payload
+    
+    async def acall_api(self, prompt: str, usage: Optional[Dict[str, Any]] = None) -> str:
+        """Appeler l'API Codestral sans bloquer la boucle d'evenements (mode ASGI)"""
+        if not self.api_key:
+            return "Erreur: Cle API manquante"
+        
+        started = time.perf_counter()
+        try:
+            if self.async_http is not None:
+                # Client keep-alive partage: des centaines d'appels en vol sur quelques connexions
+                headers, payload = self._codestral_request(prompt)
+                response = await self.async_http.get().post(CODESTRAL_CHAT_URL, headers=headers, json=payload)
+                if response.status_code == 200:
+                    data = response.json()
+                    self._report_usage(usage, started, usage_from_response(data.get('usage')))
+                    return data['choices'][0]['message']['content']
+                return f"Erreur API: {response.status_code}"
+            elif LITELLM_AVAILABLE:
+                response = await acompletion(
+                    model="codestral/codestral-latest",
+                    messages=[{"role": "user", "content": prompt}],
+                    api_key=self.api_key,
+                    max_tokens=2000,
+                    temperature=0.1
+                )
+                self._report_usage(usage, started, usage_from_response(getattr(response, 'usage', None)))
+                return response.choices[0].message.content
+            else:
+                return await asyncio.to_thread(self.call_api, prompt, usage)
+        
+        except Exception as e:
+            return f"Erreur: {e}"
+    
+    async def acall_api_stream(self, prompt: str, usage: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """Appeler l'API Codestral en streaming (mode ASGI): fragments de texte"""
+        if not self.api_key:
+            yield "Erreur: Cle API manquante"
+            return
+        
+        started = time.perf_counter()
+        api_usage = None
+        try:
+            if self.async_http is not None:
+                headers, payload = self._codestral_request(prompt, stream=True)
+                async with self.async_http.get().stream(
+                    'POST', CODESTRAL_CHAT_URL, headers=headers, json=payload
+                ) as response:
+                    if response.status_code != 200:
+                        yield f"Erreur API: {response.status_code}"
+                        return
+                    async for line in response.aiter_lines():
+                        done, delta, line_usage = parse_sse_line(line)
+                        api_usage = line_usage or api_usage
+                        if done:
+                            break
+                        if delta:
+                            yield delta
+                    self._report_usage(usage, started, api_usage)
+            elif LITELLM_AVAILABLE:
+                response = await acompletion(
+                    model="codestral/codestral-latest",
+                    messages=[{"role": "user", "content": prompt}],
+                    api_key=self.api_key,
+                    max_tokens=2000,
+                    temperature=0.1,
+                    stream=True
+                )
+                async for chunk in response:
+                    api_usage = usage_from_response(getattr(chunk, 'usage', None)) or api_usage
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        yield delta
+                self._report_usage(usage, started, api_usage)
+            else:
+                for delta in await asyncio.to_thread(lambda: list(self.call_api_stream(prompt, usage))):
+                    yield delta
+        
+        except Exception as e:
+            yield f"Erreur: {e}"
+    
+    def detect_context_reference(self, question: str) -> bool:
+        """Detecter reference au contexte precedent.
+
+        Mots entiers, sans accents ('précédent', 'ça'): 'son' ne doit pas etre trouve dans
+        'sont', ni 'il' dans 'utiliser'. Seul detecteur utilise, pour le choix du prompt
+        comme pour le cache semantique partage.
+        """
+        question_lower = unicodedata.normalize('NFKD', question.lower().strip())
+        question_lower = ''.join(char for char in question_lower if not unicodedata.combining(char))
+        return CONTEXT_WORDS_PATTERN.search(question_lower) is not None
     
     def _classify_question(self, question: str) -> str:
         """Classifier le type de question"""
@@ -344,81 +1122,326 @@ class PostgreSQLRAGSystem:
     
     def build_context(self, question: str, docs: List[Dict], use_history: bool = False) -> str:
         """Construire le contexte enrichi pour l'API"""
-        context_parts = []
+        return self.pack_context(question, docs, use_history).text
+    
+    def pack_context(self, question: str, docs: List[Dict], use_history: bool = False):
+        """Contexte (echange precedent + documents) tenant dans le budget de tokens"""
+        previous_question, previous_answer = None, None
         
-        # Contexte conversationnel amélioré pour références
+        # Contexte conversationnel pour références (dernier échange seulement)
         if use_history:
             if self.memory:
                 # Utiliser la mémoire LangChain
                 memory_context = self.memory.load_memory_variables({})
                 chat_history = memory_context.get('chat_history', [])
-                
-                if chat_history:
-                    context_parts.append("=== CONTEXTE CONVERSATIONNEL ===")
-                    # Prendre seulement le dernier échange pour les références
-                    recent_messages = chat_history[-2:] if len(chat_history) >= 2 else chat_history
-                    
-                    if len(recent_messages) >= 2:
-                        human_msg = recent_messages[-2]
-                        ai_msg = recent_messages[-1]
-                        context_parts.append(f"Question précédente: {human_msg.content}")
-                        # Réponse complète pour bien comprendre le contexte
-                        context_parts.append(f"Réponse précédente: {ai_msg.content}")
-                        context_parts.append("")
-            
+                if len(chat_history) >= 2:
+                    previous_question = chat_history[-2].content
+                    previous_answer = chat_history[-1].content
             elif self.conversation_history:
                 # Fallback sur l'historique local
-                context_parts.append("=== CONTEXTE PRECEDENT ===")
                 last_exchange = self.conversation_history[-1]
-                context_parts.append(f"Question précédente: {last_exchange['question']}")
-                context_parts.append(f"Réponse précédente: {last_exchange['response']}")
-                context_parts.append("")
-        
-        # Documents pertinents avec filtrage par pertinence
-        if docs:
-            # Filtrer les sources peu pertinentes si on a une référence contextuelle
-            relevant_docs = docs
-            if use_history:
-                # Pour les questions contextuelles, garder seulement sources très pertinentes
-                relevant_docs = [doc for doc in docs if doc.get('similarity', 0) > 0.4] or docs[:2]
-            
-            if relevant_docs:
-                context_parts.append("=== DOCUMENTS PERTINENTS ===")
-                for i, doc in enumerate(relevant_docs[:3], 1):
-                    similarity = doc.get('similarity', 0)
-                    context_parts.append(f"[Source {i}] {doc['source']} (Similarité: {similarity:.3f})")
-                    context_parts.append(f"Contenu: {doc['content'][:400]}...")
-                    context_parts.append("")
-        
-        return "\n".join(context_parts)
+                previous_question = last_exchange['question']
+                previous_answer = last_exchange['response']
+        
+        with tracing.span('near_duplicates', docs=len(docs)):
+            unique_docs = self.near_duplicates.filter_results(docs)
+        
+        relevant_docs = unique_docs
+        if use_history and unique_docs:
+            # Pour les questions contextuelles, garder seulement sources très pertinentes
+            relevant_docs = [doc for doc in unique_docs if doc.get('similarity', 0) > 0.4] or unique_docs[:2]
+        
+        with tracing.span('build_context', docs=len(relevant_docs)) as context_span:
+            packed = self.context_packer.pack(question, relevant_docs, previous_question, previous_answer)
+            packed.near_duplicates_removed = len(docs) - len(unique_docs)
+            context_span.set_attribute('tokens', packed.tokens_used)
+        return packed
     
     def query(self, question: str) -> Dict[str, Any]:
-        """Requete RAG complete"""
+        """Requete RAG complete (duree de chaque etape dans result['timings'])"""
+        with self.tracer.trace('rag.query', session=self.session_name) as trace:
+            query_vector = self._embed_question(question)
+            cached = self._lookup_cached_answer(question, query_vector)
+            if cached is not None:
+                return self._with_timings(cached, trace)
+            
+            prepared = self._prepare_query(question, query_vector)
+            
+            # Appel API
+            with tracing.span('llm'):
+                response = self.call_api(prepared['prompt'], prepared['usage'])
+            
+            result = self._finalize_query(question, prepared, response)
+            self._store_cached_answer(query_vector, result)
+            return self._with_timings(result, trace)
+    
+    @staticmethod
+    def _with_timings(result: Dict[str, Any], trace: Optional[tracing.Trace]) -> Dict[str, Any]:
+        """Durees par etape (ms) de la trace en cours dans le resultat"""
+        if trace is not None:
+            result['timings'] = trace.timings()
+        return result
+    
+    def query_many(self, questions: List[str], concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Requetes RAG par lot (evaluation, pre-chauffage du cache), resultats dans l'ordre.
+
+        Les questions sont independantes: pas d'historique ni de memoire de session.
+        Embeddings en une passe, une recherche multi-vecteurs, puis appels LLM
+        en parallele (au plus `concurrency`, RAG_BATCH_CONCURRENCY par defaut).
+        """
+        with self.tracer.trace('rag.query_many', questions=len(questions)):
+            return self._query_many(questions, concurrency)
+    
+    def _query_many(self, questions: List[str], concurrency: Optional[int]) -> List[Dict[str, Any]]:
+        start = time.time()
+        concurrency = max(1, concurrency or self.batch_concurrency)
+        results = [None] * len(questions)
+        
+        with tracing.span('embed_query', questions=len(questions)):
+            query_vectors = self._embed_questions(questions)
+        
+        # Reponses deja en cache semantique; une question repetee dans le lot n'est traitee qu'une fois
+        pending = []
+        duplicates = {}
+        first_index = {}
+        for i, (question, query_vector) in enumerate(zip(questions, query_vectors)):
+            if question in first_index:
+                duplicates[i] = first_index[question]
+                continue
+            first_index[question] = i
+            cached = self._lookup_cached_answer(question, query_vector, record=False)
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.append(i)
+        
+        if pending:
+            searchable = [i for i in pending if query_vectors[i] is not None]
+            with tracing.span('vector_search', backend=self.vector_backend, questions=len(searchable)):
+                docs_by_index = dict(zip(searchable, self.search_documents_many(
+                    [questions[i] for i in searchable], [query_vectors[i] for i in searchable], k=5
+                )))
+            prepared = {
+                i: self._build_prompt(
+                    questions[i],
+                    docs_by_index[i] if i in docs_by_index else self.search_documents(questions[i], k=5),
+                    use_history=False
+                )
+                for i in pending
+            }
+            
+            with tracing.span('llm', calls=len(pending)), \
+                    ThreadPoolExecutor(max_workers=min(concurrency, len(pending))) as executor:
+                responses = list(executor.map(
+                    self.call_api, [prepared[i]['prompt'] for i in pending], [prepared[i]['usage'] for i in pending]
+                ))
+            
+            for i, response in zip(pending, responses):
+                result = self._build_result(questions[i], prepared[i], response, method='batch_rag')
+                self._store_cached_answer(query_vectors[i], result)
+                results[i] = result
+        
+        for i, original in duplicates.items():
+            results[i] = dict(results[original])
+        
+        print(f"[BATCH] {len(questions)} questions ({len(questions) - len(pending) - len(duplicates)} en cache, "
+              f"{len(duplicates)} doublons, "
+              f"{concurrency} appels simultanes) en {time.time() - start:.1f}s")
+        return results
+    
+    def query_stream(self, question: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Requete RAG en streaming: ('sources', ...), puis ('token', ...) pour chaque
+        fragment de la reponse, et enfin ('done', resultat complet)"""
+        with self.tracer.trace('rag.query_stream', session=self.session_name) as trace:
+            query_vector = self._embed_question(question)
+            cached = self._lookup_cached_answer(question, query_vector)
+            if cached is not None:
+                yield 'sources', {
+                    'sources': cached['sources'],
+                    'sources_count': cached['sources_count'],
+                    'context_reference': cached['context_reference']
+                }
+                yield 'token', {'delta': cached['response']}
+                yield 'done', self._with_timings(cached, trace)
+                return
+            
+            prepared = self._prepare_query(question, query_vector)
+            yield 'sources', {
+                'sources': prepared['docs'],
+                'sources_count': len(prepared['docs']),
+                'context_reference': prepared['has_context_ref']
+            }
+            
+            fragments = []
+            with tracing.span('llm', stream=True):
+                for delta in self.call_api_stream(prepared['prompt'], prepared['usage']):
+                    fragments.append(delta)
+                    yield 'token', {'delta': delta}
+            
+            result = self._finalize_query(question, prepared, ''.join(fragments))
+            self._store_cached_answer(query_vector, result)
+            yield 'done', self._with_timings(result, trace)
+    
+    async def aquery(self, question: str) -> Dict[str, Any]:
+        """Requete RAG complete en mode asynchrone (ASGI): aucun thread bloque
+        pendant la recherche pgvector ni pendant l'appel au LLM"""
+        with self.tracer.trace('rag.aquery', session=self.session_name) as trace:
+            query_vector = await asyncio.to_thread(self._embed_question, question)
+            cached = await asyncio.to_thread(self._lookup_cached_answer, question, query_vector)
+            if cached is not None:
+                return self._with_timings(cached, trace)
+            
+            prepared = await self._aprepare_query(question, query_vector)
+            with tracing.span('llm'):
+                response = await self.acall_api(prepared['prompt'], prepared['usage'])
+            
+            result = await asyncio.to_thread(self._finalize_query, question, prepared, response)
+            await asyncio.to_thread(self._store_cached_answer, query_vector, result)
+            return self._with_timings(result, trace)
+    
+    async def aquery_stream(self, question: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Version asynchrone de query_stream (memes evenements)"""
+        with self.tracer.trace('rag.aquery_stream', session=self.session_name) as trace:
+            query_vector = await asyncio.to_thread(self._embed_question, question)
+            cached = await asyncio.to_thread(self._lookup_cached_answer, question, query_vector)
+            if cached is not None:
+                yield 'sources', {
+                    'sources': cached['sources'],
+                    'sources_count': cached['sources_count'],
+                    'context_reference': cached['context_reference']
+                }
+                yield 'token', {'delta': cached['response']}
+                yield 'done', self._with_timings(cached, trace)
+                return
+            
+            prepared = await self._aprepare_query(question, query_vector)
+            yield 'sources', {
+                'sources': prepared['docs'],
+                'sources_count': len(prepared['docs']),
+                'context_reference': prepared['has_context_ref']
+            }
+            
+            fragments = []
+            with tracing.span('llm', stream=True):
+                async for delta in self.acall_api_stream(prepared['prompt'], prepared['usage']):
+                    fragments.append(delta)
+                    yield 'token', {'delta': delta}
+            
+            result = await asyncio.to_thread(self._finalize_query, question, prepared, ''.join(fragments))
+            await asyncio.to_thread(self._store_cached_answer, query_vector, result)
+            yield 'done', self._with_timings(result, trace)
+    
+    def _embed_question(self, question: str) -> Optional[List[float]]:
+        """Embedding de la question, partage entre cache semantique et recherche"""
+        try:
+            with tracing.span('embed_query'):
+                if self.query_embeddings is not None:
+                    return self.query_embeddings.embed(question, self.embeddings.embed_query)
+                return self.embeddings.embed_query(question)
+        except Exception as e:
+            print(f"[WARNING] Embedding de la question impossible: {e}")
+            return None
+    
+    def _embed_questions(self, questions: List[str]) -> List[Optional[List[float]]]:
+        """Embeddings de plusieurs questions en une seule passe du modele"""
+        compute_many = self.embeddings.embed_queries if hasattr(self.embeddings, 'embed_queries') \
+            else self.embeddings.embed_documents
+        try:
+            if self.query_embeddings is not None:
+                return self.query_embeddings.embed_many(questions, compute_many)
+            return compute_many(questions)
+        except Exception as e:
+            print(f"[WARNING] Embedding des questions impossible: {e}")
+            return [self._embed_question(question) for question in questions]
+    
+    def _is_standalone_question(self, question: str) -> bool:
+        """Question sans reference a la conversation (meme detecteur que le choix du prompt)"""
+        return not self.detect_context_reference(question)
+    
+    def _lookup_cached_answer(self, question: str, query_vector, record: bool = True) -> Optional[Dict[str, Any]]:
+        """Reponse du cache semantique pour une question non contextuelle
+        (`record`: ajouter l'echange a l'historique de la session)"""
+        if self.answer_cache is None or query_vector is None or not self._is_standalone_question(question):
+            return None
+        
+        with tracing.span('semantic_cache'):
+            entry = self.answer_cache.lookup(query_vector, fingerprint=self._cache_fingerprint())
+        if entry is None or entry.get('context_reference'):
+            # Reponse construite sur la conversation d'une autre session: jamais servie
+            return None
+        
+        print(f"[CACHE] Reponse en cache (similarite {entry['cache_similarity']:.3f}): {entry['question']}")
+        prepared = {'docs': list(entry['sources']), 'has_context_ref': entry['context_reference']}
+        if record:
+            result = self._finalize_query(question, prepared, entry['response'])
+        else:
+            result = self._build_result(question, prepared, entry['response'])
+        result['cached'] = True
+        result['cache_similarity'] = entry['cache_similarity']
+        result['method'] = 'semantic_cache'
+        return result
+    
+    def _store_cached_answer(self, query_vector, result: Dict[str, Any]):
+        """Memoriser une reponse reussie a une question non contextuelle"""
+        if self.answer_cache is None or query_vector is None:
+            return
+        if result.get('context_reference') or not self._is_standalone_question(result['question']):
+            # Prompt contextuel (reponse precedente de la session incluse): non partageable
+            return
+        if not result['success'] or result['response'].startswith('Erreur'):
+            return
+        self.answer_cache.put(query_vector, {
+            'question': result['question'],
+            'response': result['response'],
+            'sources': result['sources'],
+            'context_reference': result['context_reference']
+        }, fingerprint=self._cache_fingerprint())
+    
+    def _cache_fingerprint(self) -> Optional[str]:
+        """Empreinte du corpus pour le cache semantique, a jour apres un reindex.py externe"""
+        if self.manifest_fingerprint is None:
+            return self.corpus_fingerprint
+        return self.manifest_fingerprint.current()
+    
+    def _prepare_query(self, question: str, query_vector: Optional[List[float]] = None) -> Dict[str, Any]:
+        """Recherche des sources et construction du prompt"""
         print(f"[QUERY] {question}")
         
-        # Detection de reference contextuelle
-        has_context_ref = self.detect_context_reference(question)
+        # TOUJOURS faire une nouvelle recherche, même pour questions contextuelles
+        # Cela permet de trouver de nouveaux documents
+        docs = self.search_documents(question, k=5, query_vector=query_vector)
+        return self._build_prompt(question, docs)
+    
+    async def _aprepare_query(self, question: str, query_vector: Optional[List[float]] = None) -> Dict[str, Any]:
+        """Version asynchrone de _prepare_query"""
+        print(f"[QUERY] {question}")
+        docs = await self.asearch_documents(question, k=5, query_vector=query_vector)
+        # Sources de l'echange precedent (psycopg2), memoire, SimHash, tiktoken: hors de la boucle
+        return await asyncio.to_thread(self._build_prompt, question, docs)
+    
+    def _build_prompt(self, question: str, docs: List[Dict], use_history: bool = True) -> Dict[str, Any]:
+        """Sources de l'echange precedent si besoin, contexte et prompt adaptatif"""
+        # Detection de reference contextuelle (jamais pour les questions d'un lot)
+        has_context_ref = use_history and self.detect_context_reference(question)
         
         # Gestion intelligente des sources selon le contexte
         if has_context_ref and self.conversation_history:
-            # TOUJOURS faire une nouvelle recherche, même pour questions contextuelles
-            # Cela permet de trouver de nouveaux documents
-            docs = self.search_documents(question, k=5)
             print(f"[CONTEXT+SEARCH] Recherche contextuelle: {len(docs)} docs")
             
             # Ajouter quelques sources précédentes si pertinentes pour le contexte
             last_entry = self.conversation_history[-1]
-            prev_docs = last_entry.get('sources', [])[:2]  # Seulement 2 sources précédentes
+            # Seulement 2 sources précédentes (contenu relu dans le vector store)
+            prev_docs = self.resolve_sources(last_entry.get('sources', [])[:2])
             if prev_docs:
                 docs.extend(prev_docs)
                 print(f"[CONTEXT] Ajout de {len(prev_docs)} sources précédentes")
         else:
             # Nouvelle recherche vectorielle pour questions non-contextuelles
-            docs = self.search_documents(question, k=5)
             print(f"[SEARCH] Nouvelle recherche: {len(docs)} docs")
         
-        # Construire le contexte
-        context = self.build_context(question, docs, has_context_ref)
+        # Construire le contexte (budget de tokens)
+        packed = self.pack_context(question, docs, has_context_ref)
+        context = packed.text
         
         # Prompt adaptatif selon le type de question
         if context:
@@ -449,44 +1472,125 @@ Reponse:"""
         else:
             prompt = f"Question: {question}\n\nReponse:"
         
-        # Appel API
-        response = self.call_api(prompt)
-        
-        # Sauvegarder IMMÉDIATEMENT dans la mémoire LangChain
-        if self.memory:
-            self.memory.save_context(
-                {"input": question},
-                {"output": response}
+        return {'docs': docs, 'has_context_ref': has_context_ref, 'prompt': prompt, 'usage': {},
+                'context_tokens': packed.tokens_used, 'context_stats': packed.get_stats()}
+    
+    def _measure_usage(self, prepared: Dict[str, Any], response: str) -> Dict[str, Any]:
+        """Tokens de l'appel LLM: ceux renvoyes par l'API, sinon estimes localement
+        (aucun appel pour une reponse en cache ou une erreur)"""
+        if 'prompt' not in prepared or response.startswith('Erreur'):
+            return {'prompt_tokens': 0, 'completion_tokens': 0, 'latency_s': None, 'source': 'none'}
+        usage = dict(prepared.get('usage') or {})
+        if usage.get('source') != 'api':
+            tokenizer = self.context_packer.tokenizer
+            usage.update(
+                prompt_tokens=tokenizer.count(prepared['prompt']),
+                completion_tokens=tokenizer.count(response),
+                source='estimate'
             )
-        
-        # Resultats avec informations de debug
-        result = {
+        usage.setdefault('latency_s', None)
+        return usage
+    
+    def _build_result(self, question: str, prepared: Dict[str, Any], response: str,
+                      method: Optional[str] = None) -> Dict[str, Any]:
+        """Resultat d'une requete (sans effet sur la session); l'appel LLM est compte
+        dans la telemetrie"""
+        docs = prepared['docs']
+        has_context_ref = prepared['has_context_ref']
+        question_type = self._classify_question(question)
+        method = method or ('contextual_rag' if has_context_ref else 'search_rag')
+        usage = self._measure_usage(prepared, response)
+        if usage['source'] != 'none':
+            self.llm_telemetry.record(question_type, usage['prompt_tokens'], usage['completion_tokens'],
+                                      usage['latency_s'], source=usage['source'], method=method)
+        return {
             'question': question,
             'response': response,
             'raw_response': response,
             'sources': docs,
             'sources_count': len(docs),
             'context_reference': has_context_ref,
-            'question_type': self._classify_question(question),
+            'context_tokens': prepared.get('context_tokens', 0),
+            'context_stats': prepared.get('context_stats', {}),
+            'prompt_tokens': usage['prompt_tokens'],
+            'completion_tokens': usage['completion_tokens'],
+            'tokens_used': usage['prompt_tokens'] + usage['completion_tokens'],
+            'token_source': usage['source'],
+            'generation_time': round(usage['latency_s'], 3) if usage['latency_s'] is not None else None,
+            'question_type': question_type,
             'success': len(response) > 10,
-            'method': 'contextual_rag' if has_context_ref else 'search_rag',
+            'method': method,
             'session': self.session_name,
             'timestamp': datetime.now().isoformat(),
             'memory_messages': len(self.memory.chat_memory.messages) if self.memory else 0
         }
+    
+    def _finalize_query(self, question: str, prepared: Dict[str, Any], response: str) -> Dict[str, Any]:
+        """Memoire, historique et sauvegarde une fois la reponse obtenue"""
+        # Sauvegarder IMMÉDIATEMENT dans la mémoire LangChain
+        if self.memory:
+            with tracing.span('memory_update'):
+                self.memory.save_context(
+                    {"input": question},
+                    {"output": response}
+                )
+        
+        # Resultats avec informations de debug
+        result = self._build_result(question, prepared, response)
         
-        # Ajouter a l'historique local
-        self.conversation_history.append(result)
+        # Ajouter a l'historique local (references des sources, pas leur contenu)
+        self.conversation_history.append(self._history_entry(result))
         
         # Sauvegarde automatique après chaque échange
         try:
-            self._save_current_session()
+            with tracing.span('session_save'):
+                self._save_current_session()
         except Exception as e:
             print(f"[WARNING] Erreur sauvegarde automatique: {e}")
         
-        print(f"[OK] Reponse avec {len(docs)} sources - Mémoire: {result['memory_messages']} messages")
+        print(f"[OK] Reponse avec {result['sources_count']} sources - Mémoire: {result['memory_messages']} messages")
         return result
     
+    @staticmethod
+    def _source_ref(doc: Dict) -> Dict:
+        """Reference compacte d'une source pour l'historique: chunk_id, fichier, scores"""
+        chunk_id = (doc.get('metadata') or {}).get('chunk_id') or doc.get('chunk_id')
+        if not chunk_id:
+            # Pas d'identifiant (index anterieur aux chunk_id): contenu conserve
+            return doc
+        ref = {'chunk_id': chunk_id, 'source': doc.get('source', 'Unknown'), 'similarity': doc.get('similarity', 0.0)}
+        for key in ('bm25_score', 'rrf_score'):
+            if key in doc:
+                ref[key] = doc[key]
+        return ref
+    
+    def _history_entry(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Echange tel que garde en historique et en session (sources en references)"""
+        return dict(entry, sources=[self._source_ref(doc) for doc in entry.get('sources', [])])
+    
+    def resolve_sources(self, sources: List[Dict]) -> List[Dict]:
+        """Contenu des sources referencees dans l'historique, lu a la demande dans le
+        vector store (source marquee 'missing' si le chunk n'existe plus)"""
+        chunk_ids = [source['chunk_id'] for source in sources if 'content' not in source and source.get('chunk_id')]
+        documents = {}
+        if chunk_ids:
+            try:
+                documents = self._get_chunks_by_ids(chunk_ids)
+            except Exception as e:
+                print(f"[WARNING] Lecture des sources impossible: {e}")
+        
+        resolved = []
+        for source in sources:
+            if 'content' in source:
+                resolved.append(source)
+                continue
+            doc = documents.get(source.get('chunk_id'))
+            if doc is None:
+                resolved.append(dict(source, content='', metadata={'chunk_id': source.get('chunk_id')}, missing=True))
+            else:
+                resolved.append(dict(source, content=doc.page_content, metadata=doc.metadata))
+        return resolved
+    
     def clear_memory(self):
         """Effacer l'historique"""
         self.conversation_history.clear()
@@ -519,7 +1623,8 @@ Reponse:"""
                 data = json.load(f)
             
             self.session_name = data.get('session_name', self.session_name)
-            self.conversation_history = data.get('conversation_history', [])
+            self.conversation_history = [self._history_entry(entry) for entry in data.get('conversation_history', [])]
+            self.persisted_turns = None
             
             print(f"[LOAD] {len(self.conversation_history)} echanges")
             return True
@@ -533,9 +1638,16 @@ Reponse:"""
             'session_name': self.session_name,
             'conversations': len(self.conversation_history),
             'vector_store_ready': self.vector_store is not None,
+            'vector_backend': self.vector_backend,
+            'lexical_index': self.lexical_index.get_stats() if self.lexical_index is not None else None,
             'api_ready': bool(self.api_key),
             'langchain_available': True,  # Obligatoire pour Séance 5
-            'litellm_available': LITELLM_AVAILABLE
+            'litellm_available': LITELLM_AVAILABLE,
+            'embedding_cache': self.embeddings.get_stats() if isinstance(self.embeddings, CachedEmbeddings) else None,
+            'semantic_cache': self.answer_cache.get_stats() if self.answer_cache is not None else None,
+            'db_pool': self.db_pool.get_stats(),
+            'session_store': self.session_store.get_stats(),
+            'async_db_pool': self.async_db_pool.get_stats() if self.async_db_pool is not None else None
         }
     
     # Méthodes pour compatibilité avec l'interface
@@ -564,54 +1676,58 @@ Reponse:"""
                 lines.append("---")
             return "\n".join(lines)
     
-    def get_conversation_history(self) -> List[Dict]:
-        """Obtenir l'historique de conversation"""
+    def get_conversation_history(self, resolve_sources: bool = False) -> List[Dict]:
+        """Obtenir l'historique de conversation (`resolve_sources`: avec le contenu des sources)"""
+        if resolve_sources:
+            return [dict(entry, sources=self.resolve_sources(entry.get('sources', [])))
+                    for entry in self.conversation_history]
         return self.conversation_history.copy()
     
     # Gestionnaire de sessions pour l'interface
     def list_all_sessions(self) -> List[Dict]:
         """Lister toutes les sessions sauvegardées"""
+        return self.list_sessions_page()['sessions']
+    
+    def list_sessions_page(self, limit: Optional[int] = None, offset: int = 0,
+                           sort_by: str = 'last_activity', descending: bool = True) -> Dict[str, Any]:
+        """Page de sessions lue dans le catalogue (session courante en tete de la premiere page)"""
         sessions = []
         
         # Session courante
-        current_time = datetime.now().isoformat()
-        sessions.append({
-            'session_id': self.session_name,
-            'session_name': self.session_name,
-            'created_at': current_time,
-            'start_time': current_time,  # Pour compatibilité interface web
-            'last_activity': current_time,  # Pour compatibilité interface web
-            'message_count': len(self.conversation_history),
-            'turns_count': len(self.conversation_history),  # Pour compatibilité interface web
-            'is_current': True
-        })
-        
-        # Sessions sauvegardées - TOUTES les sessions JSON
-        for session_file in self.sessions_dir.glob("*.json"):
-            try:
-                with open(session_file, 'r', encoding='utf-8') as f:
-                    session_data = json.load(f)
-                
-                if session_data.get('session_name') != self.session_name:
-                    saved_at = session_data.get('saved_at', current_time)
-                    conversations = session_data.get('conversation_history', [])
-                    last_activity = conversations[-1].get('timestamp', saved_at) if conversations else saved_at
-                    
-                    sessions.append({
-                        'session_id': session_data.get('session_name', session_file.stem),
-                        'session_name': session_data.get('session_name', session_file.stem),
-                        'created_at': saved_at,
-                        'start_time': saved_at,  # Pour compatibilité interface web
-                        'last_activity': last_activity,  # Pour compatibilité interface web
-                        'message_count': session_data.get('conversation_count', 0),
-                        'turns_count': session_data.get('conversation_count', 0),  # Pour compatibilité interface web
-                        'is_current': False
-                    })
-            except Exception as e:
-                print(f"[WARNING] Erreur lecture session {session_file}: {e}")
+        if offset == 0:
+            current_time = datetime.now().isoformat()
+            sessions.append({
+                'session_id': self.session_name,
+                'session_name': self.session_name,
+                'created_at': current_time,
+                'start_time': current_time,  # Pour compatibilité interface web
+                'last_activity': current_time,  # Pour compatibilité interface web
+                'message_count': len(self.conversation_history),
+                'turns_count': len(self.conversation_history),  # Pour compatibilité interface web
+                'is_current': True
+            })
+            if limit is not None:
+                limit = max(0, limit - 1)
         
-                
-        return sessions
+        # Sessions sauvegardées (journaux .jsonl et anciens .json), sans ouvrir les fichiers
+        summaries, total = self.session_store.list_sessions(
+            limit=limit, offset=max(0, offset - 1), sort_by=sort_by,
+            descending=descending, exclude=self.session_name
+        )
+        for summary in summaries:
+            saved_at = summary.get('saved_at') or summary.get('created_at')
+            sessions.append({
+                'session_id': summary['session_id'],
+                'session_name': summary['session_name'],
+                'created_at': summary.get('created_at') or saved_at,
+                'start_time': summary.get('created_at') or saved_at,  # Pour compatibilité interface web
+                'last_activity': summary.get('last_activity') or saved_at,  # Pour compatibilité interface web
+                'message_count': summary['conversation_count'],
+                'turns_count': summary['conversation_count'],  # Pour compatibilité interface web
+                'is_current': False
+            })
+        
+        return {'sessions': sessions, 'total': total + 1}
     
     def create_new_session(self, session_name: str = None) -> str:
         """Créer une nouvelle session et sauvegarder l'ancienne"""
@@ -625,6 +1741,7 @@ Reponse:"""
         # Réinitialiser
         self.session_name = new_session_name
         self.conversation_history = []
+        self.persisted_turns = None
         
         if self.memory:
             self.memory.clear()
@@ -638,8 +1755,7 @@ Reponse:"""
             print(f"[LOAD] Session déjà active: {session_id}")
             return True
         
-        session_file = self.sessions_dir / f"{session_id}.json"
-        if not session_file.exists():
+        if not self.session_store.exists(session_id):
             print(f"[ERROR] Session {session_id} non trouvée")
             return False
         
@@ -648,12 +1764,14 @@ Reponse:"""
             if self.conversation_history:
                 self._save_current_session()
             
-            # Charger la nouvelle session
-            with open(session_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            # Charger la nouvelle session (journal .jsonl ou ancien .json)
+            data = self.session_store.load(session_id)
             
-            self.session_name = data.get('session_name', session_id)
-            self.conversation_history = data.get('conversation_history', [])
+            self.session_name = session_id
+            # Anciennes sessions: contenu des sources remplace par des references
+            self.conversation_history = [self._history_entry(entry) for entry in data.get('conversation_history', [])]
+            # Ancien format: converti en journal a la prochaine sauvegarde
+            self.persisted_turns = len(self.conversation_history) if data['format'] == 'jsonl' else None
             
             # Restaurer dans la mémoire LangChain
             if self.memory:
@@ -677,13 +1795,12 @@ Reponse:"""
             print("[ERROR] Impossible de supprimer la session courante")
             return False
         
-        session_file = self.sessions_dir / f"{session_id}.json"
-        if not session_file.exists():
+        if not self.session_store.exists(session_id):
             print(f"[ERROR] Session {session_id} non trouvée")
             return False
         
         try:
-            session_file.unlink()
+            self.session_store.delete(session_id)
             print(f"[DELETE] Session {session_id} supprimée")
             return True
         except Exception as e:
@@ -691,23 +1808,15 @@ Reponse:"""
             return False
     
     def _save_current_session(self):
-        """Sauvegarder la session courante - CENTRALISÉ"""
+        """Sauvegarder la session courante - CENTRALISÉ (ajout au journal sessions/{id}.jsonl,
+        ecriture faite par le thread du SessionStore)"""
         if not self.conversation_history:
             return
         
-        # CENTRALISER toutes les sessions dans le dossier sessions/
-        session_file = self.sessions_dir / f"{self.session_name}.json"
-        data = {
-            'session_name': self.session_name,
-            'saved_at': datetime.now().isoformat(),
-            'conversation_count': len(self.conversation_history),
-            'conversation_history': self.conversation_history,
-            'session_type': 'unified'  # Marquer comme session unifiée
-        }
-        
         try:
-            with open(session_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            self.persisted_turns = self.session_store.save(
+                self.session_name, self.conversation_history, self.persisted_turns
+            )
             print(f"[SAVE] Session {self.session_name} sauvegardée: {len(self.conversation_history)} conversations")
         except Exception as e:
             print(f"[ERROR] Sauvegarde session: {e}")
@@ -739,13 +1848,11 @@ def test_seance5_rag():
             print(f"   {k}: {v}")
         
         print("\n2. TEST CONNEXION POSTGRESQL")
-        try:
-            import psycopg2
-            conn = psycopg2.connect(**rag.db_params)
-            conn.close()
-            print("Connexion PostgreSQL OK")
-        except Exception as e:
-            print(f"Connexion PostgreSQL: {e}")
+        health = rag.db_pool.health_check()
+        if health['ok']:
+            print(f"Connexion PostgreSQL OK ({health['latency_ms']} ms, via le pool)")
+        else:
+            print(f"Connexion PostgreSQL: {health['error']}")
         
         print("\n3. PREMIERE QUESTION")
         result1 = rag.query("Qu'est-ce que la gestion des projets ?")
@@ -761,7 +1868,7 @@ def test_seance5_rag():
         
         print("\n5. VERIFICATION INTEGRATION")
         if result1['success'] and result2['success']:
-²            print("PostgreSQL + pgvector : FONCTIONNEL")
+            print("PostgreSQL + pgvector : FONCTIONNEL")
             print("LangChain integration : FONCTIONNEL") 
             print("Codestral API : FONCTIONNEL")
             print("Memoire conversationnelle : FONCTIONNEL")
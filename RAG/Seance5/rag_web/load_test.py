@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Test de charge de l'API RAG - Seance 5
+N clients concurrents envoient des questions a /api/rag/query (ou /query/stream) et on
+mesure le debit, la latence (p50/p95) et les erreurs. Avec --flask-url et --asgi-url,
+les deux modes de service sont compares.
+
+Les serveurs doivent etre lances avec RAG_SEMANTIC_CACHE=false: sinon la comparaison
+mesure le cache de reponses et non le service (verifie via /api/rag/stats, --allow-cache
+pour passer outre). Chaque requete porte une question unique (numero de requete ajoute)
+pour ne pas non plus mesurer le cache LRU des vecteurs de questions.
+
+Exemples:
+    RAG_SEMANTIC_CACHE=false python src/main.py
+    RAG_SEMANTIC_CACHE=false python src/asgi.py
+    python load_test.py --flask-url http://localhost:5000 --concurrency 50 --requests 500
+    python load_test.py --flask-url http://localhost:5000 --asgi-url http://localhost:5001 --stream
+"""
+
+import time
+import json
+import asyncio
+import argparse
+from typing import List, Dict, Any
+
+import httpx
+import numpy as np
+
+DEFAULT_QUESTIONS = [
+    "Quels sont les objectifs du module ?",
+    "Comment fonctionne la recherche vectorielle ?",
+    "Qu'est-ce qu'un embedding ?",
+    "Quelles sont les etapes de l'ingestion des documents ?",
+    "Comment evaluer un systeme RAG ?"
+]
+
+
+def unique_question(questions: List[str], index: int) -> str:
+    """Question distincte pour chaque requete (pas de succes de cache d'une requete a l'autre)"""
+    return f"{questions[index % len(questions)]} (requete {index})"
+
+
+async def semantic_cache_enabled(base_url: str, timeout: float) -> bool:
+    """Le serveur expose-t-il un cache semantique de reponses actif ? (/api/rag/stats)"""
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        response = await client.get(base_url.rstrip('/') + '/api/rag/stats')
+        response.raise_for_status()
+        return bool(response.json().get('statistics', {}).get('semantic_cache'))
+
+
+async def run_client(client: httpx.AsyncClient, base_url: str, client_id: int, questions: List[str],
+                     queue: asyncio.Queue, stream: bool, latencies: List[float], errors: List[str]):
+    """Un client: une requete a la fois, avec sa propre session"""
+    headers = {'X-Session-Id': f'load_{client_id:04d}'}
+    endpoint = '/api/rag/query/stream' if stream else '/api/rag/query'
+    while True:
+        try:
+            index = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        payload = {'question': unique_question(questions, index), 'include_sources': False}
+        start = time.perf_counter()
+        try:
+            if stream:
+                async with client.stream('POST', base_url + endpoint, json=payload, headers=headers) as response:
+                    if response.status_code != 200:
+                        errors.append(f'HTTP {response.status_code}')
+                        continue
+                    failed = False
+                    async for line in response.aiter_lines():
+                        if line.startswith('event: error'):
+                            failed = True
+                    if failed:
+                        errors.append('stream error')
+                        continue
+            else:
+                response = await client.post(base_url + endpoint, json=payload, headers=headers)
+                if response.status_code != 200 or not response.json().get('success'):
+                    errors.append(f'HTTP {response.status_code}')
+                    continue
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(type(e).__name__)
+
+
+async def run_load(base_url: str, concurrency: int, total_requests: int, questions: List[str],
+                   stream: bool, timeout: float) -> Dict[str, Any]:
+    """Lancer `concurrency` clients jusqu'a epuisement des `total_requests` requetes"""
+    queue = asyncio.Queue()
+    for index in range(total_requests):
+        queue.put_nowait(index)
+    latencies, errors = [], []
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            run_client(client, base_url.rstrip('/'), client_id, questions, queue, stream, latencies, errors)
+            for client_id in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - start
+
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        'url': base_url,
+        'concurrency': concurrency,
+        'requests': total_requests,
+        'succeeded': len(latencies),
+        'errors': len(errors),
+        'error_types': {error: errors.count(error) for error in set(errors)},
+        'elapsed_s': round(elapsed, 2),
+        'requests_per_s': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(float(np.percentile(latencies_ms, 50)), 1) if len(latencies) else None,
+        'p95_ms': round(float(np.percentile(latencies_ms, 95)), 1) if len(latencies) else None,
+        'max_ms': round(float(latencies_ms.max()), 1) if len(latencies) else None
+    }
+
+
+def print_report(name: str, report: Dict[str, Any]):
+    print(f"\n[LOAD] {name} ({report['url']})")
+    print(f"   Requetes: {report['succeeded']}/{report['requests']} reussies, {report['errors']} erreurs "
+          f"{report['error_types'] or ''}")
+    print(f"   Debit: {report['requests_per_s']} req/s en {report['elapsed_s']}s "
+          f"({report['concurrency']} clients)")
+    print(f"   Latence: p50 {report['p50_ms']} ms, p95 {report['p95_ms']} ms, max {report['max_ms']} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge de l'API RAG (Flask vs ASGI)")
+    parser.add_argument('--flask-url', help='URL du serveur Flask (python src/main.py)')
+    parser.add_argument('--asgi-url', help='URL du serveur ASGI (python src/asgi.py)')
+    parser.add_argument('--concurrency', type=int, default=20, help='Clients concurrents')
+    parser.add_argument('--requests', type=int, default=200, help='Nombre total de requetes par serveur')
+    parser.add_argument('--stream', action='store_true', help='Utiliser /query/stream (SSE)')
+    parser.add_argument('--timeout', type=float, default=120.0, help='Delai max par requete (s)')
+    parser.add_argument('--questions', help='Fichier texte: une question par ligne')
+    parser.add_argument('--output', help='Ecrire les resultats en JSON')
+    parser.add_argument('--allow-cache', action='store_true',
+                        help='Accepter un serveur avec cache semantique actif (resultats non comparables)')
+    args = parser.parse_args()
+
+    if not args.flask_url and not args.asgi_url:
+        parser.error('indiquer --flask-url et/ou --asgi-url')
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, encoding='utf-8') as f:
+            questions = [line.strip() for line in f if line.strip()] or DEFAULT_QUESTIONS
+
+    reports = {}
+    for name, url in (('flask', args.flask_url), ('asgi', args.asgi_url)):
+        if url:
+            if not args.allow_cache and asyncio.run(semantic_cache_enabled(url, args.timeout)):
+                parser.error(f'cache semantique actif sur {url}: relancer le serveur avec '
+                             f'RAG_SEMANTIC_CACHE=false (ou --allow-cache)')
+            reports[name] = asyncio.run(run_load(url, args.concurrency, args.requests, questions,
+                                                 args.stream, args.timeout))
+            print_report(name.upper(), reports[name])
+
+    if 'flask' in reports and 'asgi' in reports:
+        flask_rps = reports['flask']['requests_per_s']
+        asgi_rps = reports['asgi']['requests_per_s']
+        print("\n[LOAD] Comparaison ASGI / Flask")
+        if flask_rps:
+            print(f"   Debit: x{asgi_rps / flask_rps:.2f}")
+        if reports['flask']['p95_ms'] and reports['asgi']['p95_ms']:
+            print(f"   p95: {reports['flask']['p95_ms']} ms -> {reports['asgi']['p95_ms']} ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, indent=2, ensure_ascii=False)
+        print(f"\n[LOAD] Resultats ecrits dans {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Mode de service ASGI - Seance 5
+Les routes chaudes (/api/rag/query, /query/stream, /search) sont servies en asynchrone par Quart;
+toutes les autres routes (sessions, stats, fichiers statiques...) restent celles de l'application
+Flask, exposee en ASGI via WsgiToAsgi.
+
+Lancement: python src/asgi.py   ou   hypercorn src.asgi:app --bind 0.0.0.0:5000
+"""
+
+import os
+import sys
+# Memes chemins que main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart
+
+from src.main import app as flask_app
+from src.routes.rag_api_async import rag_async_bp, ASYNC_ROUTES
+
+API_PREFIX = '/api/rag'
+ASYNC_PATHS = {API_PREFIX + route for route in ASYNC_ROUTES}
+
+quart_app = Quart(__name__)
+quart_app.config['SECRET_KEY'] = flask_app.config['SECRET_KEY']
+quart_app.register_blueprint(rag_async_bp, url_prefix=API_PREFIX)
+
+@quart_app.after_request
+async def add_cors_headers(response):
+    # Equivalent de CORS(app) cote Flask (les requetes OPTIONS passent par Flask)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+wsgi_app = WsgiToAsgi(flask_app)
+
+async def app(scope, receive, send):
+    """Dispatcher ASGI: POST sur les routes asynchrones -> Quart, le reste -> Flask"""
+    if scope['type'] == 'lifespan':
+        # Demarrage/arret (fermeture des pools asynchrones) geres par Quart
+        await quart_app(scope, receive, send)
+    elif scope['type'] == 'http' and scope.get('method') == 'POST' \
+            and scope['path'].rstrip('/') in ASYNC_PATHS:
+        await quart_app(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
+
+if __name__ == '__main__':
+    import asyncio
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [os.getenv('RAG_ASGI_BIND', '0.0.0.0:5000')]
+    asyncio.run(serve(app, config))
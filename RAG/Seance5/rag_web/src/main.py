@@ -1,12 +1,13 @@
 import os
 import sys
+import multiprocessing
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 from flask import Flask, send_from_directory, request, jsonify
 from flask_cors import CORS
-from src.routes.rag_api import rag_bp
+from src.routes.rag_api import rag_bp, start_warmup
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'generic_rag_secret_key_2025'
@@ -41,5 +42,20 @@ def not_found(error):
 def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
+def is_child_process() -> bool:
+    """Processus enfant (pool d'ingestion en mode spawn): le script parent y est re-execute
+    sous le nom __mp_main__ et ne doit ni charger le modele ni indexer (le nom du processus
+    est deja fixe pendant ce re-import, parent_process() ne l'est qu'apres)"""
+    return (__name__ == '__mp_main__'
+            or multiprocessing.current_process().name != 'MainProcess'
+            or multiprocessing.parent_process() is not None)
+
+# Chargement du modele et indexation en arriere-plan: le port est ouvert immediatement
 if __name__ == '__main__':
+    # Pas dans le processus superviseur du reloader Flask, qui ne sert aucune requete
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_warmup()
     app.run(host='0.0.0.0', port=5000, debug=True)
+elif not is_child_process():
+    # Import par un serveur WSGI (gunicorn src.main:app); en ASGI, hook before_serving
+    start_warmup()
@@ -5,85 +5,286 @@ Compatible avec toute documentation fournie
 """
 
 import os
+import re
 import sys
 import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from typing import Dict, Any, List
 
 # Ajouter le chemin parent pour importer les modules RAG generiques
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))))
 
-try:
-    from rag_chain import RAGChain, PostgreSQLRAGSystem
-    print("RAG Chain LangChain charge avec succes")
-    LANGCHAIN_AVAILABLE = True
-except ImportError as e:
-    print(f"Erreur d'import: {e}")
-    RAGChain = None
-    PostgreSQLRAGSystem = None
-    LANGCHAIN_AVAILABLE = False
+# rag_chain (LangChain, sentence-transformers, torch) est importe par le thread de
+# prechauffage: le serveur ecoute avant que le modele soit charge
+RAGChain = None
+PostgreSQLRAGSystem = None
+LANGCHAIN_AVAILABLE = None  # connu une fois rag_chain importe
 
 # Blueprint generique pour tout systeme RAG
 rag_bp = Blueprint('rag', __name__)
 
-# Instance globale du systeme RAG (initialisee au demarrage)
+# Instance globale du systeme RAG (initialisee au demarrage): ressources partagees
 rag_system = None
 indexer_system = None
 initialization_error = None
+session_registry = None
+
+# Prechauffage en arriere-plan: not_started -> loading_model -> indexing -> ready | failed
+WARMUP_ACTIVE_STATES = ('starting', 'loading_model', 'indexing')
+warmup_state = 'not_started'
+warmup_started_at = None
+warmup_timings = {}
+warmup_thread = None
+warmup_lock = threading.Lock()
+warmup_done = threading.Event()
+
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+DEFAULT_SESSION_ID = "web_session"
+
+# Taille maximale d'un lot pour /query/batch
+BATCH_MAX_QUESTIONS = int(os.getenv('RAG_BATCH_MAX_QUESTIONS', '1000'))
+
+class SessionRegistry:
+    """Etat de conversation par client (historique + memoire), borne en LRU.
+
+    Chaque session est une instance legere creee par `spawn_session` qui partage
+    embeddings, vector store, index, caches et pool avec le systeme global.
+    """
+    
+    def __init__(self, base_system, max_sessions: int = 256):
+        self.base_system = base_system
+        self.max_sessions = max(1, max_sessions)
+        self.sessions = OrderedDict()  # session_id -> systeme RAG de la session
+        self.lock = threading.Lock()
+        self.created = 0
+        self.evicted = 0
+    
+    def get(self, session_id: str):
+        """Session du client (creee, ou rechargee depuis sessions/, a la premiere requete)"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                self.sessions.move_to_end(session_id)
+                return session
+        
+        # Creation hors verrou: le chargement disque ne bloque pas les autres clients
+        session = self.base_system.spawn_session()
+        if not (session.session_store.exists(session_id)
+                and session.load_session_by_id(session_id)):
+            session.session_name = session_id
+        
+        with self.lock:
+            existing = self.sessions.get(session_id)
+            if existing is not None:
+                self.sessions.move_to_end(session_id)
+                return existing
+            self.sessions[session_id] = session
+            self.created += 1
+            while len(self.sessions) > self.max_sessions:
+                # Rien a sauvegarder: chaque echange est deja ecrit sur disque
+                self.sessions.popitem(last=False)
+                self.evicted += 1
+        return session
+    
+    def rekey(self, session_id: str, session) -> str:
+        """Suivre un renommage de session (nouvelle conversation, session chargee): l'entree
+        passe sous le nouveau nom, que le client renvoie ensuite dans X-Session-Id.
+        Sans cela, une fois evincee, l'entree rechargerait l'ancienne conversation."""
+        new_id = session.session_name
+        with self.lock:
+            if self.sessions.get(session_id) is session:
+                del self.sessions[session_id]
+            # Session deja ouverte par un autre onglet: on garde l'instance existante
+            self.sessions.setdefault(new_id, session)
+            self.sessions.move_to_end(new_id)
+        return new_id
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'active_sessions': len(self.sessions),
+                'max_sessions': self.max_sessions,
+                'created': self.created,
+                'evicted': self.evicted
+            }
+
+def set_warmup_state(state: str):
+    """Changer l'etat du prechauffage (horodate depuis le lancement)"""
+    global warmup_state
+    with warmup_lock:
+        if state == warmup_state:
+            return
+        warmup_state = state
+        warmup_timings[state] = round(time.time() - warmup_started_at, 2)
+    print(f"[STARTUP] Etat du systeme RAG: {state} ({warmup_timings[state]}s)")
 
 def initialize_rag_system():
-    """Initialiser le systeme RAG au demarrage de l'application"""
-    global rag_system, initialization_error
+    """Initialiser le systeme RAG (thread de prechauffage)"""
+    global rag_system, initialization_error, session_registry
+    global RAGChain, PostgreSQLRAGSystem, LANGCHAIN_AVAILABLE
     try:
+        set_warmup_state('loading_model')
+        try:
+            from rag_chain import RAGChain, PostgreSQLRAGSystem
+            print("RAG Chain LangChain charge avec succes")
+            LANGCHAIN_AVAILABLE = True
+        except ImportError as e:
+            print(f"Erreur d'import: {e}")
+            LANGCHAIN_AVAILABLE = False
+        
+        system = None
         if LANGCHAIN_AVAILABLE and PostgreSQLRAGSystem:
             print("[STARTUP] Initialisation du systeme RAG Seance 5 avec LangChain + PostgreSQL...")
-            rag_system = PostgreSQLRAGSystem("web_session")
+            system = PostgreSQLRAGSystem(DEFAULT_SESSION_ID, on_progress=set_warmup_state)
             print("[STARTUP] Systeme RAG pret a recevoir des requetes")
         elif RAGChain:
             print("[STARTUP] Fallback sur RAGChain")
-            rag_system = RAGChain("web_session")
+            system = RAGChain(DEFAULT_SESSION_ID)
         else:
             initialization_error = "Aucun systeme RAG disponible"
+        
+        if system is not None and hasattr(system, 'spawn_session'):
+            session_registry = SessionRegistry(
+                system, max_sessions=int(os.getenv('RAG_WEB_MAX_SESSIONS', '256'))
+            )
+        rag_system = system
     except Exception as e:
         initialization_error = f"Erreur lors de l'initialisation du RAG: {e}"
         print(f"[ERROR] {initialization_error}")
-        
+    finally:
+        set_warmup_state('ready' if rag_system is not None else 'failed')
+        warmup_done.set()
+
+def start_warmup():
+    """Lancer l'initialisation du systeme RAG en arriere-plan (une seule fois)"""
+    global warmup_thread, warmup_state, warmup_started_at
+    with warmup_lock:
+        if warmup_thread is not None:
+            return
+        warmup_started_at = time.time()
+        warmup_state = 'starting'
+        warmup_thread = threading.Thread(target=initialize_rag_system, name='rag-warmup', daemon=True)
+        warmup_thread.start()
+
+def wait_until_ready(timeout: float = None) -> bool:
+    """Attendre la fin du prechauffage (scripts, tests); True si le systeme est pret"""
+    start_warmup()
+    warmup_done.wait(timeout)
+    return rag_system is not None
+
+def get_warmup_status() -> Dict[str, Any]:
+    with warmup_lock:
+        return {
+            'state': warmup_state,
+            'error': initialization_error,
+            'elapsed_seconds': round(time.time() - warmup_started_at, 2) if warmup_started_at else 0.0,
+            'timings': dict(warmup_timings)
+        }
+
 def get_rag_system():
-    """Obtenir l'instance du systeme RAG (deja initialisee)"""
+    """Obtenir l'instance du systeme RAG (None tant que le prechauffage n'est pas termine)"""
     global rag_system, initialization_error
+    if warmup_thread is None:
+        # Premier acces sans prechauffage explicite (import hors de main.py)
+        start_warmup()
     if initialization_error:
         print(f"[ERROR] Systeme RAG non disponible: {initialization_error}")
         return None
     return rag_system
 
-# Initialiser le systeme RAG au chargement du module
-if LANGCHAIN_AVAILABLE:
-    initialize_rag_system()
+def check_database(rag) -> Dict[str, Any]:
+    """Verification reelle de PostgreSQL (SELECT 1 via le pool partage)"""
+    if rag is None or getattr(rag, 'db_pool', None) is None:
+        return {'ok': False, 'error': 'Systeme RAG non initialise'}
+    result = rag.db_pool.health_check()
+    # Index NumPy embarque: la recherche ne depend pas de PostgreSQL
+    result['required'] = getattr(rag, 'vector_backend', 'pgvector') != 'numpy'
+    return result
+
+def resolve_session_rag(session_id: str):
+    """Systeme RAG d'une session client (systeme global si l'identifiant est absent ou invalide)"""
+    rag = get_rag_system()
+    if rag is None or session_registry is None:
+        return rag
+    session_id = registry_session_id(session_id)
+    if session_id is None:
+        return rag
+    return session_registry.get(session_id)
+
+def registry_session_id(session_id: str):
+    """Identifiant de session valide pour le registre (None: systeme global)"""
+    session_id = (session_id or '').strip()
+    if not SESSION_ID_PATTERN.match(session_id) or session_id == DEFAULT_SESSION_ID:
+        return None
+    return session_id
+
+def get_session_rag():
+    """Systeme RAG de la session du client (en-tete X-Session-Id envoye par app.js)"""
+    return resolve_session_rag(request.headers.get('X-Session-Id', ''))
+
+def rekey_session_rag(rag) -> str:
+    """Nouveau nom de la session du client apres renommage (a renvoyer au client)"""
+    session_id = registry_session_id(request.headers.get('X-Session-Id', ''))
+    if session_registry is None or session_id is None:
+        return rag.session_name
+    if registry_session_id(rag.session_name) is None:
+        # Nom inutilisable en en-tete (ancienne session): l'entree garde l'identifiant du client
+        return session_id
+    return session_registry.rekey(session_id, rag)
 
 def get_indexer_system():
     """L'indexeur est integre dans le systeme RAG PostgreSQL"""
     # Pas besoin d'indexeur separe, la recherche se fait via PostgreSQL
     return get_rag_system()
 
+def build_response_metadata(result) -> Dict[str, Any]:
+    """Metadonnees de reponse communes a /query et /query/stream"""
+    return {
+        'sources_count': len(result.get('sources', [])) if isinstance(result, dict) else 0,
+        'tokens_used': result.get('tokens_used', 0) if isinstance(result, dict) else 0,
+        'context_tokens': result.get('context_tokens', 0) if isinstance(result, dict) else 0,
+        'model': 'codestral-latest',
+        'timestamp': datetime.now().isoformat(),
+        'method': result.get('method', 'unknown') if isinstance(result, dict) else 'unknown',
+        'context_reference': result.get('context_reference', False) if isinstance(result, dict) else False,
+        'timings': result.get('timings', {}) if isinstance(result, dict) else {}
+    }
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Encoder un evenement Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
 @rag_bp.route('/health', methods=['GET'])
 def health_check():
-    """Verifier l'etat du systeme"""
+    """Verifier l'etat du systeme (vivant: 200 pendant le prechauffage, 503 si en echec)"""
     try:
+        warmup = get_warmup_status()
         rag = get_rag_system()
-        indexer = get_indexer_system()
+        database = check_database(rag) if rag is not None else None
+        
+        if warmup['state'] in WARMUP_ACTIVE_STATES:
+            status = 'starting'
+        elif rag is not None and (database['ok'] or not database['required']):
+            status = 'healthy'
+        else:
+            status = 'unhealthy'
         
-        status = {
-            'status': 'healthy',
+        return jsonify({
+            'status': status,
             'timestamp': datetime.now().isoformat(),
+            'warmup': warmup,
             'components': {
                 'rag_system': rag is not None,
-                'indexer_system': indexer is not None,
-                'database': True  # Simplifie pour la demo
-            }
-        }
-        
-        return jsonify(status), 200
+                'indexer_system': get_indexer_system() is not None,
+                'database': bool(database and database['ok'])
+            },
+            'database': database
+        }), 503 if status == 'unhealthy' else 200
         
     except Exception as e:
         return jsonify({
@@ -92,6 +293,20 @@ def health_check():
             'timestamp': datetime.now().isoformat()
         }), 500
 
+@rag_bp.route('/ready', methods=['GET'])
+def readiness_check():
+    """Sonde de disponibilite: 200 seulement si le systeme peut repondre aux requetes"""
+    warmup = get_warmup_status()
+    rag = get_rag_system()
+    database = check_database(rag) if rag is not None else None
+    ready = warmup['state'] == 'ready' and rag is not None and (database['ok'] or not database['required'])
+    return jsonify({
+        'ready': ready,
+        'state': warmup['state'],
+        'database': database,
+        'timestamp': datetime.now().isoformat()
+    }), 200 if ready else 503
+
 @rag_bp.route('/query', methods=['POST'])
 def query_rag():
     """Traiter une requete RAG"""
@@ -116,7 +331,7 @@ def query_rag():
         include_conversation = data.get('include_conversation', True)
         
         # Obtenir le systeme RAG
-        rag = get_rag_system()
+        rag = get_session_rag()
         if not rag:
             return jsonify({
                 'error': 'Systeme RAG non disponible',
@@ -125,7 +340,9 @@ def query_rag():
         
         # Traiter la requete avec la nouvelle interface
         try:
-            result = rag.query(question)
+            # Une requete a la fois par session: l'historique reste coherent
+            with rag.session_lock:
+                result = rag.query(question)
             print(f"[DEBUG] Résultat RAG keys: {list(result.keys()) if isinstance(result, dict) else type(result)}")
         except Exception as e:
             print(f"[ERROR] Erreur query RAG: {e}")
@@ -141,14 +358,7 @@ def query_rag():
                 'success': True,
                 'question': question,
                 'response': result.get('response', 'Erreur: pas de réponse') if isinstance(result, dict) else str(result),
-                'metadata': {
-                    'sources_count': len(result.get('sources', [])) if isinstance(result, dict) else 0,
-                    'tokens_used': result.get('tokens_used', 0) if isinstance(result, dict) else 0,
-                    'model': 'codestral-latest',
-                    'timestamp': datetime.now().isoformat(),
-                    'method': result.get('method', 'unknown') if isinstance(result, dict) else 'unknown',
-                    'context_reference': result.get('context_reference', False) if isinstance(result, dict) else False
-                }
+                'metadata': build_response_metadata(result)
             }
             
             # Ajouter les sources si demandees et disponibles
@@ -174,6 +384,139 @@ def query_rag():
             'timestamp': datetime.now().isoformat()
         }), 500
 
+@rag_bp.route('/query/stream', methods=['POST'])
+def query_rag_stream():
+    """Traiter une requete RAG en streaming (Server-Sent Events)
+
+    Evenements: sources (avant la generation), token (fragments de la reponse),
+    done (metadonnees finales) ou error.
+    """
+    data = request.get_json(silent=True)
+    if not data or not str(data.get('question', '')).strip():
+        return jsonify({
+            'error': 'Question manquante dans la requete',
+            'success': False
+        }), 400
+    
+    question = data['question'].strip()
+    include_sources = data.get('include_sources', True)
+    
+    rag = get_session_rag()
+    if not rag or not hasattr(rag, 'query_stream'):
+        return jsonify({
+            'error': 'Systeme RAG non disponible',
+            'success': False
+        }), 503
+    
+    def generate():
+        try:
+            # Une requete a la fois par session: l'historique reste coherent
+            with rag.session_lock:
+                for event, payload in rag.query_stream(question):
+                    if event == 'sources':
+                        yield format_sse('sources', {
+                            'sources': payload['sources'] if include_sources else [],
+                            'sources_count': payload['sources_count'],
+                            'context_reference': payload['context_reference']
+                        })
+                    elif event == 'token':
+                        yield format_sse('token', payload)
+                    elif event == 'done':
+                        yield format_sse('done', {
+                            'success': True,
+                            'question': question,
+                            'response': payload.get('response', ''),
+                            'metadata': build_response_metadata(payload)
+                        })
+        except Exception as e:
+            print(f"[ERROR] Erreur query RAG (stream): {e}")
+            yield format_sse('error', {
+                'error': f'Erreur lors de la requête RAG: {str(e)}',
+                'success': False,
+                'timestamp': datetime.now().isoformat()
+            })
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # pas de mise en tampon par un proxy nginx
+        }
+    )
+
+@rag_bp.route('/query/batch', methods=['POST'])
+def query_rag_batch():
+    """Traiter un lot de questions independantes (evaluation, pre-chauffage du cache)"""
+    try:
+        data = request.get_json()
+        
+        questions = data.get('questions') if data else None
+        if not isinstance(questions, list) or not questions:
+            return jsonify({
+                'error': 'Liste de questions manquante dans la requete',
+                'success': False
+            }), 400
+        
+        questions = [str(question).strip() for question in questions]
+        if not all(questions):
+            return jsonify({
+                'error': 'Question vide dans le lot',
+                'success': False
+            }), 400
+        
+        if len(questions) > BATCH_MAX_QUESTIONS:
+            return jsonify({
+                'error': f'Lot trop grand ({len(questions)} questions, maximum {BATCH_MAX_QUESTIONS})',
+                'success': False
+            }), 413
+        
+        concurrency = data.get('concurrency')
+        if concurrency is not None and (not isinstance(concurrency, int) or concurrency < 1):
+            return jsonify({
+                'error': 'concurrency doit etre un entier positif',
+                'success': False
+            }), 400
+        
+        # Questions independantes: systeme global, sans historique de session
+        rag = get_rag_system()
+        if not rag or not hasattr(rag, 'query_many'):
+            return jsonify({
+                'error': 'Systeme RAG non disponible',
+                'success': False
+            }), 503
+        
+        start = time.time()
+        results = rag.query_many(questions, concurrency=concurrency)
+        include_sources = data.get('include_sources', False)
+        
+        items = []
+        for result in results:
+            item = {
+                'question': result['question'],
+                'response': result['response'],
+                'success': result['success'],
+                'metadata': build_response_metadata(result)
+            }
+            if include_sources:
+                item['sources'] = result['sources']
+            items.append(item)
+        
+        return jsonify({
+            'success': True,
+            'results': items,
+            'count': len(items),
+            'elapsed_seconds': round(time.time() - start, 3),
+            'timestamp': datetime.now().isoformat()
+        }), 200
+    
+    except Exception as e:
+        return jsonify({
+            'error': f'Erreur lors du traitement du lot: {str(e)}',
+            'success': False,
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
 @rag_bp.route('/search', methods=['POST'])
 def search_documents():
     """Rechercher dans la base documentaire"""
@@ -238,16 +581,18 @@ def search_documents():
 def get_conversation_history():
     """Obtenir l'historique de conversation"""
     try:
-        rag = get_rag_system()
+        rag = get_session_rag()
         if not rag:
             return jsonify({
                 'error': 'Systeme RAG non disponible',
                 'success': False
             }), 503
         
-        # Recuperer l'historique du systeme PostgreSQL
+        # Recuperer l'historique du systeme PostgreSQL (sources en references,
+        # ?resolve_sources=true pour relire leur contenu)
+        resolve_sources = request.args.get('resolve_sources', 'false').lower() in ('1', 'true', 'yes')
         if hasattr(rag, 'get_conversation_history'):
-            history = rag.get_conversation_history()
+            history = rag.get_conversation_history(resolve_sources=resolve_sources)
         elif hasattr(rag, 'conversation_history'):
             history = rag.conversation_history
         else:
@@ -271,22 +616,23 @@ def get_conversation_history():
 def clear_conversation():
     """Effacer l'historique de conversation"""
     try:
-        rag = get_rag_system()
+        rag = get_session_rag()
         if not rag:
             return jsonify({
                 'error': 'Systeme RAG non disponible',
                 'success': False
             }), 503
         
-        # Effacer la memoire conversationnelle
-        if hasattr(rag, 'clear_conversation_memory'):
-            rag.clear_conversation_memory()
-        elif hasattr(rag, 'clear_memory'):
-            rag.clear_memory()
-        else:
-            # Fallback - reinitialiser la memoire
-            if hasattr(rag, 'conversation_history'):
-                rag.conversation_history = []
+        # Effacer la memoire conversationnelle (pas pendant une requete de la session)
+        with rag.session_lock:
+            if hasattr(rag, 'clear_conversation_memory'):
+                rag.clear_conversation_memory()
+            elif hasattr(rag, 'clear_memory'):
+                rag.clear_memory()
+            else:
+                # Fallback - reinitialiser la memoire
+                if hasattr(rag, 'conversation_history'):
+                    rag.conversation_history = []
         
         return jsonify({
             'success': True,
@@ -305,7 +651,7 @@ def clear_conversation():
 def export_conversation():
     """Exporter la conversation"""
     try:
-        rag = get_rag_system()
+        rag = get_session_rag()
         if not rag:
             return jsonify({
                 'error': 'Systeme RAG non disponible',
@@ -337,17 +683,20 @@ def export_conversation():
 def start_new_conversation():
     """Demarrer une nouvelle conversation"""
     try:
-        rag = get_rag_system()
+        rag = get_session_rag()
         if not rag:
             return jsonify({
                 'error': 'Systeme RAG non disponible',
                 'success': False
             }), 503
         
-        # Demarrer une nouvelle session
+        # Demarrer une nouvelle session: nom unique au format des identifiants web
         if hasattr(rag, 'create_new_session'):
-            old_session_id = rag.session_name
-            new_session_id = rag.create_new_session()
+            with rag.session_lock:
+                old_session_id = rag.session_name
+                rag.create_new_session(f"web_{uuid.uuid4().hex[:24]}")
+                # Le client adopte ce nom dans X-Session-Id
+                new_session_id = rekey_session_rag(rag)
             
             return jsonify({
                 'success': True,
@@ -359,7 +708,8 @@ def start_new_conversation():
         else:
             # Fallback - effacer l'historique
             if hasattr(rag, 'clear_memory'):
-                rag.clear_memory()
+                with rag.session_lock:
+                    rag.clear_memory()
             
             return jsonify({
                 'success': True,
@@ -379,13 +729,14 @@ def get_statistics():
     """Obtenir les statistiques du systeme"""
     try:
         indexer = get_indexer_system()
-        rag = get_rag_system()
+        rag = get_session_rag()
         
         stats = {
             'timestamp': datetime.now().isoformat(),
             'system_status': {
                 'rag_available': rag is not None,
-                'indexer_available': indexer is not None
+                'indexer_available': indexer is not None,
+                'warmup': get_warmup_status()
             }
         }
         
@@ -420,6 +771,43 @@ def get_statistics():
             except Exception as e:
                 stats['conversation'] = {'error': str(e)}
         
+        # Sessions web actives (registre LRU)
+        if session_registry is not None:
+            stats['sessions'] = session_registry.get_stats()
+        
+        # Pool de connexions PostgreSQL
+        if rag and getattr(rag, 'db_pool', None) is not None:
+            try:
+                stats['db_pool'] = rag.db_pool.get_stats()
+            except Exception as e:
+                stats['db_pool'] = {'error': str(e)}
+        
+        # Vecteurs des questions en memoire (taux de succes du cache LRU)
+        if rag and getattr(rag, 'query_embeddings', None) is not None:
+            stats['query_embedding_cache'] = rag.query_embeddings.get_stats()
+        
+        # Cache semantique des reponses (hits, taux de succes, evictions)
+        if rag and getattr(rag, 'answer_cache', None) is not None:
+            try:
+                stats['semantic_cache'] = rag.answer_cache.get_stats()
+            except Exception as e:
+                stats['semantic_cache'] = {'error': str(e)}
+        
+        # Appels LLM: tokens/s, latence p50/p95, tokens par type de question (fenetre glissante)
+        if rag and getattr(rag, 'llm_telemetry', None) is not None:
+            try:
+                stats['llm'] = rag.llm_telemetry.get_stats()
+            except Exception as e:
+                stats['llm'] = {'error': str(e)}
+        
+        # Traces par etape (export OTLP/JSON si RAG_TRACE_FILE)
+        if rag and getattr(rag, 'tracer', None) is not None:
+            stats['tracing'] = rag.tracer.get_stats()
+        
+        # Quasi-doublons SimHash ecartes (ingestion et resultats de recherche)
+        if rag and getattr(rag, 'near_duplicates', None) is not None:
+            stats['near_duplicates'] = rag.near_duplicates.get_stats()
+        
         return jsonify({
             'success': True,
             'statistics': stats
@@ -448,54 +836,45 @@ def get_document_modules():
         # Obtenir les modules depuis LangChain PGVector
         try:
             # Requete pour obtenir les sources uniques depuis la table LangChain
-            import psycopg2
-            conn = psycopg2.connect(
-                host="localhost",
-                database="rag_database",
-                user="postgres",
-                password="postgres"
-            )
-            cursor = conn.cursor()
-            
-            # Chercher dans les tables LangChain PGVector
-            cursor.execute("""
-                SELECT table_name FROM information_schema.tables 
-                WHERE table_schema = 'public' AND table_name LIKE 'langchain_pg_%'
-            """)
-            tables = cursor.fetchall()
+            # (connexion empruntee au pool partage du systeme RAG, parametres .env)
+            with indexer.db_pool.connection() as conn, conn.cursor() as cursor:
+                # Chercher dans les tables LangChain PGVector
+                cursor.execute("""
+                    SELECT table_name FROM information_schema.tables 
+                    WHERE table_schema = 'public' AND table_name LIKE 'langchain_pg_%'
+                """)
+                tables = cursor.fetchall()
             
-            modules = []
-            if tables:
-                # Utiliser la table embedding de LangChain si elle existe
-                for table in tables:
-                    if 'embedding' in table[0]:
-                        try:
-                            cursor.execute(f"""
-                                SELECT 
-                                    cmetadata->>'filename' as filename, 
-                                    COUNT(*) as doc_count
-                                FROM {table[0]}
-                                WHERE cmetadata->>'filename' IS NOT NULL
-                                GROUP BY cmetadata->>'filename'
-                                ORDER BY doc_count DESC
-                                LIMIT 20
-                            """)
+                modules = []
+                if tables:
+                    # Utiliser la table embedding de LangChain si elle existe
+                    for table in tables:
+                        if 'embedding' in table[0]:
+                            try:
+                                cursor.execute(f"""
+                                    SELECT 
+                                        cmetadata->>'filename' as filename, 
+                                        COUNT(*) as doc_count
+                                    FROM {table[0]}
+                                    WHERE cmetadata->>'filename' IS NOT NULL
+                                    GROUP BY cmetadata->>'filename'
+                                    ORDER BY doc_count DESC
+                                    LIMIT 20
+                                """)
                             
-                            module_data = cursor.fetchall()
-                            for filename, count in module_data:
-                                if filename:
-                                    modules.append({
-                                        'id': filename.lower().replace(' ', '_').replace('.', '_'),
-                                        'name': filename.replace('.md', '').replace('.txt', ''),
-                                        'description': f'Document: {filename}',
-                                        'document_count': count
-                                    })
-                            break
-                        except Exception as e:
-                            print(f"Erreur requête table {table[0]}: {e}")
-                            continue
-            
-            conn.close()
+                                module_data = cursor.fetchall()
+                                for filename, count in module_data:
+                                    if filename:
+                                        modules.append({
+                                            'id': filename.lower().replace(' ', '_').replace('.', '_'),
+                                            'name': filename.replace('.md', '').replace('.txt', ''),
+                                            'description': f'Document: {filename}',
+                                            'document_count': count
+                                        })
+                                break
+                            except Exception as e:
+                                print(f"Erreur requête table {table[0]}: {e}")
+                                continue
             
             # Si aucun module trouvé, utiliser fallback
             if not modules:
@@ -582,22 +961,41 @@ def get_example_questions():
 def get_all_sessions():
     """Obtenir toutes les sessions sauvegardees"""
     try:
-        rag = get_rag_system()
+        rag = get_session_rag()
         if not rag:
             return jsonify({
                 'error': 'Systeme RAG non disponible',
                 'success': False
             }), 503
         
-        if hasattr(rag, 'list_all_sessions'):
-            sessions = rag.list_all_sessions()
-        else:
-            sessions = []
+        # Pagination et tri: ?limit=50&offset=0&sort=last_activity&order=desc
+        try:
+            limit = request.args.get('limit', type=int)
+            offset = max(0, request.args.get('offset', 0, type=int))
+            sort_by = request.args.get('sort', 'last_activity')
+            descending = request.args.get('order', 'desc').lower() != 'asc'
+            
+            if hasattr(rag, 'list_sessions_page'):
+                page = rag.list_sessions_page(limit=limit, offset=offset, sort_by=sort_by, descending=descending)
+                sessions, total = page['sessions'], page['total']
+            elif hasattr(rag, 'list_all_sessions'):
+                sessions = rag.list_all_sessions()
+                total = len(sessions)
+            else:
+                sessions, total = [], 0
+        except ValueError as e:
+            return jsonify({
+                'error': str(e),
+                'success': False
+            }), 400
         
         return jsonify({
             'success': True,
             'sessions': sessions,
             'count': len(sessions),
+            'total': total,
+            'offset': offset,
+            'has_more': offset + len(sessions) < total,
             'timestamp': datetime.now().isoformat()
         }), 200
         
@@ -622,7 +1020,7 @@ def load_session():
         
         session_id = data['session_id']
         
-        rag = get_rag_system()
+        rag = get_session_rag()
         if not rag:
             return jsonify({
                 'error': 'Systeme RAG non disponible',
@@ -630,7 +1028,11 @@ def load_session():
             }), 503
         
         if hasattr(rag, 'load_session_by_id'):
-            success = rag.load_session_by_id(session_id)
+            with rag.session_lock:
+                success = rag.load_session_by_id(session_id)
+                if success:
+                    # Le client adopte ce nom dans X-Session-Id
+                    session_id = rekey_session_rag(rag)
             if success:
                 return jsonify({
                     'success': True,
@@ -670,7 +1072,7 @@ def delete_session():
         
         session_id = data['session_id']
         
-        rag = get_rag_system()
+        rag = get_session_rag()
         if not rag:
             return jsonify({
                 'error': 'Systeme RAG non disponible',
@@ -0,0 +1,214 @@
+"""
+API asynchrone (ASGI) pour systeme RAG generique - Seance 5
+Routes chaudes (/query, /query/stream, /search) servies par Quart: un appel au LLM
+en attente n'occupe aucun thread. Les autres routes restent celles du blueprint Flask.
+"""
+
+import asyncio
+from datetime import datetime
+from quart import Blueprint, request, jsonify, Response
+
+from . import rag_api
+
+rag_async_bp = Blueprint('rag_async', __name__)
+
+# Routes servies par ce blueprint (le reste de /api/rag passe par Flask)
+ASYNC_ROUTES = {'/query', '/query/stream', '/search'}
+
+async def get_session_rag():
+    """Systeme RAG de la session du client (en-tete X-Session-Id), meme registre que Flask"""
+    session_id = request.headers.get('X-Session-Id', '')
+    # Une session inconnue est rechargee depuis le disque: hors de la boucle d'evenements
+    return await asyncio.to_thread(rag_api.resolve_session_rag, session_id)
+
+def session_async_lock(rag) -> asyncio.Lock:
+    """Verrou asyncio par session: une requete a la fois, l'historique reste coherent"""
+    lock = getattr(rag, 'async_session_lock', None)
+    if lock is None:
+        lock = asyncio.Lock()
+        rag.async_session_lock = lock
+    return lock
+
+@rag_async_bp.route('/query', methods=['POST'])
+async def query_rag():
+    """Traiter une requete RAG (meme contrat que la route Flask)"""
+    try:
+        data = await request.get_json()
+
+        if not data or 'question' not in data:
+            return jsonify({
+                'error': 'Question manquante dans la requete',
+                'success': False
+            }), 400
+
+        question = data['question'].strip()
+        if not question:
+            return jsonify({
+                'error': 'Question vide',
+                'success': False
+            }), 400
+
+        rag = await get_session_rag()
+        if not rag or not hasattr(rag, 'aquery'):
+            return jsonify({
+                'error': 'Systeme RAG non disponible',
+                'success': False
+            }), 503
+
+        try:
+            async with session_async_lock(rag):
+                result = await rag.aquery(question)
+        except Exception as e:
+            print(f"[ERROR] Erreur query RAG (async): {e}")
+            return jsonify({
+                'error': f'Erreur lors de la requête RAG: {str(e)}',
+                'success': False,
+                'timestamp': datetime.now().isoformat()
+            }), 500
+
+        api_response = {
+            'success': True,
+            'question': question,
+            'response': result.get('response', 'Erreur: pas de réponse'),
+            'metadata': rag_api.build_response_metadata(result)
+        }
+        if data.get('include_sources', True):
+            api_response['sources'] = result.get('sources', [])
+
+        return jsonify(api_response), 200
+
+    except Exception as e:
+        return jsonify({
+            'error': f'Erreur lors du traitement: {str(e)}',
+            'success': False,
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+@rag_async_bp.route('/query/stream', methods=['POST'])
+async def query_rag_stream():
+    """Traiter une requete RAG en streaming (Server-Sent Events, memes evenements que Flask)"""
+    data = await request.get_json(silent=True)
+    if not data or not str(data.get('question', '')).strip():
+        return jsonify({
+            'error': 'Question manquante dans la requete',
+            'success': False
+        }), 400
+
+    question = data['question'].strip()
+    include_sources = data.get('include_sources', True)
+
+    rag = await get_session_rag()
+    if not rag or not hasattr(rag, 'aquery_stream'):
+        return jsonify({
+            'error': 'Systeme RAG non disponible',
+            'success': False
+        }), 503
+
+    async def generate():
+        try:
+            async with session_async_lock(rag):
+                async for event, payload in rag.aquery_stream(question):
+                    if event == 'sources':
+                        yield rag_api.format_sse('sources', {
+                            'sources': payload['sources'] if include_sources else [],
+                            'sources_count': payload['sources_count'],
+                            'context_reference': payload['context_reference']
+                        })
+                    elif event == 'token':
+                        yield rag_api.format_sse('token', payload)
+                    elif event == 'done':
+                        yield rag_api.format_sse('done', {
+                            'success': True,
+                            'question': question,
+                            'response': payload.get('response', ''),
+                            'metadata': rag_api.build_response_metadata(payload)
+                        })
+        except Exception as e:
+            print(f"[ERROR] Erreur query RAG (stream async): {e}")
+            yield rag_api.format_sse('error', {
+                'error': f'Erreur lors de la requête RAG: {str(e)}',
+                'success': False,
+                'timestamp': datetime.now().isoformat()
+            })
+
+    response = Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+    # Une generation longue ne doit pas etre coupee par le delai de reponse de Quart
+    response.timeout = None
+    return response
+
+@rag_async_bp.route('/search', methods=['POST'])
+async def search_documents():
+    """Rechercher dans la base documentaire (requete pgvector via asyncpg)"""
+    try:
+        data = await request.get_json()
+
+        if not data or 'query' not in data:
+            return jsonify({
+                'error': 'Requete de recherche manquante',
+                'success': False
+            }), 400
+
+        query = data['query'].strip()
+        if not query:
+            return jsonify({
+                'error': 'Requete de recherche vide',
+                'success': False
+            }), 400
+
+        limit = data.get('limit', 10)
+
+        indexer = rag_api.get_indexer_system()
+        if not indexer or not hasattr(indexer, 'asearch_documents'):
+            return jsonify({
+                'error': 'Systeme d\'indexation non disponible',
+                'success': False
+            }), 503
+
+        results = [
+            {
+                'content': result.get('content', ''),
+                'source': result.get('source', 'Unknown'),
+                'similarity': result.get('similarity', 0.0),
+                'metadata': result.get('metadata', {})
+            }
+            for result in await indexer.asearch_documents(query, k=limit)
+        ]
+
+        return jsonify({
+            'success': True,
+            'query': query,
+            'results': results,
+            'count': len(results),
+            'timestamp': datetime.now().isoformat()
+        }), 200
+
+    except Exception as e:
+        return jsonify({
+            'error': f'Erreur lors de la recherche: {str(e)}',
+            'success': False,
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+@rag_async_bp.before_app_serving
+async def start_rag_warmup():
+    """Prechauffage au demarrage du serveur ASGI (jamais a l'import: les workers d'ingestion
+    en mode spawn re-importent le script parent)"""
+    rag_api.start_warmup()
+
+@rag_async_bp.after_app_serving
+async def close_async_resources():
+    """Fermer le pool asyncpg et le client HTTP a l'arret du serveur"""
+    rag = rag_api.get_rag_system()
+    if rag is None:
+        return
+    if getattr(rag, 'async_db_pool', None) is not None:
+        await rag.async_db_pool.close()
+    if getattr(rag, 'async_http', None) is not None:
+        await rag.async_http.aclose()
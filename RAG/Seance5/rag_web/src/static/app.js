@@ -8,6 +8,8 @@ class GenericRAGApp {
         this.apiBase = '/api/rag';
         this.isLoading = false;
         this.conversationHistory = [];
+        this.sessionId = this.getSessionId();
+        this.sessionsPageSize = 50;
         
         this.initializeElements();
         this.bindEvents();
@@ -15,6 +17,34 @@ class GenericRAGApp {
         this.startAutoRefresh();
     }
     
+    getSessionId() {
+        // Identifiant de session propre a ce navigateur (historique et memoire separes)
+        let sessionId = localStorage.getItem('ragSessionId');
+        if (!sessionId) {
+            const random = window.crypto && crypto.randomUUID
+                ? crypto.randomUUID().replace(/-/g, '')
+                : Math.random().toString(16).slice(2) + Date.now().toString(16);
+            sessionId = `web_${random.slice(0, 24)}`;
+            localStorage.setItem('ragSessionId', sessionId);
+        }
+        return sessionId;
+    }
+    
+    setSessionId(sessionId) {
+        // Session renommee cote serveur (nouvelle conversation, session chargee)
+        if (sessionId) {
+            this.sessionId = sessionId;
+            localStorage.setItem('ragSessionId', sessionId);
+        }
+    }
+    
+    apiFetch(url, options = {}) {
+        return fetch(url, {
+            ...options,
+            headers: { ...(options.headers || {}), 'X-Session-Id': this.sessionId }
+        });
+    }
+    
     initializeElements() {
         // Elements principaux
         this.questionInput = document.getElementById('questionInput');
@@ -99,12 +129,18 @@ class GenericRAGApp {
     
     async checkSystemHealth() {
         try {
-            const response = await fetch(`${this.apiBase}/health`);
+            const response = await this.apiFetch(`${this.apiBase}/health`);
             const data = await response.json();
             
             if (data.status === 'healthy') {
                 this.updateStatus('ragStatus', 'En ligne', 'online');
                 this.updateStatus('dbStatus', 'Connectée', 'online');
+            } else if (data.status === 'starting') {
+                // Prechauffage en cours (modele, indexation): nouvelle verification plus tard
+                const label = data.warmup && data.warmup.state === 'indexing' ? 'Indexation...' : 'Démarrage...';
+                this.updateStatus('ragStatus', label, 'offline');
+                this.updateStatus('dbStatus', 'En attente', 'offline');
+                setTimeout(() => this.checkSystemHealth(), 2000);
             } else {
                 this.updateStatus('ragStatus', 'Hors ligne', 'offline');
                 this.updateStatus('dbStatus', 'Erreur', 'offline');
@@ -123,7 +159,7 @@ class GenericRAGApp {
     
     async loadExampleQuestions() {
         try {
-            const response = await fetch(`${this.apiBase}/questions/examples`);
+            const response = await this.apiFetch(`${this.apiBase}/questions/examples`);
             const data = await response.json();
             
             if (data.success) {
@@ -166,7 +202,7 @@ class GenericRAGApp {
     
     async loadModules() {
         try {
-            const response = await fetch(`${this.apiBase}/modules`);
+            const response = await this.apiFetch(`${this.apiBase}/modules`);
             const data = await response.json();
             
             if (data.success) {
@@ -221,38 +257,31 @@ class GenericRAGApp {
         // Afficher le loading
         this.setLoading(true);
         
+        const payload = {
+            question: question,
+            max_sources: 5,
+            include_conversation: this.includeConversation.checked,
+            include_sources: this.includeSources.checked
+        };
+        
         try {
-            const response = await fetch(`${this.apiBase}/query`, {
+            const response = await this.apiFetch(`${this.apiBase}/query/stream`, {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream'
                 },
-                body: JSON.stringify({
-                    question: question,
-                    max_sources: 5,
-                    include_conversation: this.includeConversation.checked,
-                    include_sources: this.includeSources.checked
-                })
+                body: JSON.stringify(payload)
             });
             
-            const data = await response.json();
-            
-            if (data.success) {
-                this.addMessage('assistant', data.response, data.metadata, data.sources);
-                this.conversationHistory.push({
-                    question: question,
-                    response: data.response,
-                    metadata: data.metadata,
-                    timestamp: new Date().toISOString()
-                });
-                
-                // Rafraîchir l'historique après l'ajout d'un message
-                setTimeout(() => this.refreshConversationHistory(), 1000);
-            } else {
-                this.addMessage('assistant', `Erreur: ${data.error}`, null, null, true);
-                this.showToast('Erreur lors du traitement de la question', 'error');
+            // Pas de streaming disponible: repli sur l'endpoint classique
+            if (!response.ok || !response.body) {
+                await this.sendMessageBlocking(payload);
+                return;
             }
             
+            await this.readResponseStream(question, response);
+            
         } catch (error) {
             console.error('Erreur lors de l\'envoi:', error);
             this.addMessage('assistant', 'Erreur de connexion au serveur', null, null, true);
@@ -262,6 +291,116 @@ class GenericRAGApp {
         }
     }
     
+    async sendMessageBlocking(payload) {
+        const response = await this.apiFetch(`${this.apiBase}/query`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(payload)
+        });
+        
+        const data = await response.json();
+        
+        if (data.success) {
+            this.addMessage('assistant', data.response, data.metadata, data.sources);
+            this.onAnswerReceived(payload.question, data.response, data.metadata);
+        } else {
+            this.addMessage('assistant', `Erreur: ${data.error}`, null, null, true);
+            this.showToast('Erreur lors du traitement de la question', 'error');
+        }
+    }
+    
+    async readResponseStream(question, response) {
+        // Lecture des Server-Sent Events: "event: <type>\ndata: <json>\n\n"
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let message = null;
+        let content = '';
+        let renderPending = false;
+        
+        const render = () => {
+            renderPending = false;
+            message.bubble.innerHTML = marked.parse(content);
+            this.chatMessages.scrollTop = this.chatMessages.scrollHeight;
+        };
+        
+        const handleEvent = (event, data) => {
+            if (event === 'sources') {
+                // Les sources arrivent avant la generation: la bulle apparait tout de suite
+                message = this.createStreamingMessage(data.sources);
+                this.loadingOverlay.classList.remove('show');
+            } else if (event === 'token') {
+                if (!message) message = this.createStreamingMessage(null);
+                content += data.delta;
+                // Un seul rendu Markdown par frame, quel que soit le debit de tokens
+                if (!renderPending) {
+                    renderPending = true;
+                    requestAnimationFrame(render);
+                }
+            } else if (event === 'done') {
+                if (!message) message = this.createStreamingMessage(null);
+                content = data.response;
+                render();
+                this.finalizeStreamingMessage(message, data.metadata);
+                this.onAnswerReceived(question, data.response, data.metadata);
+            } else if (event === 'error') {
+                if (message) message.element.remove();
+                this.addMessage('assistant', `Erreur: ${data.error}`, null, null, true);
+                this.showToast('Erreur lors du traitement de la question', 'error');
+            }
+        };
+        
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            let separator;
+            while ((separator = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, separator);
+                buffer = buffer.slice(separator + 2);
+                
+                let event = 'message';
+                const dataLines = [];
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+                });
+                if (dataLines.length) handleEvent(event, JSON.parse(dataLines.join('\n')));
+            }
+        }
+    }
+    
+    onAnswerReceived(question, response, metadata) {
+        this.conversationHistory.push({
+            question: question,
+            response: response,
+            metadata: metadata,
+            timestamp: new Date().toISOString()
+        });
+        
+        // Rafraîchir l'historique après l'ajout d'un message
+        setTimeout(() => this.refreshConversationHistory(), 1000);
+    }
+    
+    createStreamingMessage(sources) {
+        const messageDiv = this.addMessage('assistant', '', null, sources);
+        return {
+            element: messageDiv,
+            bubble: messageDiv.querySelector('.message-bubble'),
+            content: messageDiv.querySelector('.message-content')
+        };
+    }
+    
+    finalizeStreamingMessage(message, metadata) {
+        const metadataDiv = this.createMetadataElement(metadata);
+        if (metadataDiv) {
+            message.content.insertBefore(metadataDiv, message.bubble.nextSibling);
+        }
+    }
+    
     addMessage(sender, content, metadata = null, sources = null, isError = false) {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message message-${sender}`;
@@ -291,51 +430,60 @@ class GenericRAGApp {
         messageContent.appendChild(bubble);
         
         // Ajouter les métadonnées
-        if (metadata) {
-            const metadataDiv = document.createElement('div');
-            metadataDiv.className = 'message-metadata';
-            metadataDiv.innerHTML = `
-                <span><i class="fas fa-clock"></i> ${new Date(metadata.timestamp).toLocaleTimeString()}</span>
-                <span><i class="fas fa-database"></i> ${metadata.sources_count} sources</span>
-                <span><i class="fas fa-coins"></i> ${metadata.tokens_used} tokens</span>
-                <span><i class="fas fa-brain"></i> ${metadata.model}</span>
-            `;
-            messageContent.appendChild(metadataDiv);
-        }
+        const metadataDiv = this.createMetadataElement(metadata);
+        if (metadataDiv) messageContent.appendChild(metadataDiv);
         
         // Ajouter les sources
-        if (sources && sources.length > 0 && this.includeSources.checked) {
-            const sourcesDiv = document.createElement('div');
-            sourcesDiv.className = 'message-sources';
-            
-            const sourcesTitle = document.createElement('h4');
-            sourcesTitle.innerHTML = '<i class="fas fa-book"></i> Sources consultées';
-            sourcesDiv.appendChild(sourcesTitle);
-            
-            sources.forEach((source, index) => {
-                const sourceItem = document.createElement('div');
-                sourceItem.className = 'source-item';
-                
-                sourceItem.innerHTML = `
-                    <div class="source-title">${index + 1}. ${source.source || source.source_document || 'Document inconnu'}</div>
-                    <div class="source-details">
-                        Document: ${source.source || source.source_document || 'Document inconnu'} | 
-                        Similarité: ${source.similarity ? (source.similarity * 100).toFixed(1) : '0.0'}%
-                        ${source.section_title ? ` | Section: ${source.section_title}` : ''}
-                    </div>
-                `;
-                
-                sourcesDiv.appendChild(sourceItem);
-            });
-            
-            messageContent.appendChild(sourcesDiv);
-        }
+        const sourcesDiv = this.createSourcesElement(sources);
+        if (sourcesDiv) messageContent.appendChild(sourcesDiv);
         
         messageDiv.appendChild(avatar);
         messageDiv.appendChild(messageContent);
         
         this.chatMessages.appendChild(messageDiv);
         this.chatMessages.scrollTop = this.chatMessages.scrollHeight;
+        return messageDiv;
+    }
+    
+    createMetadataElement(metadata) {
+        if (!metadata) return null;
+        const metadataDiv = document.createElement('div');
+        metadataDiv.className = 'message-metadata';
+        metadataDiv.innerHTML = `
+            <span><i class="fas fa-clock"></i> ${new Date(metadata.timestamp).toLocaleTimeString()}</span>
+            <span><i class="fas fa-database"></i> ${metadata.sources_count} sources</span>
+            <span><i class="fas fa-coins"></i> ${metadata.tokens_used} tokens</span>
+            <span><i class="fas fa-brain"></i> ${metadata.model}</span>
+        `;
+        return metadataDiv;
+    }
+    
+    createSourcesElement(sources) {
+        if (!sources || sources.length === 0 || !this.includeSources.checked) return null;
+        const sourcesDiv = document.createElement('div');
+        sourcesDiv.className = 'message-sources';
+        
+        const sourcesTitle = document.createElement('h4');
+        sourcesTitle.innerHTML = '<i class="fas fa-book"></i> Sources consultées';
+        sourcesDiv.appendChild(sourcesTitle);
+        
+        sources.forEach((source, index) => {
+            const sourceItem = document.createElement('div');
+            sourceItem.className = 'source-item';
+            
+            sourceItem.innerHTML = `
+                <div class="source-title">${index + 1}. ${source.source || source.source_document || 'Document inconnu'}</div>
+                <div class="source-details">
+                    Document: ${source.source || source.source_document || 'Document inconnu'} | 
+                    Similarité: ${source.similarity ? (source.similarity * 100).toFixed(1) : '0.0'}%
+                    ${source.section_title ? ` | Section: ${source.section_title}` : ''}
+                </div>
+            `;
+            
+            sourcesDiv.appendChild(sourceItem);
+        });
+        
+        return sourcesDiv;
     }
     
     setLoading(loading) {
@@ -352,7 +500,7 @@ class GenericRAGApp {
     
     async showStatistics() {
         try {
-            const response = await fetch(`${this.apiBase}/stats`);
+            const response = await this.apiFetch(`${this.apiBase}/stats`);
             const data = await response.json();
             
             if (data.success) {
@@ -399,6 +547,19 @@ class GenericRAGApp {
             `;
         }
         
+        if (stats.llm && stats.llm.window) {
+            html += `
+                <div class="stat-card">
+                    <div class="stat-value">${stats.llm.window.tokens_per_second}</div>
+                    <div class="stat-label">Tokens/s (LLM)</div>
+                </div>
+                <div class="stat-card">
+                    <div class="stat-value">${stats.llm.window.latency_p50_ms ?? '-'} / ${stats.llm.window.latency_p95_ms ?? '-'} ms</div>
+                    <div class="stat-label">Latence LLM p50 / p95</div>
+                </div>
+            `;
+        }
+        
         html += '</div>';
         
         // Détails de l'index
@@ -423,11 +584,12 @@ class GenericRAGApp {
     
     async showHistory() {
         try {
-            const response = await fetch(`${this.apiBase}/conversation/sessions`);
+            // Sessions les plus recentes d'abord, une page a la fois (catalogue cote serveur)
+            const response = await this.apiFetch(`${this.apiBase}/conversation/sessions?limit=${this.sessionsPageSize}&sort=last_activity&order=desc`);
             const data = await response.json();
             
             if (data.success) {
-                this.renderSessionsList(data.sessions);
+                this.renderSessionsList(data.sessions, data.total);
                 this.historyModal.classList.add('show');
             } else {
                 this.showToast('Erreur lors du chargement des sessions', 'error');
@@ -438,7 +600,7 @@ class GenericRAGApp {
         }
     }
     
-    renderSessionsList(sessions) {
+    renderSessionsList(sessions, total = sessions.length) {
         const historyContent = document.getElementById('historyContent');
         
         if (sessions.length === 0) {
@@ -490,6 +652,10 @@ class GenericRAGApp {
             `;
         });
         
+        if (total > sessions.length) {
+            html += `<p style="color: #666; font-size: 0.9em;">${total - sessions.length} session(s) plus ancienne(s) non affichée(s).</p>`;
+        }
+        
         historyContent.innerHTML = html;
     }
     
@@ -499,7 +665,7 @@ class GenericRAGApp {
         }
         
         try {
-            const response = await fetch(`${this.apiBase}/conversation/load`, {
+            const response = await this.apiFetch(`${this.apiBase}/conversation/load`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
@@ -512,6 +678,7 @@ class GenericRAGApp {
             const data = await response.json();
             
             if (data.success) {
+                this.setSessionId(data.session_id);
                 this.historyModal.classList.remove('show');
                 this.showToast(`Session ${sessionId} chargée`, 'success');
                 
@@ -532,7 +699,7 @@ class GenericRAGApp {
         }
         
         try {
-            const response = await fetch(`${this.apiBase}/conversation/delete`, {
+            const response = await this.apiFetch(`${this.apiBase}/conversation/delete`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
@@ -560,7 +727,7 @@ class GenericRAGApp {
     async refreshConversationHistory() {
         // Mise à jour automatique de l'historique
         try {
-            const response = await fetch(`${this.apiBase}/conversation/history`);
+            const response = await this.apiFetch(`${this.apiBase}/conversation/history`);
             const data = await response.json();
             
             if (data.success) {
@@ -577,7 +744,7 @@ class GenericRAGApp {
         // Charger et afficher visuellement la conversation de la session
         try {
             // Récupérer l'historique de la session chargée
-            const response = await fetch(`${this.apiBase}/conversation/history`);
+            const response = await this.apiFetch(`${this.apiBase}/conversation/history`);
             const data = await response.json();
             
             if (data.success && data.history && data.history.length > 0) {
@@ -708,7 +875,7 @@ class GenericRAGApp {
         }
         
         try {
-            const response = await fetch(`${this.apiBase}/conversation/clear`, {
+            const response = await this.apiFetch(`${this.apiBase}/conversation/clear`, {
                 method: 'POST'
             });
             
@@ -734,13 +901,14 @@ class GenericRAGApp {
         }
         
         try {
-            const response = await fetch(`${this.apiBase}/conversation/new`, {
+            const response = await this.apiFetch(`${this.apiBase}/conversation/new`, {
                 method: 'POST'
             });
             
             const data = await response.json();
             
             if (data.success) {
+                this.setSessionId(data.new_session_id);
                 this.chatMessages.innerHTML = '';
                 this.welcomeMessage.style.display = 'block';
                 this.conversationHistory = [];
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Re-indexation du corpus Seance 5 en ligne de commande
+Mise a jour incrementale (ou complete) + benchmark COPY vs INSERT de l'ORM
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+
+def run_reindex(args):
+    """Lancer l'indexation du corpus avec les options demandees"""
+    if args.full:
+        os.environ['RAG_FORCE_REINDEX'] = 'true'
+    os.environ['RAG_BULK_WRITE'] = args.writer
+    os.environ['RAG_COPY_FORMAT'] = args.format
+    os.environ['RAG_COPY_BATCH_SIZE'] = str(args.batch_size)
+
+    from rag_chain import PostgreSQLRAGSystem
+
+    start = time.monotonic()
+    rag = PostgreSQLRAGSystem("reindex")
+    print(f"[REINDEX] Termine en {time.monotonic() - start:.2f}s - "
+          f"vector store pret: {rag.vector_store is not None}")
+    return 0 if rag.vector_store is not None else 1
+
+
+def run_benchmark(args):
+    """Comparer INSERT ORM (PGVector.add_embeddings) et COPY texte/binaire sur une collection jetable"""
+    from rag_chain import PGVector
+    from pgvector_bulk import PGVectorBulkWriter
+    from db_pool import DatabasePool
+
+    db_params = {
+        "host": os.getenv('DB_HOST', 'localhost'),
+        "port": os.getenv('DB_PORT', '5432'),
+        "database": os.getenv('DB_NAME'),
+        "user": os.getenv('DB_USER'),
+        "password": os.getenv('DB_PASSWORD')
+    }
+    connection_string = (f"postgresql://{db_params['user']}:{db_params['password']}"
+                         f"@{db_params['host']}:{db_params['port']}/{db_params['database']}")
+    # Connexions ouvertes une fois pour toutes: on ne mesure que l'ecriture
+    pool = DatabasePool(db_params, min_size=1, max_size=2)
+
+    rng = np.random.default_rng(42)
+    vectors = rng.standard_normal((args.benchmark, args.dim), dtype=np.float32)
+    texts = [f"Chunk de benchmark numero {i} " * 20 for i in range(args.benchmark)]
+    metadatas = [{'filename': 'benchmark.txt', 'chunk_id': f"bench-{i}"} for i in range(args.benchmark)]
+    ids = [f"bench-{i}" for i in range(args.benchmark)]
+
+    print(f"[BENCH] {args.benchmark} lignes, dimension {args.dim}")
+    results = {}
+    for method in ('orm', 'copy-text', 'copy-binary'):
+        store = PGVector(
+            connection_string=connection_string,
+            embedding_function=None,
+            collection_name="seance5_bulk_benchmark",
+            pre_delete_collection=True,
+            connection=pool.engine
+        )
+        start = time.monotonic()
+        if method == 'orm':
+            for offset in range(0, args.benchmark, args.batch_size):
+                end = offset + args.batch_size
+                store.add_embeddings(texts[offset:end], vectors[offset:end].tolist(),
+                                     metadatas[offset:end], ids[offset:end])
+        else:
+            writer = PGVectorBulkWriter(db_params, "seance5_bulk_benchmark",
+                                        copy_format=method.split('-')[1], batch_size=args.batch_size,
+                                        pool=pool)
+            writer.add_embeddings(texts, vectors.tolist(), metadatas, ids)
+            writer.close()
+        elapsed = time.monotonic() - start
+        results[method] = elapsed
+        print(f"   {method:12s} {elapsed:8.2f}s  {args.benchmark / elapsed:10.0f} lignes/s")
+        store.delete_collection()
+    pool.dispose()
+
+    baseline = results['orm']
+    for method in ('copy-text', 'copy-binary'):
+        print(f"[BENCH] {method}: x{baseline / results[method]:.1f} par rapport a l'ORM")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-indexation du corpus Seance 5 (PostgreSQL + pgvector)")
+    parser.add_argument('--full', action='store_true', help="reconstruire toute la collection")
+    parser.add_argument('--writer', choices=['copy', 'orm'], default=os.getenv('RAG_BULK_WRITE', 'copy'),
+                        help="chemin d'ecriture des embeddings")
+    parser.add_argument('--format', choices=['text', 'binary'], default=os.getenv('RAG_COPY_FORMAT', 'text'),
+                        help="format COPY")
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv('RAG_COPY_BATCH_SIZE', '5000')),
+                        help="lignes par transaction COPY")
+    parser.add_argument('--benchmark', type=int, metavar='N', default=0,
+                        help="comparer ORM / COPY texte / COPY binaire sur N lignes synthetiques")
+    parser.add_argument('--dim', type=int, default=384, help="dimension des vecteurs du benchmark")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        return run_benchmark(args)
+    return run_reindex(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
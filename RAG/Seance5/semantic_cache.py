@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Cache semantique des reponses - Seance 5
+Questions deja traitees (embeddings normalises dans une matrice float32) -> reponse + sources
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """Recherche exacte par produit scalaire sur une petite matrice de questions.
+
+    Une entree est servie si la similarite cosinus depasse `threshold`. Le cache est
+    borne (LRU sur `max_entries`), les entrees expirent apres `ttl_seconds`, et tout
+    est invalide quand l'empreinte du corpus change.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1000, ttl_seconds: float = 86400):
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.fingerprint = None
+
+        self.matrix = None                # (max_entries, dim), allouee au premier ajout
+        self.created_at = np.zeros(self.max_entries, dtype=np.float64)
+        self.active = np.zeros(self.max_entries, dtype=bool)
+        self.entries = {}                 # ligne -> reponse en cache
+        self.lru = OrderedDict()          # ligne -> None, de la moins a la plus recemment utilisee
+        self.free_slots = list(range(self.max_entries - 1, -1, -1))
+        self.lock = threading.Lock()
+
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_env(cls) -> 'SemanticAnswerCache':
+        return cls(
+            threshold=float(os.getenv('RAG_SEMANTIC_CACHE_THRESHOLD', '0.95')),
+            max_entries=int(os.getenv('RAG_SEMANTIC_CACHE_MAX_ENTRIES', '1000')),
+            ttl_seconds=float(os.getenv('RAG_SEMANTIC_CACHE_TTL', '86400'))
+        )
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _check_fingerprint(self, fingerprint: Optional[str]):
+        """Vider le cache si le corpus indexe a change (appele sous verrou)"""
+        if fingerprint != self.fingerprint:
+            if self.entries:
+                self.invalidations += 1
+                print(f"[CACHE] Corpus modifie: {len(self.entries)} reponses en cache invalidees")
+            self._clear()
+            self.fingerprint = fingerprint
+
+    def _clear(self):
+        self.active[:] = False
+        self.entries = {}
+        self.lru = OrderedDict()
+        self.free_slots = list(range(self.max_entries - 1, -1, -1))
+
+    def _release(self, slot: int):
+        self.active[slot] = False
+        self.entries.pop(slot, None)
+        self.lru.pop(slot, None)
+        self.free_slots.append(slot)
+
+    def _expire(self, now: float):
+        if not self.ttl_seconds:
+            return
+        expired = np.flatnonzero(self.active & (now - self.created_at > self.ttl_seconds))
+        for slot in expired:
+            self._release(int(slot))
+        self.expirations += len(expired)
+
+    def lookup(self, query_vector, fingerprint: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Reponse en cache la plus proche de la question, si au-dessus du seuil"""
+        query = self._normalize(query_vector)
+        with self.lock:
+            self.lookups += 1
+            self._check_fingerprint(fingerprint)
+            self._expire(time.time())
+            if self.matrix is None or not self.entries or self.matrix.shape[1] != query.shape[0]:
+                return None
+
+            scores = self.matrix @ query
+            scores[~self.active] = -np.inf
+            slot = int(np.argmax(scores))
+            similarity = float(scores[slot])
+            if similarity < self.threshold:
+                return None
+
+            self.hits += 1
+            self.lru.move_to_end(slot)
+            return dict(self.entries[slot], cache_similarity=round(similarity, 4))
+
+    def put(self, query_vector, entry: Dict[str, Any], fingerprint: Optional[str] = None):
+        """Memoriser la reponse d'une question (eviction LRU si le cache est plein)"""
+        query = self._normalize(query_vector)
+        with self.lock:
+            self._check_fingerprint(fingerprint)
+            if self.matrix is None or self.matrix.shape[1] != query.shape[0]:
+                self._clear()
+                self.matrix = np.zeros((self.max_entries, query.shape[0]), dtype=np.float32)
+
+            # Question quasi identique deja en cache: on remplace l'entree
+            if self.entries:
+                scores = self.matrix @ query
+                scores[~self.active] = -np.inf
+                slot = int(np.argmax(scores))
+                if scores[slot] >= self.threshold:
+                    self._release(slot)
+
+            if not self.free_slots:
+                oldest, _ = self.lru.popitem(last=False)
+                self._release(oldest)
+                self.evictions += 1
+
+            slot = self.free_slots.pop()
+            self.matrix[slot] = query
+            self.created_at[slot] = time.time()
+            self.active[slot] = True
+            self.entries[slot] = entry
+            self.lru[slot] = None
+
+    def clear(self):
+        with self.lock:
+            self._clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'ttl_seconds': self.ttl_seconds,
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'misses': self.lookups - self.hits,
+                'hit_rate': round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+Stockage des sessions de conversation - Seance 5
+Journal append-only par session (sessions/{id}.jsonl): une ligne d'en-tete puis une ligne
+compacte par echange, ecrit par un thread dedie. Les anciennes sessions .json restent lisibles.
+Catalogue SQLite (sessions/catalog.sqlite3) pour lister les sessions sans ouvrir les journaux.
+"""
+
+import os
+import json
+import queue
+import atexit
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+FORMAT_VERSION = 1
+
+CATALOG_SORT_COLUMNS = ('last_activity', 'created_at', 'turns', 'session_id')
+
+_shared_stores = {}
+_shared_lock = threading.Lock()
+
+
+def _dumps(record: Dict[str, Any]) -> str:
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+
+class SessionCatalog:
+    """Index SQLite des sessions: id, dates de creation / derniere activite, nombre
+    d'echanges. Mis a jour par le thread d'ecriture du SessionStore; une page triee
+    se lit par un index (ORDER BY ... LIMIT), sans ouvrir aucun journal.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                session_name TEXT,
+                created_at TEXT,
+                last_activity TEXT,
+                turns INTEGER NOT NULL DEFAULT 0,
+                format TEXT NOT NULL DEFAULT 'jsonl'
+            );
+            CREATE INDEX IF NOT EXISTS sessions_last_activity ON sessions (last_activity);
+            CREATE INDEX IF NOT EXISTS sessions_created_at ON sessions (created_at);
+            CREATE INDEX IF NOT EXISTS sessions_turns ON sessions (turns);
+        """)
+        self.conn.commit()
+
+    def upsert(self, session_id: str, session_name: str, created_at: Optional[str],
+               last_activity: Optional[str], turns: int, format_name: str = 'jsonl'):
+        """Ecrire la ligne d'une session (nombre d'echanges absolu)"""
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO sessions (session_id, session_name, created_at, last_activity, turns, format) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET session_name = excluded.session_name, "
+                "created_at = COALESCE(sessions.created_at, excluded.created_at), "
+                "last_activity = excluded.last_activity, turns = excluded.turns, format = excluded.format",
+                (session_id, session_name, created_at, last_activity, turns, format_name)
+            )
+            self.conn.commit()
+
+    def add_turns(self, session_id: str, created_at: str, last_activity: Optional[str], count: int):
+        """Echanges ajoutes a un journal (cree la ligne si besoin)"""
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO sessions (session_id, session_name, created_at, last_activity, turns, format) "
+                "VALUES (?, ?, ?, ?, ?, 'jsonl') "
+                "ON CONFLICT(session_id) DO UPDATE SET turns = sessions.turns + excluded.turns, "
+                "last_activity = COALESCE(excluded.last_activity, sessions.last_activity), format = 'jsonl'",
+                (session_id, session_id, created_at, last_activity or created_at, count)
+            )
+            self.conn.commit()
+
+    def delete(self, session_id: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self.conn.commit()
+
+    def session_ids(self) -> set:
+        with self.lock:
+            return {row[0] for row in self.conn.execute("SELECT session_id FROM sessions")}
+
+    def count(self, exclude: Optional[str] = None) -> int:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM sessions WHERE session_id IS NOT ?", (exclude,)
+            ).fetchone()[0]
+
+    def page(self, limit: Optional[int] = None, offset: int = 0, sort_by: str = 'last_activity',
+             descending: bool = True, exclude: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Une page de sessions triee (colonne validee contre CATALOG_SORT_COLUMNS)"""
+        if sort_by not in CATALOG_SORT_COLUMNS:
+            raise ValueError(f"Tri inconnu: {sort_by} (valeurs: {', '.join(CATALOG_SORT_COLUMNS)})")
+        direction = 'DESC' if descending else 'ASC'
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT session_id, session_name, created_at, last_activity, turns, format FROM sessions "
+                f"WHERE session_id IS NOT ? ORDER BY {sort_by} {direction}, session_id {direction} "
+                f"LIMIT ? OFFSET ?",
+                (exclude, -1 if limit is None else max(0, limit), max(0, offset))
+            ).fetchall()
+        return [
+            {
+                'session_id': session_id,
+                'session_name': session_name,
+                'created_at': created_at,
+                'saved_at': last_activity,
+                'last_activity': last_activity,
+                'conversation_count': turns,
+                'format': format_name
+            }
+            for session_id, session_name, created_at, last_activity, turns, format_name in rows
+        ]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class SessionStore:
+    """Journal JSONL par session.
+
+    - {"type": "header", "session_name": ..., "created_at": ..., "version": 1}
+    - {"type": "turn", "turn": {...}} pour chaque echange
+
+    Les ecritures passent par une file consommee par un thread unique (ordre
+    conserve, aucune E/S sur le thread de la requete); une lecture n'attend que
+    les ecritures en file de sa propre session. Tous les `compact_every`
+    echanges ajoutes, le journal est reecrit (en-tete a jour, lignes tronquees
+    par un arret brutal supprimees).
+    """
+
+    def __init__(self, sessions_dir: Path, compact_every: int = 200):
+        self.sessions_dir = Path(sessions_dir)
+        self.sessions_dir.mkdir(parents=True, exist_ok=True)
+        self.compact_every = max(1, compact_every)
+        self.appended_since_compaction = {}
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = {}  # session_id -> ecritures en file
+        self.pending_done = threading.Condition(self.lock)
+        self.writes = 0
+        self.compactions = 0
+        self.errors = 0
+        self.catalog = SessionCatalog(self.sessions_dir / "catalog.sqlite3")
+        self.reconcile_catalog()
+        self.writer = threading.Thread(target=self._writer_loop, name='session-writer', daemon=True)
+        self.writer.start()
+        atexit.register(self.flush)
+
+    @classmethod
+    def from_env(cls, sessions_dir: Path) -> 'SessionStore':
+        return cls(sessions_dir, compact_every=int(os.getenv('RAG_SESSION_COMPACT_EVERY', '200')))
+
+    @classmethod
+    def shared(cls, sessions_dir: Path) -> 'SessionStore':
+        """Un seul store (donc un seul thread d'ecriture) par dossier de sessions"""
+        key = str(Path(sessions_dir).resolve())
+        with _shared_lock:
+            store = _shared_stores.get(key)
+            if store is None:
+                store = cls.from_env(sessions_dir)
+                _shared_stores[key] = store
+            return store
+
+    # ------------------------------------------------------------------
+    # Chemins
+    # ------------------------------------------------------------------
+    def log_path(self, session_id: str) -> Path:
+        return self.sessions_dir / f"{session_id}.jsonl"
+
+    def legacy_path(self, session_id: str) -> Path:
+        return self.sessions_dir / f"{session_id}.json"
+
+    def exists(self, session_id: str) -> bool:
+        return self.log_path(session_id).exists() or self.legacy_path(session_id).exists()
+
+    # ------------------------------------------------------------------
+    # Ecriture (asynchrone)
+    # ------------------------------------------------------------------
+    def save(self, session_id: str, turns: List[Dict[str, Any]], persisted: Optional[int]) -> int:
+        """Persister l'historique d'une session.
+
+        `persisted` est le nombre d'echanges deja dans le journal: seuls les suivants
+        sont ajoutes. None (journal inconnu, ancien format .json) -> reecriture complete.
+        Retourne le nouveau nombre d'echanges persistes.
+        """
+        last_activity = turns[-1].get('timestamp') if turns else None
+        if persisted is None or persisted > len(turns):
+            lines = [_dumps({'type': 'turn', 'turn': turn}) for turn in turns]
+            self._enqueue(self._rewrite, session_id, lines, last_activity)
+        else:
+            lines = [_dumps({'type': 'turn', 'turn': turn}) for turn in turns[persisted:]]
+            if lines:
+                self._enqueue(self._append, session_id, lines, last_activity)
+        return len(turns)
+
+    def delete(self, session_id: str):
+        self._enqueue(self._delete, session_id)
+        self.wait_for(session_id)
+
+    def flush(self):
+        """Attendre que toutes les ecritures en file soient sur disque (arret du processus)"""
+        self.queue.join()
+
+    def wait_for(self, session_id: str):
+        """Attendre les seules ecritures en file de `session_id` (pas celles des autres sessions)"""
+        with self.pending_done:
+            self.pending_done.wait_for(lambda: not self.pending.get(session_id))
+
+    def _enqueue(self, operation, session_id: str, *args):
+        with self.lock:
+            self.pending[session_id] = self.pending.get(session_id, 0) + 1
+        self.queue.put((operation, (session_id,) + args))
+
+    def _writer_loop(self):
+        while True:
+            operation, args = self.queue.get()
+            try:
+                operation(*args)
+            except Exception as e:
+                with self.lock:
+                    self.errors += 1
+                print(f"[ERROR] Ecriture session {args[0]}: {e}")
+            finally:
+                with self.pending_done:
+                    remaining = self.pending.get(args[0], 1) - 1
+                    if remaining > 0:
+                        self.pending[args[0]] = remaining
+                    else:
+                        self.pending.pop(args[0], None)
+                    self.pending_done.notify_all()
+                self.queue.task_done()
+
+    def _header(self, session_id: str, created_at: str = None, turns: int = None) -> str:
+        header = {
+            'type': 'header',
+            'version': FORMAT_VERSION,
+            'session_name': session_id,
+            'created_at': created_at or datetime.now().isoformat()
+        }
+        if turns is not None:
+            header['compacted_at'] = datetime.now().isoformat()
+            header['conversation_count'] = turns
+        return _dumps(header)
+
+    def _append(self, session_id: str, lines: List[str], last_activity: Optional[str] = None):
+        path = self.log_path(session_id)
+        if not path.exists() and self.legacy_path(session_id).exists():
+            # Ancien format: on ne complete pas un .json, on le convertit
+            legacy = self._read_legacy(self.legacy_path(session_id))
+            legacy_lines = [_dumps({'type': 'turn', 'turn': turn}) for turn in legacy['conversation_history']]
+            self._rewrite(session_id, legacy_lines + lines, last_activity)
+            return
+
+        created_at = datetime.now().isoformat()
+        with open(path, 'a', encoding='utf-8') as f:
+            if f.tell() == 0:
+                f.write(self._header(session_id, created_at) + '\n')
+            f.write('\n'.join(lines) + '\n')
+        self.catalog.add_turns(session_id, created_at, last_activity, len(lines))
+
+        with self.lock:
+            self.writes += 1
+            count = self.appended_since_compaction.get(session_id, 0) + len(lines)
+            self.appended_since_compaction[session_id] = count
+        if count >= self.compact_every:
+            self._compact(session_id)
+
+    def _rewrite(self, session_id: str, lines: List[str], last_activity: Optional[str] = None):
+        path = self.log_path(session_id)
+        created_at = None
+        if path.exists():
+            created_at = self._read_log(path)['created_at']
+        elif self.legacy_path(session_id).exists():
+            created_at = self._read_legacy(self.legacy_path(session_id))['created_at']
+
+        created_at = created_at or datetime.now().isoformat()
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self._header(session_id, created_at, turns=len(lines)) + '\n')
+            if lines:
+                f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+        legacy = self.legacy_path(session_id)
+        if legacy.exists():
+            legacy.unlink()
+        self.catalog.upsert(session_id, session_id, created_at, last_activity or created_at, len(lines))
+        with self.lock:
+            self.writes += 1
+            self.appended_since_compaction[session_id] = 0
+
+    def _compact(self, session_id: str):
+        """Reecrire le journal: en-tete a jour, lignes illisibles supprimees"""
+        path = self.log_path(session_id)
+        if not path.exists():
+            return
+        data = self._read_log(path)
+        lines = [_dumps({'type': 'turn', 'turn': turn}) for turn in data['conversation_history']]
+        self._rewrite(session_id, lines, data['saved_at'])
+        with self.lock:
+            self.compactions += 1
+        print(f"[SESSION] Journal {session_id} compacte: {len(lines)} echanges")
+
+    def _delete(self, session_id: str):
+        for path in (self.log_path(session_id), self.legacy_path(session_id)):
+            if path.exists():
+                path.unlink()
+        self.catalog.delete(session_id)
+        with self.lock:
+            self.appended_since_compaction.pop(session_id, None)
+
+    # ------------------------------------------------------------------
+    # Lecture
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _read_log(path: Path) -> Dict[str, Any]:
+        header = {}
+        turns = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Derniere ligne tronquee par un arret brutal
+                    continue
+                if record.get('type') == 'header':
+                    header = record
+                elif record.get('type') == 'turn':
+                    turns.append(record['turn'])
+
+        saved_at = turns[-1].get('timestamp') if turns else None
+        return {
+            'session_name': header.get('session_name', path.stem),
+            'created_at': header.get('created_at'),
+            'saved_at': saved_at or header.get('created_at'),
+            'conversation_count': len(turns),
+            'conversation_history': turns,
+            'format': 'jsonl'
+        }
+
+    @staticmethod
+    def _read_legacy(path: Path) -> Dict[str, Any]:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        turns = data.get('conversation_history', [])
+        return {
+            'session_name': data.get('session_name', path.stem),
+            'created_at': data.get('saved_at'),
+            'saved_at': data.get('saved_at'),
+            'conversation_count': data.get('conversation_count', len(turns)),
+            'conversation_history': turns,
+            'format': 'json'
+        }
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Session complete (journal .jsonl, sinon ancien .json), None si absente"""
+        self.wait_for(session_id)
+        if self.log_path(session_id).exists():
+            return self._read_log(self.log_path(session_id))
+        if self.legacy_path(session_id).exists():
+            return self._read_legacy(self.legacy_path(session_id))
+        return None
+
+    def summary(self, path: Path) -> Dict[str, Any]:
+        """Resume d'une session sans decoder tous les echanges: en-tete, nombre de
+        lignes et dernier echange"""
+        if path.suffix == '.json':
+            data = self._read_legacy(path)
+            turns = data.pop('conversation_history')
+            data['last_activity'] = turns[-1].get('timestamp', data['saved_at']) if turns else data['saved_at']
+            return data
+
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline() or b'{}')
+            content = f.read()
+        lines = content.splitlines()
+        if lines and not content.endswith(b'\n'):
+            # Derniere ligne tronquee par un arret brutal
+            lines.pop()
+        last_activity = header.get('created_at')
+        for line in reversed(lines):
+            try:
+                last_activity = json.loads(line)['turn'].get('timestamp', last_activity)
+                break
+            except (ValueError, KeyError):
+                continue
+        return {
+            'session_name': header.get('session_name', path.stem),
+            'created_at': header.get('created_at'),
+            'saved_at': last_activity,
+            'last_activity': last_activity,
+            'conversation_count': len(lines),
+            'format': 'jsonl'
+        }
+
+    def _session_files(self) -> Dict[str, Path]:
+        """Fichiers de session par id (un journal .jsonl masque un .json du meme nom)"""
+        paths = {path.stem: path for path in self.sessions_dir.glob("*.json")}
+        paths.update({path.stem: path for path in self.sessions_dir.glob("*.jsonl")})
+        return paths
+
+    def reconcile_catalog(self):
+        """Aligner le catalogue sur le dossier (premier lancement, fichiers copies ou
+        supprimes a la main): seuls les fichiers absents du catalogue sont lus"""
+        paths = self._session_files()
+        known = self.catalog.session_ids()
+        for session_id in known - set(paths):
+            self.catalog.delete(session_id)
+        added = 0
+        for session_id in sorted(set(paths) - known):
+            try:
+                summary = self.summary(paths[session_id])
+                self.catalog.upsert(session_id, summary['session_name'], summary['created_at'],
+                                    summary['last_activity'], summary['conversation_count'], summary['format'])
+                added += 1
+            except Exception as e:
+                print(f"[WARNING] Erreur lecture session {paths[session_id]}: {e}")
+        if added:
+            print(f"[SESSION] Catalogue: {added} sessions indexees")
+
+    def list_sessions(self, limit: Optional[int] = None, offset: int = 0, sort_by: str = 'last_activity',
+                      descending: bool = True, exclude: Optional[str] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """Page de resumes de sessions depuis le catalogue et nombre total de sessions
+        (sans attendre la file: un echange en cours d'ecriture apparait juste apres)"""
+        return (
+            self.catalog.page(limit=limit, offset=offset, sort_by=sort_by, descending=descending, exclude=exclude),
+            self.catalog.count(exclude=exclude)
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'pending_writes': self.queue.qsize(),
+                'writes': self.writes,
+                'compactions': self.compactions,
+                'errors': self.errors,
+                'compact_every': self.compact_every
+            }
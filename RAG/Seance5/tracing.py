@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Traces par etape des requetes RAG - Seance 5
+Spans chronometres (perf_counter_ns) autour de l'embedding, de la recherche, du contexte,
+de l'appel LLM, de la memoire et de la sauvegarde; export optionnel au format OTLP/JSON
+(une trace par ligne, lisible par le collecteur OpenTelemetry ou Jaeger)
+"""
+
+import os
+import json
+import time
+import threading
+import contextvars
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+# Trace de la requete en cours (propagee aux taches asyncio et a asyncio.to_thread)
+_current_trace = contextvars.ContextVar('rag_current_trace', default=None)
+# Span ouvert le plus interne: parent des spans suivants dans ce contexte uniquement
+# (deux taches ou threads d'une meme trace ne s'imbriquent pas l'un dans l'autre)
+_current_span = contextvars.ContextVar('rag_current_span', default=None)
+
+
+class _NoopSpan:
+    """Span partage quand aucune trace n'est active: aucun chronometrage"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'attributes', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'error', 'token')
+
+    def __init__(self, trace: 'Trace', name: str, attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = None
+        self.start_ns = 0
+        self.end_ns = 0
+        self.error = None
+        self.token = None
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent is not None and parent.trace is self.trace else None
+        self.token = _current_span.set(self)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.perf_counter_ns()
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        try:
+            _current_span.reset(self.token)
+        except ValueError:
+            # Sortie dans un autre contexte (generateur de streaming): retour au parent
+            _current_span.set(self.trace.spans_by_id.get(self.parent_id))
+        self.trace.spans.append(self)
+        return False
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    """Spans d'une requete; la racine couvre toute la requete"""
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self.spans_by_id = {}
+        # Horloge murale pour l'export, durees mesurees en monotone
+        self.epoch_ns = time.time_ns()
+        self.origin_ns = time.perf_counter_ns()
+        self.root = Span(self, name, attributes)
+        self.spans_by_id[self.root.span_id] = self.root
+
+    def span(self, name: str, attributes: Dict[str, Any]) -> Span:
+        span = Span(self, name, attributes)
+        self.spans_by_id[span.span_id] = span
+        return span
+
+    def timings(self) -> Dict[str, float]:
+        """Duree (ms) par etape, cumulee si une etape se repete; 'total' = racine (en cours ou non)"""
+        timings = {}
+        for span in self.spans:
+            if span is not self.root:
+                timings[span.name] = round(timings.get(span.name, 0.0) + span.duration_ms, 3)
+        end_ns = self.root.end_ns or time.perf_counter_ns()
+        timings['total'] = round((end_ns - self.root.start_ns) / 1e6, 3)
+        return timings
+
+    def to_otlp(self, service_name: str) -> Dict[str, Any]:
+        """Trace au format OTLP/JSON (ExportTraceServiceRequest)"""
+        spans = []
+        for span in self.spans:
+            otlp_span = {
+                'traceId': self.trace_id,
+                'spanId': span.span_id,
+                'name': span.name,
+                'kind': 1,
+                'startTimeUnixNano': str(self.epoch_ns + span.start_ns - self.origin_ns),
+                'endTimeUnixNano': str(self.epoch_ns + span.end_ns - self.origin_ns),
+                'attributes': [_otlp_attribute(key, value) for key, value in span.attributes.items()],
+                'status': {'code': 2, 'message': span.error} if span.error else {}
+            }
+            if span.parent_id:
+                otlp_span['parentSpanId'] = span.parent_id
+            spans.append(otlp_span)
+        return {
+            'resourceSpans': [{
+                'resource': {'attributes': [_otlp_attribute('service.name', service_name)]},
+                'scopeSpans': [{'scope': {'name': 'rag.tracing'}, 'spans': spans}]
+            }]
+        }
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+def span(name: str, **attributes) -> Any:
+    """Span dans la trace en cours (no-op partage si aucune trace n'est active)"""
+    trace = _current_trace.get()
+    if trace is None or trace.root.end_ns:
+        # Aucune trace, ou trace deja terminee (generateur de streaming abandonne)
+        return NOOP_SPAN
+    return trace.span(name, attributes)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+class OTLPFileExporter:
+    """Ajoute chaque trace terminee (une ligne OTLP/JSON) a un fichier local"""
+
+    def __init__(self, path: Path, service_name: str = 'rag-seance5'):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.service_name = service_name
+        self.lock = threading.Lock()
+        self.exported = 0
+        self.errors = 0
+
+    def export(self, trace: Trace):
+        line = json.dumps(trace.to_otlp(self.service_name), ensure_ascii=False, separators=(',', ':'))
+        try:
+            with self.lock:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+                self.exported += 1
+        except OSError as e:
+            self.errors += 1
+            print(f"[WARNING] Export de trace impossible ({self.path}): {e}")
+
+
+class _TraceScope:
+    """Context manager d'une trace racine: active la trace, la termine et l'exporte"""
+
+    __slots__ = ('tracer', 'trace', 'token')
+
+    def __init__(self, tracer: 'Tracer', trace: Trace):
+        self.tracer = tracer
+        self.trace = trace
+        self.token = None
+
+    def __enter__(self) -> Trace:
+        self.token = _current_trace.set(self.trace)
+        self.trace.root.__enter__()
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.root.__exit__(exc_type, exc, tb)
+        try:
+            _current_trace.reset(self.token)
+        except ValueError:
+            # Generateur termine dans un autre contexte (streaming): simple desactivation
+            _current_trace.set(None)
+        if self.tracer.exporter is not None:
+            self.tracer.exporter.export(self.trace)
+        return False
+
+
+class _NestedScope:
+    """Trace demandee a l'interieur d'une autre: span de la trace englobante"""
+
+    __slots__ = ('trace', 'span')
+
+    def __init__(self, trace: Trace, span: Span):
+        self.trace = trace
+        self.span = span
+
+    def __enter__(self) -> Trace:
+        self.span.__enter__()
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        return self.span.__exit__(exc_type, exc, tb)
+
+
+class _NoopScope:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SCOPE = _NoopScope()
+
+
+class Tracer:
+    """Point d'entree des traces (RAG_TRACING, RAG_TRACE_FILE).
+
+    Desactive, `trace()` et `span()` renvoient des objets no-op partages: aucun
+    chronometrage ni allocation par etape.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, enabled: bool = True, exporter: Optional[OTLPFileExporter] = None):
+        self.enabled = enabled
+        self.exporter = exporter if enabled else None
+
+    @classmethod
+    def from_env(cls) -> 'Tracer':
+        enabled = os.getenv('RAG_TRACING', 'true').lower() in ('1', 'true', 'yes')
+        trace_file = os.getenv('RAG_TRACE_FILE', '')
+        exporter = OTLPFileExporter(Path(trace_file), os.getenv('RAG_TRACE_SERVICE_NAME', 'rag-seance5')) \
+            if trace_file else None
+        return cls(enabled=enabled, exporter=exporter)
+
+    @classmethod
+    def shared(cls) -> 'Tracer':
+        """Tracer unique du processus"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls.from_env()
+            return cls._shared
+
+    def trace(self, name: str, **attributes):
+        """Trace racine; a l'interieur, les appels a `span()` y sont rattaches.
+        Appelee dans une trace deja active, devient un span de celle-ci"""
+        if not self.enabled:
+            return NOOP_SCOPE
+        active = _current_trace.get()
+        if active is not None and not active.root.end_ns:
+            return _NestedScope(active, active.span(name, attributes))
+        return _TraceScope(self, Trace(name, attributes))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'trace_file': str(self.exporter.path) if self.exporter else None,
+            'exported_traces': self.exporter.exported if self.exporter else 0,
+            'export_errors': self.exporter.errors if self.exporter else 0
+        }
+
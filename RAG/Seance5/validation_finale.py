@@ -6,24 +6,27 @@ Teste toutes les fonctionnalites cles avec tout type de corpus
 
 import sys
 import os
-from rag_chain import GenericRAGChain
 import time
 
+# Questions generiques adaptees a tout corpus (reprises par benchmark_rag.py --corpus repo)
+QUESTIONS_GENERIQUES = [
+    "Quelles sont les principales fonctionnalites disponibles ?",
+    "Comment puis-je commencer ?",
+    "Quels sont les concepts importants a comprendre ?",
+    "Y a-t-il des procedures specifiques a suivre ?",
+    "Comment puis-je trouver des informations specifiques ?",
+    "Quels sont les differents types de documentation disponibles ?",
+    "Comment utiliser ce systeme efficacement ?",
+    "Que puis-je faire avec ces fonctionnalites ?",
+    "Comment resoudre des problemes courants ?",
+    "Ou puis-je obtenir plus d'aide ?"
+]
+
 def test_generic_questions():
     """Test avec questions generiques adaptees a tout corpus"""
+    from rag_chain import PostgreSQLRAGSystem
     
-    questions_tests = [
-        "Quelles sont les principales fonctionnalites disponibles ?",
-        "Comment puis-je commencer ?",
-        "Quels sont les concepts importants a comprendre ?",
-        "Y a-t-il des procedures specifiques a suivre ?",
-        "Comment puis-je trouver des informations specifiques ?",
-        "Quels sont les differents types de documentation disponibles ?",
-        "Comment utiliser ce systeme efficacement ?",
-        "Que puis-je faire avec ces fonctionnalites ?",
-        "Comment resoudre des problemes courants ?",
-        "Ou puis-je obtenir plus d'aide ?"
-    ]
+    questions_tests = QUESTIONS_GENERIQUES
     
     print("="*80)
     print("[TEST] VALIDATION FINALE - SYSTEME RAG GENERIQUE")
@@ -32,7 +35,7 @@ def test_generic_questions():
     # Initialisation
     print("[INIT] Initialisation du systeme RAG...")
     start_init = time.time()
-    rag = GenericRAGChain()
+    rag = PostgreSQLRAGSystem()
     end_init = time.time()
     print(f"   [OK] Initialise en {end_init - start_init:.2f}s")
     
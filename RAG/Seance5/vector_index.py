@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Gestion de l'index ANN (HNSW / IVFFlat) de la collection pgvector - Seance 5
+Creation, reconstruction, reglage des requetes et rapport taille / temps / rappel.
+L'index est partiel (WHERE collection_id = ...): la table langchain_pg_embedding est
+partagee par toutes les collections, chacune a son propre index.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import hashlib
+import argparse
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import psycopg2
+
+EMBEDDING_TABLE = "langchain_pg_embedding"
+COLLECTION_TABLE = "langchain_pg_collection"
+
+OPERATOR_CLASSES = {
+    'cosine': ('vector_cosine_ops', '<=>'),
+    'l2': ('vector_l2_ops', '<->'),
+    'inner': ('vector_ip_ops', '<#>')
+}
+
+
+def collection_predicate(collection_id, alias: str = '') -> str:
+    """Filtre `collection_id = '<uuid>'` en litteral: le planificateur ne choisit l'index
+    partiel d'une collection que s'il peut prouver ce predicat a la planification"""
+    column = f"{alias}.collection_id" if alias else "collection_id"
+    return f"{column} = '{uuid.UUID(str(collection_id))}'"
+
+
+class VectorIndexConfig:
+    """Parametres de l'index lus depuis .env"""
+
+    def __init__(self, index_type: str = 'hnsw', m: int = 16, ef_construction: int = 64,
+                 lists: int = 0, ef_search: int = 40, probes: int = 10,
+                 dimension: int = 384, distance: str = 'cosine'):
+        if index_type not in ('hnsw', 'ivfflat', 'none'):
+            raise ValueError(f"Type d'index inconnu: {index_type} (hnsw, ivfflat ou none)")
+        self.index_type = index_type
+        self.m = m
+        self.ef_construction = ef_construction
+        self.lists = lists  # 0 = automatique selon le nombre de lignes
+        self.ef_search = ef_search
+        self.probes = probes
+        self.dimension = dimension
+        self.distance = distance
+
+    @classmethod
+    def from_env(cls, distance: str = 'cosine') -> 'VectorIndexConfig':
+        return cls(
+            index_type=os.getenv('RAG_VECTOR_INDEX', 'hnsw').lower(),
+            m=int(os.getenv('RAG_HNSW_M', '16')),
+            ef_construction=int(os.getenv('RAG_HNSW_EF_CONSTRUCTION', '64')),
+            lists=int(os.getenv('RAG_IVFFLAT_LISTS', '0')),
+            ef_search=int(os.getenv('RAG_HNSW_EF_SEARCH', '40')),
+            probes=int(os.getenv('RAG_IVFFLAT_PROBES', '10')),
+            dimension=int(os.getenv('RAG_EMBEDDING_DIM', '384')),
+            distance=distance
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.index_type != 'none'
+
+    def index_name(self, collection_name: str) -> str:
+        """Nom de l'index partiel d'une collection (<= 63 caracteres)"""
+        digest = hashlib.sha1(collection_name.encode('utf-8')).hexdigest()[:10]
+        return f"{EMBEDDING_TABLE}_{self.index_type}_{digest}_idx"
+
+    def build_params(self, row_count: int) -> Dict[str, int]:
+        if self.index_type == 'hnsw':
+            return {'m': self.m, 'ef_construction': self.ef_construction}
+        lists = self.lists
+        if not lists:
+            # Recommandation pgvector: lignes/1000 jusqu'a 1M, puis sqrt(lignes)
+            lists = max(1, row_count // 1000) if row_count <= 1000000 else int(row_count ** 0.5)
+        return {'lists': lists}
+
+    def search_settings(self) -> List[str]:
+        """Parametres de session appliques a chaque connexion de recherche"""
+        if self.index_type == 'hnsw':
+            return [f"SET hnsw.ef_search = {int(self.ef_search)}"]
+        if self.index_type == 'ivfflat':
+            return [f"SET ivfflat.probes = {int(self.probes)}"]
+        return []
+
+
+class PGVectorIndexManager:
+    """Creer, reconstruire et evaluer l'index vectoriel de langchain_pg_embedding"""
+
+    def __init__(self, db_params: Dict[str, Any], collection_name: str,
+                 config: VectorIndexConfig, state_path: Path, pool=None):
+        self.db_params = db_params
+        self.collection_name = collection_name
+        self.config = config
+        self.state_path = Path(state_path)
+        self.pool = pool
+
+    def _connect(self):
+        if self.pool is not None:
+            return self.pool.raw_connection()
+        return psycopg2.connect(**self.db_params)
+
+    def _load_state(self) -> Dict[str, Any]:
+        if self.state_path.exists():
+            try:
+                with open(self.state_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception:
+                pass
+        return {}
+
+    def _save_state(self, state: Dict[str, Any]):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.state_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2)
+
+    @property
+    def index_name(self) -> str:
+        return self.config.index_name(self.collection_name)
+
+    def _existing_indexes(self, cursor) -> List[str]:
+        """Index de cette collection (HNSW ou IVFFlat), plus les anciens index sur toute la table"""
+        candidates = [VectorIndexConfig(index_type).index_name(self.collection_name)
+                      for index_type in ('hnsw', 'ivfflat')]
+        candidates += [f"{EMBEDDING_TABLE}_{index_type}_idx" for index_type in ('hnsw', 'ivfflat')]
+        cursor.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = %s AND indexname = ANY(%s)",
+            (EMBEDDING_TABLE, candidates)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def _ensure_typed_column(self, cursor):
+        """Les index pgvector exigent une colonne de dimension fixe (vector(384)). La table est
+        partagee par toutes les collections: elle n'est jamais retypee ici"""
+        cursor.execute(
+            "SELECT atttypmod FROM pg_attribute "
+            "WHERE attrelid = %s::regclass AND attname = 'embedding'",
+            (EMBEDDING_TABLE,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            raise ValueError(f"Colonne embedding absente de {EMBEDDING_TABLE}")
+        if row[0] == -1:
+            raise ValueError(
+                f"Colonne {EMBEDDING_TABLE}.embedding sans dimension: index ANN impossible. "
+                f"Si toutes les collections ont des vecteurs de dimension {self.config.dimension}, "
+                f"typer la colonne manuellement (ALTER TABLE {EMBEDDING_TABLE} ALTER COLUMN embedding "
+                f"TYPE vector({self.config.dimension})), sinon RAG_VECTOR_INDEX=none"
+            )
+        if row[0] != self.config.dimension:
+            raise ValueError(
+                f"Colonne {EMBEDDING_TABLE}.embedding en vector({row[0]}), "
+                f"RAG_EMBEDDING_DIM={self.config.dimension}: index non construit"
+            )
+
+    def _collection_id(self, cursor) -> str:
+        cursor.execute(f"SELECT uuid FROM {COLLECTION_TABLE} WHERE name = %s", (self.collection_name,))
+        row = cursor.fetchone()
+        if row is None:
+            raise ValueError(f"Collection inconnue: {self.collection_name}")
+        return str(row[0])
+
+    def _row_count(self, cursor, collection_id: str) -> int:
+        """Lignes couvertes par l'index partiel (parametres IVFFlat calcules sur elles)"""
+        cursor.execute(
+            f"SELECT COUNT(*) FROM {EMBEDDING_TABLE} WHERE {collection_predicate(collection_id)}"
+        )
+        return cursor.fetchone()[0]
+
+    def ensure_index(self) -> Optional[Dict[str, Any]]:
+        """Creer l'index s'il manque ou si sa configuration a change"""
+        if not self.config.enabled:
+            return None
+
+        state = self._load_state()
+        conn = self._connect()
+        try:
+            with conn.cursor() as cursor:
+                existing = self._existing_indexes(cursor)
+                collection_id = self._collection_id(cursor)
+                row_count = self._row_count(cursor, collection_id)
+            conn.commit()
+        finally:
+            conn.close()
+
+        up_to_date = (
+            existing == [self.index_name]
+            and state.get('collection_id') == collection_id
+            and state.get('index_type') == self.config.index_type
+            and state.get('distance') == self.config.distance
+            and (
+                state.get('params') == self.config.build_params(row_count)
+                if self.config.index_type == 'hnsw'
+                # IVFFlat: centroides calcules a la construction, on reconstruit si la table a double
+                else row_count <= 2 * max(1, state.get('rows_at_build', 0))
+            )
+        )
+        if up_to_date:
+            return state
+        return self.rebuild()
+
+    def rebuild(self) -> Dict[str, Any]:
+        """(Re)construire l'index selon la configuration courante.
+
+        CREATE INDEX CONCURRENTLY sous un nom temporaire (les recherches continuent pendant
+        la construction), puis bascule en une courte transaction: ancien index supprime,
+        nouvel index renomme.
+        """
+        if not self.config.enabled:
+            raise ValueError("RAG_VECTOR_INDEX=none: aucun index a construire")
+
+        opclass, _ = OPERATOR_CLASSES[self.config.distance]
+        building_name = f"{self.index_name}_new"
+        conn = self._connect()
+        try:
+            # CONCURRENTLY est interdit dans une transaction
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                self._ensure_typed_column(cursor)
+                collection_id = self._collection_id(cursor)
+                row_count = self._row_count(cursor, collection_id)
+                params = self.config.build_params(row_count)
+                with_clause = ", ".join(f"{key} = {int(value)}" for key, value in params.items())
+
+                # Reste d'une construction interrompue (index INVALID)
+                cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {building_name}")
+                print(f"[INDEX] Construction {self.config.index_type.upper()} ({with_clause}) "
+                      f"sur {row_count} vecteurs (CONCURRENTLY)...")
+                start = time.monotonic()
+                cursor.execute(
+                    f"CREATE INDEX CONCURRENTLY {building_name} ON {EMBEDDING_TABLE} "
+                    f"USING {self.config.index_type} (embedding {opclass}) WITH ({with_clause}) "
+                    f"WHERE {collection_predicate(collection_id)}"
+                )
+                build_seconds = time.monotonic() - start
+            conn.autocommit = False
+
+            with conn.cursor() as cursor:
+                for index_name in self._existing_indexes(cursor):
+                    if index_name != building_name:
+                        cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+                cursor.execute(f"ALTER INDEX {building_name} RENAME TO {self.index_name}")
+            conn.commit()
+        except Exception:
+            if not conn.autocommit:
+                conn.rollback()
+            raise
+        finally:
+            conn.autocommit = False
+            conn.close()
+
+        state = {
+            'index_name': self.index_name,
+            'collection_id': collection_id,
+            'index_type': self.config.index_type,
+            'distance': self.config.distance,
+            'params': params,
+            'rows_at_build': row_count,
+            'build_seconds': round(build_seconds, 3),
+            'built_at': datetime.now().isoformat()
+        }
+        self._save_state(state)
+        print(f"[INDEX] {self.index_name} construit en {build_seconds:.2f}s")
+        return state
+
+    def apply_search_settings(self, store=None):
+        """Appliquer ef_search / probes a toutes les connexions du vector store PGVector"""
+        settings = self.config.search_settings()
+        if not settings:
+            return
+        if self.pool is not None:
+            # PGVector partage l'engine du pool: un seul point de reglage
+            self.pool.add_session_settings(settings)
+            return
+
+        engine = getattr(store, '_bind', None)
+        if engine is None:
+            return
+        engine = getattr(engine, 'engine', engine)
+
+        from sqlalchemy import event
+
+        def on_connect(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for statement in settings:
+                cursor.execute(statement)
+            cursor.close()
+            # SET dans une transaction annulee au retour dans le pool serait perdu
+            dbapi_connection.commit()
+
+        event.listen(engine, 'connect', on_connect)
+        # Les connexions deja ouvertes n'ont pas les reglages: on vide le pool
+        engine.dispose()
+
+    def report(self, sample_size: int = 50, k: int = 10) -> Dict[str, Any]:
+        """Taille, temps de construction et rappel@k de l'index face a la recherche exacte"""
+        state = self._load_state()
+        _, operator = OPERATOR_CLASSES[self.config.distance]
+        report = {
+            'collection': self.collection_name,
+            'index_type': self.config.index_type,
+            'build_params': state.get('params'),
+            'build_seconds': state.get('build_seconds'),
+            'built_at': state.get('built_at'),
+            'search_settings': self.config.search_settings()
+        }
+
+        conn = self._connect()
+        try:
+            with conn.cursor() as cursor:
+                collection_id = self._collection_id(cursor)
+                report['rows'] = self._row_count(cursor, collection_id)
+                existing = self._existing_indexes(cursor)
+                report['index_present'] = self.index_name in existing
+                if report['index_present']:
+                    cursor.execute("SELECT pg_relation_size(%s::regclass)", (self.index_name,))
+                    report['index_size_bytes'] = cursor.fetchone()[0]
+                cursor.execute("SELECT pg_total_relation_size(%s::regclass)", (EMBEDDING_TABLE,))
+                report['table_size_bytes'] = cursor.fetchone()[0]
+
+                cursor.execute(
+                    f"SELECT embedding::text FROM {EMBEDDING_TABLE} "
+                    f"WHERE {collection_predicate(collection_id)} ORDER BY random() LIMIT %s",
+                    (sample_size,)
+                )
+                queries = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+
+            # Meme forme que les recherches de l'application (index partiel utilisable)
+            search_sql = (
+                f"SELECT uuid FROM {EMBEDDING_TABLE} WHERE {collection_predicate(collection_id)} "
+                f"ORDER BY embedding {operator} %s::vector LIMIT %s"
+            )
+            recalls, exact_times, index_times = [], [], []
+            for query in queries:
+                with conn.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_indexscan = off")
+                    start = time.monotonic()
+                    cursor.execute(search_sql, (query, k))
+                    exact = {row[0] for row in cursor.fetchall()}
+                    exact_times.append(time.monotonic() - start)
+                conn.commit()
+
+                with conn.cursor() as cursor:
+                    for statement in self.config.search_settings():
+                        cursor.execute(statement.replace('SET ', 'SET LOCAL ', 1))
+                    start = time.monotonic()
+                    cursor.execute(search_sql, (query, k))
+                    approx = {row[0] for row in cursor.fetchall()}
+                    index_times.append(time.monotonic() - start)
+                conn.commit()
+
+                if exact:
+                    recalls.append(len(exact & approx) / len(exact))
+        finally:
+            conn.close()
+
+        report['sample_queries'] = len(recalls)
+        report[f'recall@{k}'] = round(sum(recalls) / len(recalls), 4) if recalls else None
+        report['exact_latency_ms'] = round(1000 * sum(exact_times) / len(exact_times), 2) if exact_times else None
+        report['index_latency_ms'] = round(1000 * sum(index_times) / len(index_times), 2) if index_times else None
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index ANN de la collection pgvector Seance 5")
+    parser.add_argument('command', choices=['report', 'create', 'rebuild'])
+    parser.add_argument('--collection', default='seance5_shared_corpus')
+    parser.add_argument('--sample', type=int, default=50, help="requetes echantillon pour le rappel")
+    parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    db_params = {
+        "host": os.getenv('DB_HOST', 'localhost'),
+        "port": os.getenv('DB_PORT', '5432'),
+        "database": os.getenv('DB_NAME'),
+        "user": os.getenv('DB_USER'),
+        "password": os.getenv('DB_PASSWORD')
+    }
+    index_dir = Path(os.getenv('RAG_INDEX_DIR', Path(__file__).parent / "index_data"))
+    from db_pool import DatabasePool
+    manager = PGVectorIndexManager(
+        db_params, args.collection, VectorIndexConfig.from_env(),
+        index_dir / f"{args.collection}_vector_index.json",
+        pool=DatabasePool(db_params, min_size=1, max_size=2)
+    )
+
+    if args.command == 'create':
+        print(json.dumps(manager.ensure_index(), indent=2))
+    elif args.command == 'rebuild':
+        print(json.dumps(manager.rebuild(), indent=2))
+    else:
+        report = manager.report(sample_size=args.sample, k=args.k)
+        print("=" * 60)
+        print(f"INDEX VECTORIEL - {report['collection']}")
+        print("=" * 60)
+        for key, value in report.items():
+            print(f"   {key}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())